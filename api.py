@@ -0,0 +1,188 @@
+"""Versioned JSON API for Warbler, under /api/v1.
+
+Mirrors the main read routes for clients that don't want HTML:
+
+- GET /api/v1/timeline: a page of the logged-in user's home timeline as
+  one JSON object, paged with the same `before`/`after` cursors as the
+  homepage.
+- GET /api/v1/users/<id>: a user's profile and counters.
+- GET /api/v1/users/<id>/messages, /following, /followers and /likes:
+  the whole collection as NDJSON, one JSON object per line.
+
+Collections are read through a server-side cursor (`yield_per`) and
+written out as they arrive, selecting only the columns that are sent, so
+memory stays flat however many rows there are. Access rules are the same
+as for the HTML pages; the API answers 401 and 404 with a JSON error
+instead of redirecting.
+"""
+
+import json
+from datetime import datetime
+
+from flask import (Blueprint, Response, abort, current_app, g, jsonify,
+                   request, stream_with_context)
+
+import write_behind
+from models import db, Follows, Likes, Message, TimelineEntry, User
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+USER_FIELDS = (User.id, User.username, User.image_url)
+
+MESSAGE_FIELDS = (Message.id, Message.text, Message.timestamp,
+                  Message.user_id)
+
+
+def to_json(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def stream(query):
+    """Respond with each row of a column query as a line of NDJSON."""
+
+    rows = query.yield_per(current_app.config['API_STREAM_BATCH'])
+
+    def lines():
+        for row in rows:
+            yield json.dumps(row._asdict(), default=to_json) + '\n'
+
+    return Response(stream_with_context(lines()),
+                    mimetype='application/x-ndjson')
+
+
+def require_user():
+    if not g.user:
+        abort(401)
+
+
+def require_exists(user_id):
+    if not db.session.query(User.id).filter(User.id == user_id).scalar():
+        abort(404)
+
+
+@api.errorhandler(400)
+@api.errorhandler(401)
+@api.errorhandler(404)
+def error(exc):
+    return jsonify(error=exc.description), exc.code
+
+
+@api.route('/timeline')
+def timeline():
+    """A page of the logged-in user's home timeline."""
+
+    require_user()
+
+    try:
+        page = TimelineEntry.page_for(
+            g.user,
+            limit=current_app.config['TIMELINE_PAGE_SIZE'],
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+        )
+    except ValueError:
+        abort(400)
+
+    message_ids = [msg.id for msg in page.items]
+    likes = Likes.summarize(message_ids, g.user.id)
+
+    if current_app.config['WRITE_BEHIND_ENABLED']:
+        likes = write_behind.likes_with_pending(g.user.id, likes, message_ids)
+
+    messages = [{
+        'id': msg.id,
+        'text': msg.text,
+        'timestamp': msg.timestamp.isoformat(),
+        'user': {'id': msg.user.id,
+                 'username': msg.user.username,
+                 'image_url': msg.user.image_url},
+        'likes': likes.counts.get(msg.id, 0),
+        'liked': msg.id in likes.liked,
+    } for msg in page.items]
+
+    return jsonify(messages=messages, newer=page.newer, older=page.older)
+
+
+@api.route('/users/<int:user_id>')
+def user_show(user_id):
+    """A user's profile."""
+
+    user = (db.session
+            .query(*USER_FIELDS, User.header_image_url, User.bio,
+                   User.location, User.messages_count, User.following_count,
+                   User.followers_count, User.likes_count)
+            .filter(User.id == user_id)
+            .first())
+
+    if user is None:
+        abort(404)
+
+    return jsonify(user._asdict())
+
+
+@api.route('/users/<int:user_id>/messages')
+def user_messages(user_id):
+    """Every message by a user, newest first."""
+
+    require_exists(user_id)
+
+    return stream(db.session
+                  .query(*MESSAGE_FIELDS)
+                  .filter(Message.user_id == user_id)
+                  .order_by(Message.timestamp.desc(), Message.id.desc()))
+
+
+@api.route('/users/<int:user_id>/following')
+def user_following(user_id):
+    """Everyone a user follows."""
+
+    require_user()
+    require_exists(user_id)
+
+    return stream(db.session
+                  .query(*USER_FIELDS)
+                  .join(Follows, Follows.user_being_followed_id == User.id)
+                  .filter(Follows.user_following_id == user_id)
+                  .order_by(User.id))
+
+
+@api.route('/users/<int:user_id>/followers')
+def user_followers(user_id):
+    """Everyone following a user."""
+
+    require_user()
+    require_exists(user_id)
+
+    return stream(db.session
+                  .query(*USER_FIELDS)
+                  .join(Follows, Follows.user_following_id == User.id)
+                  .filter(Follows.user_being_followed_id == user_id)
+                  .order_by(User.id))
+
+
+@api.route('/users/<int:user_id>/likes')
+def user_likes(user_id):
+    """Every message a user likes, most recently liked first."""
+
+    require_user()
+    require_exists(user_id)
+
+    return stream(db.session
+                  .query(*MESSAGE_FIELDS, User.username)
+                  .join(Likes, Likes.message_id == Message.id)
+                  .join(User, User.id == Message.user_id)
+                  .filter(Likes.user_id == user_id)
+                  .order_by(Likes.id.desc()))
+
+
+def init_app(app):
+    """Serve the JSON API under /api/v1.
+
+    You should call this in your Flask app.
+    """
+
+    app.config.setdefault('API_STREAM_BATCH', 1000)
+    app.register_blueprint(api)
@@ -1,13 +1,35 @@
 import os
+import time
+from collections import namedtuple
+from datetime import datetime
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import Flask, render_template, request, flash, redirect, session, g, abort
+from flask.ctx import _AppCtxGlobals
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, User, Message, Likes
+import api
+import conditional
+import fragments
+import instrumentation
+import metrics
+import migrations
+import passwords
+import profiling
+import recommendations
+import replicas
+import write_behind
+from models import (db, connect_db, loading, User, Message, Follows, Likes,
+                    TimelineEntry, TrendingMessage, Suggestion)
+from passwords import PasswordQueueFull
+from search import search_users, install_search_indexes
 
 CURR_USER_KEY = "curr_user"
+CURR_USER_NAV_KEY = "curr_user_nav"
+VIEWER_SINCE_KEY = "viewer_since"
+
+NavUser = namedtuple('NavUser', ['id', 'username', 'image_url'])
 
 app = Flask(__name__)
 
@@ -17,33 +39,176 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgres:///warbler'))
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Optional read replicas: a comma-separated DATABASE_REPLICA_URLS. GET
+# requests read from one of them, except for DB_PRIMARY_STICKY_SECONDS
+# after the user's own writes (see replicas.py).
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica{n}': url for n, url in enumerate(
+        url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+        if url)
+}
+app.config['SQLALCHEMY_READ_REPLICAS'] = list(app.config['SQLALCHEMY_BINDS'])
+app.config['DB_PRIMARY_STICKY_SECONDS'] = int(
+    os.environ.get('DB_PRIMARY_STICKY_SECONDS', 5))
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+
+# Keep id, username and image_url of the logged-in user in the (signed)
+# session cookie so the nav bar can render without querying for them.
+app.config['SESSION_NAV_SNAPSHOT'] = True
+
+# Authors with more followers than this are not fanned out to follower
+# timelines on write; their messages are merged in when timelines are read.
+app.config['TIMELINE_PUSH_MAX_FOLLOWERS'] = int(
+    os.environ.get('TIMELINE_PUSH_MAX_FOLLOWERS', 5000))
+app.config['TIMELINE_MAX_ENTRIES'] = int(
+    os.environ.get('TIMELINE_MAX_ENTRIES', 800))
+app.config['TIMELINE_PAGE_SIZE'] = int(
+    os.environ.get('TIMELINE_PAGE_SIZE', 100))
+app.config['USER_SEARCH_PAGE_SIZE'] = int(
+    os.environ.get('USER_SEARCH_PAGE_SIZE', 24))
+# Users or messages per page of the followers/following/likes/users lists.
+app.config['LIST_PAGE_SIZE'] = int(os.environ.get('LIST_PAGE_SIZE', 48))
+
+# Page queries load the relationships their templates read (see
+# models.LOADING_PROFILES). With LOADING_STRICT on, as in the tests, any
+# other lazy load raises instead of quietly running a query per row.
+app.config['LOADING_STRICT'] = os.environ.get('LOADING_STRICT', '') == '1'
+
+# Password hashing runs on a bounded pool; set BCRYPT_TARGET_MS to pick
+# the bcrypt cost by timing this host at startup instead of using
+# BCRYPT_LOG_ROUNDS.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_TARGET_MS'] = int(os.environ.get('BCRYPT_TARGET_MS', 0))
+app.config['PASSWORD_WORKERS'] = int(os.environ.get('PASSWORD_WORKERS', 4))
+app.config['PASSWORD_MAX_PENDING'] = int(
+    os.environ.get('PASSWORD_MAX_PENDING', 32))
+
+# Rendered profile headers, message lists and messages are cached per
+# process; writes invalidate them, and FRAGMENT_CACHE_TTL bounds staleness
+# across processes.
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_SIZE', 5000))
+app.config['FRAGMENT_CACHE_TTL'] = int(
+    os.environ.get('FRAGMENT_CACHE_TTL', 300))
+
+# Opt-in profiling (see profiling.py): cProfile a fraction of requests,
+# and/or keep stack samples of requests slower than PROFILE_SLOW_MS.
+# Admins can download the profiles from /admin/profiles.
+app.config['PROFILE_SAMPLE_RATE'] = float(
+    os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_SLOW_MS'] = int(os.environ.get('PROFILE_SLOW_MS', 0))
+app.config['PROFILE_SAMPLE_INTERVAL_MS'] = int(
+    os.environ.get('PROFILE_SAMPLE_INTERVAL_MS', 5))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR')
+app.config['PROFILE_KEEP'] = int(os.environ.get('PROFILE_KEEP', 50))
+# Ids, not usernames: users pick (and can change) their usernames.
+app.config['ADMIN_USER_IDS'] = [
+    int(user_id)
+    for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id]
+
+# Optional write-behind for follow and like toggles (see write_behind.py):
+# queued locally and applied in batches every WRITE_BEHIND_INTERVAL seconds.
+app.config['WRITE_BEHIND_ENABLED'] = (
+    os.environ.get('WRITE_BEHIND_ENABLED', '') == '1')
+app.config['WRITE_BEHIND_PATH'] = os.environ.get('WRITE_BEHIND_PATH')
+app.config['WRITE_BEHIND_INTERVAL'] = float(
+    os.environ.get('WRITE_BEHIND_INTERVAL', 1))
+app.config['WRITE_BEHIND_BATCH'] = int(
+    os.environ.get('WRITE_BEHIND_BATCH', 500))
+
+# Trending page: likes lose half their weight every TRENDING_HALF_LIFE_HOURS,
+# and only messages from the last TRENDING_WINDOW_HOURS are ranked.
+app.config['TRENDING_HALF_LIFE_HOURS'] = float(
+    os.environ.get('TRENDING_HALF_LIFE_HOURS', 6))
+app.config['TRENDING_WINDOW_HOURS'] = float(
+    os.environ.get('TRENDING_WINDOW_HOURS', 48))
+app.config['TRENDING_PAGE_SIZE'] = int(os.environ.get('TRENDING_PAGE_SIZE', 50))
+
+# "Who to follow": suggestions kept per user by `flask suggest-follows`, and
+# how many the homepage shows.
+app.config['SUGGESTIONS_TOP_K'] = int(os.environ.get('SUGGESTIONS_TOP_K', 20))
+app.config['SUGGESTIONS_SHOWN'] = int(os.environ.get('SUGGESTIONS_SHOWN', 5))
+
+# Rows fetched per round trip when the JSON API streams a collection.
+app.config['API_STREAM_BATCH'] = int(os.environ.get('API_STREAM_BATCH', 1000))
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+passwords.init_app(app)
+fragments.init_app(app)
+conditional.init_app(app)
+instrumentation.init_app(app)
+profiling.init_app(app)
+metrics.init_app(app)
+replicas.init_app(app)
+write_behind.init_app(app)
+api.init_app(app)
+migrations.init_app(app)
+recommendations.init_app(app)
+metrics.register_cache('fragments', fragments.cache)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+class WarblerGlobals(_AppCtxGlobals):
+    """Flask globals that load the logged-in user only when it's used.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    `g.user` is fetched from the database on first access and cached for
+    the rest of the request, so requests that never look at it (static
+    files, anonymous pages) skip the users-table lookup entirely.
+
+    `g.nav_user` is the small snapshot of the user that the nav bar needs,
+    read from the signed session cookie when SESSION_NAV_SNAPSHOT is on.
+    It falls back to `g.user` when there's no snapshot for this user.
+    """
+
+    @property
+    def user(self):
+        if '_user' not in self.__dict__:
+            user_id = session.get(CURR_USER_KEY)
+            self._user = User.query.get(user_id) if user_id else None
+
+        return self._user
+
+    @user.setter
+    def user(self, user):
+        self._user = user
+
+    @property
+    def nav_user(self):
+        snapshot = session.get(CURR_USER_NAV_KEY)
+
+        if (app.config['SESSION_NAV_SNAPSHOT'] and snapshot
+                and snapshot.get('id') == session.get(CURR_USER_KEY)):
+            return NavUser(**snapshot)
+
+        return self.user
+
+
+app.app_ctx_globals_class = WarblerGlobals
 
-    else:
-        g.user = None
+
+def remember_nav_user(user):
+    """Store the fields the nav bar needs in the session."""
+
+    if app.config['SESSION_NAV_SNAPSHOT']:
+        session[CURR_USER_NAV_KEY] = NavUser(
+            id=user.id,
+            username=user.username,
+            image_url=user.image_url,
+        )._asdict()
 
 
 def do_login(user):
     """Log in user."""
 
     session[CURR_USER_KEY] = user.id
+    remember_nav_user(user)
 
 def do_logout():
     """Logout user."""
@@ -51,6 +216,93 @@ def do_logout():
     if CURR_USER_KEY in session:
         del session[CURR_USER_KEY]
 
+    session.pop(CURR_USER_NAV_KEY, None)
+
+
+def viewer_version():
+    """What about the logged-in user shows up in page chrome.
+
+    Part of the validators of cacheable pages, so logging in or out,
+    editing one's own profile, or queueing a follow or like changes them.
+    """
+
+    user_id = session.get(CURR_USER_KEY)
+    pending = 0
+
+    if user_id and app.config['WRITE_BEHIND_ENABLED']:
+        pending = write_behind.queue.latest(user_id)
+
+    return (user_id, session.get(CURR_USER_NAV_KEY), pending)
+
+
+def viewer_changed_at(viewer):
+    """When this session's `viewer_version()` last changed, for Last-Modified.
+
+    If-Modified-Since can't see who is looking, so pages send the later of
+    their data's timestamp and this one. The time a new viewer version is
+    first seen is kept in the session. It is rounded up to the next second,
+    since HTTP dates have no fractions, and kept past the previous one, so
+    two changes within a second still differ. First-time anonymous
+    visitors get datetime.min and no session cookie.
+    """
+
+    tag = conditional.version_tag(*viewer)
+    seen = session.get(VIEWER_SINCE_KEY)
+
+    if seen is None and viewer[0] is None:
+        return datetime.min
+
+    if seen is None or seen[0] != tag:
+        since = int(time.time()) + 1
+        if seen is not None:
+            since = max(since, seen[1] + 1)
+        seen = session[VIEWER_SINCE_KEY] = [tag, since]
+
+    return datetime.utcfromtimestamp(seen[1])
+
+
+def viewer_following(user_ids):
+    """Which of `user_ids` the logged-in user follows, in one query."""
+
+    if not g.user:
+        return set()
+
+    following = g.user.following_among(user_ids)
+
+    if app.config['WRITE_BEHIND_ENABLED']:
+        following = write_behind.with_pending(
+            g.user.id, write_behind.FOLLOW, following, set(user_ids))
+
+    return following
+
+
+def viewer_likes(message_ids):
+    """Like counts for `message_ids`, and which the logged-in user likes.
+
+    Includes the user's own likes still queued by write-behind.
+    """
+
+    likes = Likes.summarize(message_ids, g.user.id)
+
+    if app.config['WRITE_BEHIND_ENABLED']:
+        likes = write_behind.likes_with_pending(g.user.id, likes, message_ids)
+
+    return likes
+
+
+def page_or_400(fetch):
+    """Call `fetch(limit, before, after)` with this request's page cursors.
+
+    Aborts with 400 if a cursor is malformed.
+    """
+
+    try:
+        return fetch(app.config['LIST_PAGE_SIZE'],
+                     before=request.args.get('before'),
+                     after=request.args.get('after'))
+    except ValueError:
+        abort(400)
+
 
 @app.route('/signup', methods=["GET", "POST"])
 def signup():
@@ -79,6 +331,10 @@ def signup():
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        except PasswordQueueFull:
+            flash("We're very busy right now. Please try again.", 'danger')
+            return render_template('users/signup.html', form=form), 503
+
         do_login(user)
 
         return redirect("/")
@@ -94,10 +350,16 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
-        user = User.authenticate(form.username.data,
-                                 form.password.data)
+        try:
+            user = User.authenticate(form.username.data,
+                                     form.password.data)
+        except PasswordQueueFull:
+            flash("We're very busy right now. Please try again.", 'danger')
+            return render_template('users/login.html', form=form), 503
 
         if user:
+            # Keep a hash upgraded to the current bcrypt cost
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -112,7 +374,7 @@ def logout():
     """Handle logout of user."""
 
     if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+        do_logout()
         return redirect('/')
 
     return redirect('/login')
@@ -125,34 +387,55 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username (and
+    bio/location where full-text search is available), and a 'page' param
+    to page through the results. Without a search, lists every user by
+    descending id, paged with 'before' and 'after' cursors.
     """
 
     search = request.args.get('q')
+    results = None
+    page = None
 
     if not search:
-        users = User.query.all()
+        page = page_or_400(User.page_all)
+        users = page.items
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        results = search_users(search,
+                               page=request.args.get('page', 1, type=int),
+                               per_page=app.config['USER_SEARCH_PAGE_SIZE'])
+        users = results.users
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users, search=search,
+                           results=results, page=page,
+                           following_ids=viewer_following(
+                               user.id for user in users))
 
 
 @app.route('/users/<int:user_id>')
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = User.query.options(*loading('profile')).get_or_404(user_id)
+
+    viewer = viewer_version()
+    cached = conditional.not_modified(
+        'users_show', user.id, user.updated_at, viewer,
+        last_modified=max(user.updated_at, viewer_changed_at(viewer)))
+    if cached:
+        return cached
 
     # snagging messages in order from the database;
-    # user.messages won't be in order by default
+    # user.messages won't be in order by default. The query only runs if
+    # the rendered message list isn't already cached.
     messages = (Message
                 .query
+                .options(*loading('own_messages'))
                 .filter(Message.user_id == user_id)
                 .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+                .limit(100))
+    return render_template('users/show.html', user=user, messages=messages,
+                           following_ids=viewer_following([user.id]))
 
 
 @app.route('/users/<int:user_id>/following')
@@ -163,8 +446,13 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = User.query.options(*loading('profile')).get_or_404(user_id)
+    page = page_or_400(user.following_page)
+    following_ids = viewer_following(
+        [followed.id for followed in page.items] + [user.id])
+
+    return render_template('users/following.html', user=user, page=page,
+                           following_ids=following_ids)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -175,8 +463,13 @@ def users_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = User.query.options(*loading('profile')).get_or_404(user_id)
+    page = page_or_400(user.followers_page)
+    following_ids = viewer_following(
+        [follower.id for follower in page.items] + [user.id])
+
+    return render_template('users/followers.html', user=user, page=page,
+                           following_ids=following_ids)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -188,8 +481,17 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind.record(app, g.user.id, write_behind.FOLLOW,
+                            followed_user.id, True)
+        return redirect(f"/users/{g.user.id}/following")
+
+    if Follows.add(g.user.id, follow_id):
+        db.session.commit()
+
+        fragments.cache.invalidate(f'profile:{g.user.id}',
+                                   f'profile:{follow_id}')
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -202,9 +504,16 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind.record(app, g.user.id, write_behind.FOLLOW,
+                            follow_id, False)
+        return redirect(f"/users/{g.user.id}/following")
+
+    if Follows.remove(g.user.id, follow_id):
+        db.session.commit()
+
+        fragments.cache.invalidate(f'profile:{g.user.id}',
+                                   f'profile:{follow_id}')
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -222,8 +531,12 @@ def profile():
     form = EditUserForm(obj=user)
 
     if form.validate_on_submit():
-        user = User.authenticate(user.username,
-                                 form.password.data)
+        try:
+            user = User.authenticate(user.username,
+                                     form.password.data)
+        except PasswordQueueFull:
+            flash("We're very busy right now. Please try again.", 'danger')
+            return render_template('/users/edit.html', form=form), 503
 
         if user:
             user.username = form.username.data
@@ -232,6 +545,10 @@ def profile():
             user.header_image_url = form.header_image_url.data
             user.bio = form.bio.data
             db.session.commit()
+            remember_nav_user(user)
+            fragments.cache.invalidate(f'profile:{user.id}',
+                                       f'messages:{user.id}',
+                                       f'author:{user.id}')
             flash("User information updated!", "success")
             return redirect(f"/users/{g.user.id}")
 
@@ -248,9 +565,15 @@ def add_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    new_like = Likes(user_id=g.user.id, message_id=message_id)
-    db.session.add(new_like)
-    db.session.commit()
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind.record(app, g.user.id, write_behind.LIKE,
+                            message_id, True)
+        return redirect('/')
+
+    if Likes.add(g.user.id, message_id):
+        db.session.commit()
+
+        fragments.cache.invalidate(f'profile:{g.user.id}')
 
     return redirect('/')
 
@@ -261,9 +584,15 @@ def remove_like(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
     
-    like = Likes.query.filter_by(message_id=message_id).first()
-    db.session.delete(like)
-    db.session.commit()
+    if app.config['WRITE_BEHIND_ENABLED']:
+        write_behind.record(app, g.user.id, write_behind.LIKE,
+                            message_id, False)
+        return redirect('/')
+
+    if Likes.remove(g.user.id, message_id):
+        db.session.commit()
+
+        fragments.cache.invalidate(f'profile:{g.user.id}')
 
     return redirect('/')
 
@@ -274,10 +603,12 @@ def show_likes(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    liked_messages = user.likes
+    user = User.query.options(*loading('profile')).get_or_404(user_id)
+    page = page_or_400(user.likes_page)
 
-    return render_template('/users/likes.html', user=user, liked_messages=liked_messages)
+    return render_template('/users/likes.html', user=user, page=page,
+                           liked_messages=page.items,
+                           following_ids=viewer_following([user.id]))
     
 
 @app.route('/users/delete', methods=["POST"])
@@ -290,9 +621,14 @@ def delete_user():
 
     do_logout()
 
+    g.user.release_counts()
     db.session.delete(g.user)
     db.session.commit()
 
+    # Followers' and followed users' counts changed too; this is rare
+    # enough to simply start over.
+    fragments.cache.clear()
+
     return redirect("/signup")
 
 
@@ -313,10 +649,16 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        User.bump_counts(g.user.id, messages=1)
+        TimelineEntry.fan_out(msg)
         db.session.commit()
 
+        fragments.cache.invalidate(f'profile:{g.user.id}',
+                                   f'messages:{g.user.id}')
+
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
@@ -326,8 +668,20 @@ def messages_add():
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message.query
+           .options(*loading('messages_with_authors'))
+           .get_or_404(message_id))
+
+    author_updated_at = msg.user.updated_at
+    viewer = viewer_version()
+    cached = conditional.not_modified(
+        'messages_show', msg.id, author_updated_at, viewer,
+        last_modified=max(author_updated_at, viewer_changed_at(viewer)))
+    if cached:
+        return cached
+
+    return render_template('messages/show.html', message=msg,
+                           following_ids=viewer_following([msg.user_id]))
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -344,12 +698,32 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    TimelineEntry.retract(msg)
+    msg.release_counts()
     db.session.delete(msg)
+    User.bump_counts(g.user.id, messages=-1)
     db.session.commit()
 
+    fragments.cache.invalidate(f'profile:{g.user.id}',
+                               f'messages:{g.user.id}',
+                               f'message:{message_id}')
+
     return redirect(f"/users/{g.user.id}")
 
 
+@app.route('/trending')
+def trending():
+    """Show the messages with the fastest recent like velocity.
+
+    Ranked by `flask refresh-trending`; the page itself is a single
+    indexed read of the trending table.
+    """
+
+    messages = TrendingMessage.top(app.config['TRENDING_PAGE_SIZE'])
+
+    return render_template('messages/trending.html', messages=messages)
+
+
 ##############################################################################
 # Homepage and error pages
 
@@ -359,33 +733,114 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: most recent messages of followed_users, a page at a time,
+      and suggested accounts to follow. Takes 'before' or 'after' cursors
+      in the querystring to load older or newer messages.
     """
 
     if g.user:
-        messages = g.user.get_following_messages()
-        messages = messages[:100]
-        likes = g.user.get_likes()
+        try:
+            page = TimelineEntry.page_for(
+                g.user,
+                limit=app.config['TIMELINE_PAGE_SIZE'],
+                before=request.args.get('before'),
+                after=request.args.get('after'),
+            )
+        except ValueError:
+            abort(400)
+
+        likes = viewer_likes([msg.id for msg in page.items])
+
+        # Only queried if the panel isn't already cached.
+        suggestions = Suggestion.for_user(g.user.id,
+                                          app.config['SUGGESTIONS_SHOWN'])
 
-        return render_template('home.html', messages=messages, likes=likes)
+        return render_template('home.html', messages=page.items, page=page,
+                               likes=likes.liked, like_counts=likes.counts,
+                               suggestions=suggestions)
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Maintenance commands
+
+
+@app.cli.command('recount-users')
+def recount_users():
+    """Repair every user's and message's cached counters."""
+
+    updated = User.recount()
+    messages = Message.recount()
+    db.session.commit()
+    print(f"Recounted stats for {updated} users and {messages} messages.")
+
+
+@app.cli.command('install-search')
+def install_search():
+    """Create the pg_trgm extension and user search indexes."""
+
+    if install_search_indexes():
+        print("Search indexes installed.")
+    else:
+        print("Not a Postgres database; using substring search.")
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every home timeline from follows and messages.
+
+    Relies on users' follower counts, so run recount-users first after
+    loading data directly into the database. Also resets which authors
+    are pulled into timelines rather than fanned out.
+    """
+
+    TimelineEntry.rebuild()
+    db.session.commit()
+    print("Timelines rebuilt.")
+
+
+@app.cli.command('refresh-trending')
+def refresh_trending():
+    """Fold recent like activity into the trending ranking (run often)."""
+
+    rescored = TrendingMessage.refresh()
+    db.session.commit()
+    print(f"Rescored {rescored} trending messages.")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Cut home timelines down to TIMELINE_MAX_ENTRIES (run often)."""
+
+    removed = TimelineEntry.trim()
+    db.session.commit()
+    print(f"Removed {removed} old timeline entries.")
+
+
+##############################################################################
+# Caching headers
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Pages are private and must be revalidated; views that can tell whether
+# a client's copy is current use conditional.not_modified() to add
+# validators and answer 304. Fingerprinted static files never change, so
+# browsers and CDNs may keep them for a year.
+
 
 @app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def add_header(response):
+    """Add caching headers to every response."""
+
+    if request.endpoint == 'static':
+        if request.args.get('v'):
+            response.headers['Cache-Control'] = (
+                f'public, max-age={conditional.ASSET_MAX_AGE}, immutable')
+        else:
+            response.headers['Cache-Control'] = 'public, no-cache'
+        return response
+
+    conditional.apply_validators(response)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,252 @@
+"""EXPLAIN ANALYZE Warbler's hot-path queries, to compare schema changes.
+
+Run it from the project root against an empty scratch Postgres database
+to measure what the migrations buy:
+
+    createdb warbler-bench
+    DATABASE_URL=postgresql:///warbler-bench python benchmarks/explain_queries.py \\
+        --from-baseline 20000 --out after.json
+
+This builds the original schema (migrations/baseline.py) and seeds it
+with that many users and skewed messages, follows and likes. It runs the
+queries, applies every migration, runs them again and prints the change.
+
+Without --from-baseline it runs once against whatever the database
+holds. Use --out and --compare to compare two runs by hand.
+
+Each query runs for the busiest user of its kind (most messages, most
+follows, most likes) with EXPLAIN (ANALYZE, BUFFERS). The median
+execution time over --repeat runs, the shared buffers touched, and how
+the plan reads each table are printed and, with --out, written as JSON.
+The queries only read columns the original schema has, so the same SQL
+runs before and after migrating.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app  # noqa: E402
+import migrations  # noqa: E402
+from migrations import baseline  # noqa: E402
+from models import db, Follows, Likes, Message, User  # noqa: E402
+
+SCANS = {'Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan',
+         'Bitmap Index Scan'}
+
+# Low ids are picked far more often (random()^3), for popular users.
+SEED = [
+    "INSERT INTO users (email, username, password) "
+    "SELECT 'user' || n || '@bench.test', 'user' || n, 'x' "
+    "FROM generate_series(1, :users) AS n",
+
+    "INSERT INTO messages (text, \"timestamp\", user_id) "
+    "SELECT 'Message ' || n, "
+    "       timestamp '2020-01-01' + n * interval '1 minute', "
+    "       1 + floor(power(random(), 3) * :users) "
+    "FROM generate_series(1, :users * 20) AS n",
+
+    "INSERT INTO follows (user_following_id, user_being_followed_id) "
+    "SELECT follower, followed FROM ("
+    " SELECT 1 + floor(random() * :users) AS follower,"
+    "        1 + floor(power(random(), 3) * :users) AS followed"
+    " FROM generate_series(1, :users * 20)) AS pairs "
+    "WHERE follower <> followed "
+    "ON CONFLICT DO NOTHING",
+
+    # The original schema allows one like per message.
+    "INSERT INTO likes (user_id, message_id) "
+    "SELECT 1 + floor(power(random(), 3) * :users), id FROM messages "
+    "WHERE random() < 0.5",
+]
+
+
+def seed_baseline(users):
+    """Create the original schema and fill it with `users` users' data."""
+
+    if db.engine.table_names():
+        sys.exit("--from-baseline needs an empty database.")
+
+    baseline.create(db.engine)
+
+    with db.engine.begin() as conn:
+        for statement in SEED:
+            conn.execute(db.text(statement), users=users)
+        conn.execute('ANALYZE')
+
+
+def busiest(column):
+    """The value of `column` with the most rows, e.g. the top author."""
+
+    return (db.session.query(column)
+            .group_by(column)
+            .order_by(db.func.count().desc(), column)
+            .limit(1)
+            .scalar())
+
+
+def hot_queries(limit):
+    """{name: query} for the routes that run on every page view."""
+
+    author = busiest(Message.user_id)
+    follower = busiest(Follows.user_following_id)
+    followed = busiest(Follows.user_being_followed_id)
+    liker = busiest(Likes.user_id)
+
+    message_fields = (Message.id, Message.text, Message.timestamp,
+                      Message.user_id)
+    user_fields = (User.id, User.username, User.image_url)
+
+    return {
+        'profile messages': (db.session
+                             .query(*message_fields)
+                             .filter(Message.user_id == author)
+                             .order_by(Message.timestamp.desc())
+                             .limit(100)),
+        'timeline backfill': (db.session
+                              .query(Message.id, Message.timestamp)
+                              .filter(Message.user_id == author)
+                              .order_by(Message.timestamp.desc(),
+                                        Message.id.desc())
+                              .limit(800)),
+        'following page': (db.session
+                           .query(*user_fields)
+                           .join(Follows,
+                                 Follows.user_being_followed_id == User.id)
+                           .filter(Follows.user_following_id == follower)
+                           .order_by(Follows.user_being_followed_id.desc())
+                           .limit(limit)),
+        'followers page': (db.session
+                           .query(*user_fields)
+                           .join(Follows, Follows.user_following_id == User.id)
+                           .filter(Follows.user_being_followed_id == followed)
+                           .order_by(Follows.user_following_id.desc())
+                           .limit(limit)),
+        'likes page': (db.session
+                       .query(*message_fields)
+                       .join(Likes, Likes.message_id == Message.id)
+                       .filter(Likes.user_id == liker)
+                       .order_by(Likes.id.desc())
+                       .limit(limit)),
+    }
+
+
+def scans(plan):
+    """'Index Scan using ix on table'-style summaries of a plan's scans."""
+
+    found = []
+
+    if plan['Node Type'] in SCANS:
+        how = plan['Node Type']
+        if 'Index Name' in plan:
+            how += f" using {plan['Index Name']}"
+        if 'Relation Name' in plan:
+            how += f" on {plan['Relation Name']}"
+        found.append(how)
+
+    for child in plan.get('Plans', []):
+        found.extend(scans(child))
+
+    return found
+
+
+def explain(query, repeat):
+    compiled = query.statement.compile(dialect=db.engine.dialect)
+    sql = f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}"
+    timings = []
+
+    for _ in range(repeat):
+        result = db.session.connection().execute(sql, compiled.params).scalar()
+        if isinstance(result, str):
+            result = json.loads(result)
+        timings.append(result[0]['Execution Time'])
+
+    plan = result[0]['Plan']
+
+    return {
+        'median_ms': statistics.median(timings),
+        'buffers': (plan.get('Shared Hit Blocks', 0)
+                    + plan.get('Shared Read Blocks', 0)),
+        'scans': scans(plan),
+    }
+
+
+def report(results):
+    for name, stats in results.items():
+        print(f"\n{name}: {stats['median_ms']:.2f} ms, "
+              f"{stats['buffers']} buffers")
+        for scan in stats['scans']:
+            print(f"    {scan}")
+
+
+def compare(baseline, results):
+    print("\nChange vs baseline")
+    print(f"{'query':<24}{'before ms':>12}{'after ms':>12}{'change':>10}")
+
+    for name, stats in results.items():
+        old = baseline.get(name)
+        if old is None:
+            continue
+        change = ((stats['median_ms'] - old['median_ms']) / old['median_ms']
+                  if old['median_ms'] else 0)
+        print(f"{name:<24}{old['median_ms']:>12.2f}"
+              f"{stats['median_ms']:>12.2f}{change:>+10.1%}")
+
+
+def run(repeat):
+    results = {name: explain(query, repeat) for name, query
+               in hot_queries(app.config['LIST_PAGE_SIZE']).items()}
+    db.session.rollback()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--from-baseline', type=int, metavar='USERS',
+                        help="seed the original schema in an empty "
+                             "database, then measure before and after "
+                             "migrating")
+    parser.add_argument('--out', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results to compare against")
+    args = parser.parse_args()
+
+    if db.engine.dialect.name != 'postgresql':
+        sys.exit("EXPLAIN benchmarks need a Postgres database.")
+
+    baseline_results = None
+
+    if args.from_baseline:
+        seed_baseline(args.from_baseline)
+        baseline_results = run(args.repeat)
+        print("Before migrating:")
+        report(baseline_results)
+
+        migrations.migrate(db.engine)
+        db.session.execute('ANALYZE')
+        db.session.commit()
+        print("\nAfter migrating:")
+
+    results = run(args.repeat)
+    report(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline_results = json.load(f)
+
+    if baseline_results:
+        compare(baseline_results, results)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main()
@@ -0,0 +1,382 @@
+"""Drive concurrent simulated users through Warbler's main routes.
+
+Run it from the project root against a scratch database, e.g.:
+
+    DATABASE_URL=postgresql:///warbler-bench python benchmarks/load_test.py \\
+        --users 10000 --messages 100000 --follows 500000 \\
+        --concurrency 16 --duration 60 --out results/$(git rev-parse --short HEAD).json
+
+It generates and bulk-loads a dataset of the given size (skip with
+--skip-seed to reuse what's there), serves the app on a local port in a
+separate process, then runs --concurrency virtual users for --duration
+seconds. Each one logs in and then repeatedly picks a route: the home
+timeline, a profile, a followers list, writing a message, liking a
+message, or a user search.
+
+Throughput and p50/p95/p99 latency per route are printed and, with --out,
+written as JSON. --compare takes an earlier JSON file and prints the
+change for each route. --url runs against an already running server
+(e.g. gunicorn) instead; the dataset must then match this database.
+
+Don't point it at a database you care about: seeding drops every table,
+and benchmark users get a known password.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.cookiejar import CookieJar
+from multiprocessing import Pipe, Process
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler,
+                            build_opener)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from app import app  # noqa: E402
+from bulk_load import load  # noqa: E402
+from models import db, User, Message, Likes  # noqa: E402
+from passwords import hasher  # noqa: E402
+
+PASSWORD = 'benchmark'
+
+SEARCH_TERMS = ['a', 'jo', 'smith', 'mar', 'son', 'x', 'lee', 'an1']
+
+# How often each virtual user picks each route, relative to the others.
+ROUTE_WEIGHTS = {
+    'GET /': 30,
+    'GET /users/<id>': 20,
+    'GET /users/<id>/followers': 10,
+    'GET /messages/new': 5,
+    'POST /messages/new': 5,
+    'POST /users/add_like/<id>': 10,
+    'GET /users?q=': 10,
+}
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class NoRedirects(HTTPRedirectHandler):
+    """Report redirects as responses instead of following them.
+
+    A POST that redirects then counts as one request, timed on its own.
+    """
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def seed(args):
+    """Generate and bulk-load a dataset of the requested size."""
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run([
+            sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+            '--out', data_dir, '--seed', str(args.seed),
+            '--users', str(args.users), '--messages', str(args.messages),
+            '--follows', str(args.follows),
+        ], check=True)
+
+        load(data_dir=data_dir, fresh=True)
+
+
+def prepare_accounts(count):
+    """Usernames for `count` benchmark users, with a known password.
+
+    Clears their likes so liking starts from a clean slate on every run,
+    and recounts the cached like counters those likes had bumped.
+    """
+
+    users = User.query.order_by(User.id).limit(count).all()
+    pw_hash = hasher.hash(PASSWORD)
+
+    for user in users:
+        user.password = pw_hash
+
+    Likes.query.filter(Likes.user_id.in_([u.id for u in users])).delete(
+        synchronize_session=False)
+    User.recount()
+    Message.recount()
+    db.session.commit()
+
+    return [user.username for user in users]
+
+
+def serve(conn):
+    """Run the app on a free local port, reporting the port on `conn`."""
+
+    import logging
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    conn.send(server.server_port)
+    server.serve_forever()
+
+
+class VirtualUser(threading.Thread):
+    """One simulated user: logs in, then requests random routes."""
+
+    def __init__(self, base_url, username, dataset, deadline, results, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.username = username
+        self.dataset = dataset
+        self.deadline = deadline
+        self.results = results
+        self.random = random.Random(seed)
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),
+                                   NoRedirects())
+        self.liked = set()
+
+    def request(self, route, path, data=None):
+        """Time one request, record it under `route`, return the body."""
+
+        body = None if data is None else urlencode(data).encode('UTF-8')
+        start = time.perf_counter()
+
+        try:
+            with self.opener.open(self.base_url + path, body) as response:
+                status, text = response.status, response.read()
+        except HTTPError as error:
+            status, text = error.code, error.read()
+        except URLError:
+            status, text = None, b''
+
+        self.results.record(route, time.perf_counter() - start, status)
+        return text.decode('UTF-8', 'replace')
+
+    def form_token(self, route, path):
+        match = CSRF_TOKEN.search(self.request(route, path))
+        return match.group(1) if match else ''
+
+    def login(self):
+        token = self.form_token('GET /login', '/login')
+        self.request('POST /login', '/login', {
+            'csrf_token': token,
+            'username': self.username,
+            'password': PASSWORD,
+        })
+
+    def step(self, route):
+        users, messages = self.dataset['users'], self.dataset['messages']
+
+        if route == 'GET /':
+            self.request(route, '/')
+        elif route == 'GET /users/<id>':
+            self.request(route, f'/users/{self.random.randint(1, users)}')
+        elif route == 'GET /users/<id>/followers':
+            self.request(route,
+                         f'/users/{self.random.randint(1, users)}/followers')
+        elif route == 'GET /messages/new':
+            self.request(route, '/messages/new')
+        elif route == 'POST /messages/new':
+            token = self.form_token('GET /messages/new', '/messages/new')
+            self.request(route, '/messages/new', {
+                'csrf_token': token,
+                'text': f'Load test message {self.random.random()}',
+            })
+        elif route == 'POST /users/add_like/<id>':
+            message_id = self.random.randint(1, messages)
+            if message_id not in self.liked:
+                self.liked.add(message_id)
+                self.request(route, f'/users/add_like/{message_id}', {})
+        elif route == 'GET /users?q=':
+            term = self.random.choice(SEARCH_TERMS)
+            self.request(route, f'/users?{urlencode({"q": term})}')
+
+    def run(self):
+        self.login()
+        routes = list(ROUTE_WEIGHTS)
+        weights = list(ROUTE_WEIGHTS.values())
+
+        while time.monotonic() < self.deadline:
+            self.step(self.random.choices(routes, weights)[0])
+
+
+class Results:
+    """Latencies and status codes per route, shared by every thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, route, seconds, status):
+        with self.lock:
+            self.latencies[route].append(seconds)
+            if status is None or status >= 400:
+                self.errors[route] += 1
+
+    def summary(self, duration):
+        routes = {}
+
+        for route, latencies in sorted(self.latencies.items()):
+            routes[route] = summarize(latencies, self.errors[route], duration)
+
+        everything = [t for latencies in self.latencies.values()
+                      for t in latencies]
+        total = summarize(everything, sum(self.errors.values()), duration)
+
+        return routes, total
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, errors, duration):
+    ordered = sorted(latencies)
+
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'throughput': len(ordered) / duration,
+        'p50_ms': percentile(ordered, 0.50) * 1000 if ordered else None,
+        'p95_ms': percentile(ordered, 0.95) * 1000 if ordered else None,
+        'p99_ms': percentile(ordered, 0.99) * 1000 if ordered else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def report(routes, total):
+    print(f"\n{'route':<28}{'reqs':>8}{'errs':>6}{'req/s':>9}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+
+    def latency(ms):
+        # Routes where every request failed have no latencies.
+        return f"{'-':>9}" if ms is None else f"{ms:>9.1f}"
+
+    for route, stats in [*routes.items(), ('TOTAL', total)]:
+        print(f"{route:<28}{stats['requests']:>8}{stats['errors']:>6}"
+              f"{stats['throughput']:>9.1f}"
+              + ''.join(latency(stats[key])
+                        for key in ['p50_ms', 'p95_ms', 'p99_ms']))
+
+
+def compare(baseline, routes, total):
+    """Print each route's change against an earlier results file."""
+
+    print(f"\nChange vs {baseline['meta'].get('commit') or 'baseline'}")
+    print(f"{'route':<28}{'req/s':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+
+    def change(old, new):
+        if not old or new is None:
+            return f"{'-':>10}"
+        return f"{(new - old) / old:>+10.1%}"
+
+    before = {**baseline['routes'], 'TOTAL': baseline['total']}
+
+    for route, stats in [*routes.items(), ('TOTAL', total)]:
+        old = before.get(route)
+        if old is None:
+            continue
+        print(f"{route:<28}"
+              + ''.join(change(old[key], stats[key]) for key in
+                        ['throughput', 'p50_ms', 'p95_ms', 'p99_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--follows', type=int, default=500_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the data already in the database")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30,
+                        help="seconds to run the load for")
+    parser.add_argument('--url', help="benchmark this running server instead")
+    parser.add_argument('--out', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results to compare against")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not args.skip_seed:
+            seed(args)
+
+        usernames = prepare_accounts(args.concurrency)
+        dataset = {
+            'users': db.session.query(db.func.max(User.id)).scalar() or 1,
+            'messages': db.session.query(db.func.max(Message.id)).scalar() or 1,
+        }
+        dialect = db.engine.dialect.name
+
+    server = None
+    base_url = args.url
+
+    if base_url is None:
+        # Connections must not be shared with the forked server process.
+        db.engine.dispose()
+        receive, send = Pipe(duplex=False)
+        server = Process(target=serve, args=(send,), daemon=True)
+        server.start()
+        base_url = f'http://127.0.0.1:{receive.recv()}'
+
+    results = Results()
+    deadline = time.monotonic() + args.duration
+    started = time.monotonic()
+
+    vus = [VirtualUser(base_url.rstrip('/'), username, dataset, deadline,
+                       results, seed=f"{args.seed}-{i}")
+           for i, username in enumerate(usernames)]
+    for vu in vus:
+        vu.start()
+    for vu in vus:
+        vu.join()
+
+    duration = time.monotonic() - started
+
+    if server is not None:
+        server.terminate()
+
+    routes, total = results.summary(duration)
+    report(routes, total)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(json.load(baseline), routes, total)
+
+    if args.out:
+        meta = {
+            'commit': git_commit(),
+            'run_at': datetime.now(timezone.utc).isoformat(),
+            'database': dialect,
+            'duration': duration,
+            'max_user_id': dataset['users'],
+            'max_message_id': dataset['messages'],
+            'seed': args.seed,
+            'concurrency': args.concurrency,
+        }
+
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, 'w') as out:
+            json.dump({'meta': meta, 'routes': routes, 'total': total},
+                      out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Benchmark user search against a large seeded users table.
+
+Run it from the project root against a scratch database, e.g.:
+
+    DATABASE_URL=postgresql:///warbler-bench python benchmarks/search_benchmark.py
+
+It (re)creates the tables, seeds --users synthetic users, then times
+`search_users` for a few terms before and after `install_search_indexes`.
+Don't point it at a database you care about: it drops every table.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import app  # noqa: E402
+from models import db, User  # noqa: E402
+from search import search_users, install_search_indexes, is_postgres  # noqa: E402
+
+TERMS = ['bird', 'warbler42', 'song', 'x7', 'nonexistentuser']
+
+SEED_POSTGRES = """
+INSERT INTO users (email, username, password, bio, location)
+SELECT 'user' || n || '@example.com',
+       (ARRAY['bird', 'song', 'wing', 'nest', 'warbler'])[1 + n % 5] || n,
+       'x',
+       'Loves ' || (ARRAY['seeds', 'songs', 'trees', 'rain'])[1 + n % 4],
+       (ARRAY['Oakland', 'Austin', 'Boston', 'Denver'])[1 + n % 4]
+FROM generate_series(:start, :stop) AS n
+"""
+
+
+def seed(count, batch_size=100_000):
+    """Create `count` synthetic users, `batch_size` rows per statement."""
+
+    db.drop_all()
+    db.create_all()
+
+    for start in range(1, count + 1, batch_size):
+        stop = min(start + batch_size - 1, count)
+
+        if is_postgres():
+            db.session.execute(SEED_POSTGRES, {'start': start, 'stop': stop})
+        else:
+            db.session.execute(User.__table__.insert(), [
+                dict(email=f'user{n}@example.com',
+                     username=f"{['bird', 'song', 'wing', 'nest', 'warbler'][n % 5]}{n}",
+                     password='x')
+                for n in range(start, stop + 1)
+            ])
+
+        db.session.commit()
+        print(f"  seeded {stop:,} users", file=sys.stderr)
+
+    if is_postgres():
+        db.session.execute("ANALYZE users")
+        db.session.commit()
+
+
+def time_searches(repeat):
+    """Time each term, returning {term: (median ms, max ms, hits)}."""
+
+    results = {}
+
+    for term in TERMS:
+        timings = []
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            page = search_users(term, per_page=24)
+            timings.append((time.perf_counter() - start) * 1000)
+            db.session.rollback()
+
+        results[term] = (statistics.median(timings), max(timings),
+                         len(page.users))
+
+    return results
+
+
+def report(label, results):
+    print(f"\n{label}")
+    print(f"{'term':<20}{'median ms':>12}{'max ms':>12}{'hits':>8}")
+    for term, (median, worst, hits) in results.items():
+        print(f"{term:<20}{median:>12.2f}{worst:>12.2f}{hits:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help="reuse the users already in the database")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(args.users)
+
+    report("Before search indexes", time_searches(args.repeat))
+
+    if install_search_indexes():
+        db.session.execute("ANALYZE users")
+        db.session.commit()
+        report("After search indexes", time_searches(args.repeat))
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main()
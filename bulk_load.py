@@ -0,0 +1,312 @@
+"""Bulk-load Warbler's CSV data into the database.
+
+    python bulk_load.py [--fresh] [--data-dir generator] [--batch-size 50000]
+
+Loads users.csv, messages.csv, follows.csv and (if present) likes.csv from
+the data directory, in that order so foreign keys line up. Rows of a
+CSV without an id column get their row number as id, which is how the
+other CSVs refer to them. CSVs are streamed in batches: on Postgres each batch goes in with COPY, elsewhere
+with a batched INSERT. Each batch commits together with a progress
+record, so an interrupted load picks up where it stopped when run again
+(without --fresh).
+
+Secondary indexes and foreign keys are dropped before loading and
+recreated once everything is in. Finally cached user counters and home
+timelines are rebuilt.
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import Boolean, Column, Integer, MetaData, Table, Text, func
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from app import db
+from models import User, Message, Follows, Likes, TimelineEntry
+
+LOAD_ORDER = [
+    (User, 'users.csv'),
+    (Message, 'messages.csv'),
+    (Follows, 'follows.csv'),
+    (Likes, 'likes.csv'),
+]
+
+progress_metadata = MetaData()
+
+load_progress = Table(
+    'bulk_load_progress', progress_metadata,
+    Column('table_name', Text, primary_key=True),
+    Column('rows_loaded', Integer, nullable=False, default=0),
+    Column('done', Boolean, nullable=False, default=False),
+)
+
+deferred_ddl = Table(
+    'bulk_load_deferred_ddl', progress_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('statement', Text, nullable=False),
+)
+
+POSTGRES_INDEXES = """
+SELECT indexdef FROM pg_indexes i
+WHERE tablename = ANY(:tables)
+AND NOT EXISTS (SELECT 1 FROM pg_constraint c
+                WHERE c.conname = i.indexname)
+"""
+
+POSTGRES_FOREIGN_KEYS = """
+SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+FROM pg_constraint
+WHERE contype = 'f' AND conrelid::regclass::text = ANY(:tables)
+"""
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def table_names():
+    return [model.__tablename__ for model, _ in LOAD_ORDER]
+
+
+def defer_constraints(conn):
+    """Drop secondary indexes and foreign keys, remembering how to rebuild.
+
+    Does nothing if a previous, interrupted load already did it.
+    """
+
+    if conn.execute(db.select([func.count()]).select_from(deferred_ddl)).scalar():
+        return
+
+    drops = []
+    creates = []
+
+    if is_postgres():
+        for table, name, definition in conn.execute(
+                db.text(POSTGRES_FOREIGN_KEYS), tables=table_names()):
+            drops.append(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+            creates.append(
+                f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}')
+
+        for (definition,) in conn.execute(db.text(POSTGRES_INDEXES),
+                                          tables=table_names()):
+            name = definition.split(' ON ')[0].split()[-1]
+            drops.append(f'DROP INDEX {name}')
+            creates.append(definition)
+    else:
+        for model, _ in LOAD_ORDER:
+            for index in model.__table__.indexes:
+                drops.append(str(DropIndex(index).compile(conn)))
+                creates.append(str(CreateIndex(index).compile(conn)))
+
+    for statement in creates:
+        conn.execute(deferred_ddl.insert(), statement=statement)
+
+    for statement in drops:
+        conn.execute(statement)
+
+    log(f"Deferred {len(creates)} indexes and constraints.")
+
+
+def restore_constraints(conn):
+    """Recreate the indexes and foreign keys dropped before loading."""
+
+    statements = conn.execute(
+        db.select([deferred_ddl.c.statement]).order_by(deferred_ddl.c.id))
+
+    for (statement,) in statements.fetchall():
+        start = time.perf_counter()
+        conn.execute(statement)
+        log(f"  {statement[:70]}... ({time.perf_counter() - start:.1f}s)")
+
+    conn.execute(deferred_ddl.delete())
+
+
+def copy_batch(raw_conn, table, columns, rows):
+    """Load rows into `table` with Postgres COPY."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+
+    with raw_conn.cursor() as cursor:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer)
+
+
+def csv_value(column, value):
+    """Convert a CSV string to what `column` expects; '' means NULL."""
+
+    if value == '':
+        return None
+
+    python_type = column.type.python_type
+
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+
+    return python_type(value)
+
+
+def insert_batch(conn, table, columns, rows):
+    """Load rows into `table` with one multi-row INSERT."""
+
+    columns = [table.c[name] for name in columns]
+
+    conn.execute(table.insert(), [
+        {column.name: csv_value(column, value)
+         for column, value in zip(columns, row)}
+        for row in rows
+    ])
+
+
+def load_table(model, path, batch_size):
+    """Stream one CSV into its table, resuming after any loaded rows."""
+
+    table = model.__table__
+
+    with db.engine.begin() as conn:
+        progress = conn.execute(
+            load_progress.select()
+            .where(load_progress.c.table_name == table.name)).first()
+
+        if progress is None:
+            conn.execute(load_progress.insert(), table_name=table.name)
+            loaded, done = 0, False
+        else:
+            loaded, done = progress.rows_loaded, progress.done
+
+    if done:
+        log(f"{table.name}: already loaded.")
+        return
+
+    with open(path, newline='') as source:
+        reader = csv.reader(source)
+        columns = next(reader)
+        rows = islice(reader, loaded, None)
+
+        # Other CSVs point at these rows by position. Leaving ids to the
+        # sequence would shift them whenever it skipped values (a rolled
+        # back batch, a reused table), so give each row its number.
+        if 'id' in table.c and 'id' not in columns:
+            columns = ['id', *columns]
+            rows = ([row_number, *row]
+                    for row_number, row in enumerate(rows, start=loaded + 1))
+
+        if loaded:
+            log(f"{table.name}: resuming after {loaded:,} rows.")
+
+        start = time.perf_counter()
+        this_run = 0
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+
+            loaded += len(batch)
+            save_progress = (load_progress.update()
+                             .where(load_progress.c.table_name == table.name)
+                             .values(rows_loaded=loaded))
+
+            # The batch and its progress record commit together, so a
+            # resumed load never skips or repeats rows.
+            with db.engine.begin() as conn:
+                if is_postgres():
+                    copy_batch(conn.connection, table.name, columns, batch)
+                else:
+                    insert_batch(conn, table, columns, batch)
+                conn.execute(save_progress)
+
+            this_run += len(batch)
+            elapsed = time.perf_counter() - start
+            log(f"{table.name}: {loaded:,} rows "
+                f"({this_run / elapsed:,.0f} rows/sec)")
+
+    with db.engine.begin() as conn:
+        conn.execute(load_progress.update()
+                     .where(load_progress.c.table_name == table.name)
+                     .values(done=True))
+
+
+def load(data_dir='generator', batch_size=50_000, fresh=False, defer=True):
+    """Load every CSV in `data_dir` and rebuild derived data."""
+
+    if fresh:
+        db.drop_all()
+        progress_metadata.drop_all(db.engine)
+        db.create_all()
+    elif (not db.engine.has_table(load_progress.name)
+          and db.session.query(User.query.exists()).scalar()):
+        raise SystemExit("The database already has users and no interrupted "
+                         "load to resume; use --fresh to start over.")
+
+    progress_metadata.create_all(db.engine)
+
+    if defer:
+        with db.engine.begin() as conn:
+            defer_constraints(conn)
+
+    for model, filename in LOAD_ORDER:
+        path = os.path.join(data_dir, filename)
+
+        if os.path.exists(path):
+            load_table(model, path, batch_size)
+        else:
+            log(f"{model.__tablename__}: no {filename}, skipping.")
+
+    log("Rebuilding indexes and constraints.")
+    with db.engine.begin() as conn:
+        restore_constraints(conn)
+
+        if is_postgres():
+            conn.execute(f"ANALYZE {', '.join(table_names())}")
+
+        # Ids were given explicitly, so move the sequences past them.
+        if is_postgres():
+            for model, _ in LOAD_ORDER:
+                if 'id' in model.__table__.c:
+                    name = model.__tablename__
+                    conn.execute(
+                        f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+                        f"COALESCE((SELECT MAX(id) FROM {name}), 0) + 1, false)")
+
+    log("Recounting user and message stats and rebuilding timelines.")
+    User.recount()
+    Message.recount()
+    TimelineEntry.rebuild()
+    db.session.commit()
+
+    progress_metadata.drop_all(db.engine)
+    log("Done.")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Bulk-load Warbler CSV data, resuming if interrupted.")
+    parser.add_argument('--data-dir', default='generator',
+                        help="directory holding the CSV files")
+    parser.add_argument('--batch-size', type=int, default=50_000,
+                        help="rows per COPY/INSERT and per commit")
+    parser.add_argument('--fresh', action='store_true',
+                        help="drop and recreate all tables first")
+    parser.add_argument('--no-defer', dest='defer', action='store_false',
+                        help="keep indexes and foreign keys during the load")
+    args = parser.parse_args()
+
+    load(data_dir=args.data_dir, batch_size=args.batch_size,
+         fresh=args.fresh, defer=args.defer)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""HTTP caching helpers for Warbler: validators and fingerprinted assets.
+
+Routes whose output depends on a small, cheap-to-read data version call
+`not_modified()` before rendering. It records an ETag (and optionally a
+Last-Modified date) for the response and, when the client already holds
+that version, returns a 304 to send instead of rendering the page.
+
+Static files linked through `static_url()` carry a content fingerprint in
+their URL, so they can be cached by browsers and CDNs "forever".
+"""
+
+import hashlib
+import os
+from datetime import timezone
+
+from flask import current_app, g, request, session, url_for
+
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+_fingerprints = {}
+
+
+def version_tag(*parts):
+    """A short, stable ETag value for a tuple of data-version parts."""
+
+    return hashlib.sha1(repr(parts).encode('UTF-8')).hexdigest()[:20]
+
+
+def as_utc_naive(moment):
+    """Drop any timezone from `moment`, converting it to UTC first."""
+
+    if moment is not None and moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return moment
+
+
+def not_modified(*version, last_modified=None):
+    """Set validators for this response; 304 if the client is current.
+
+    `version` is anything that changes whenever the rendered page would.
+    Clients that only send If-Modified-Since are answered from
+    `last_modified` alone, so it has to move whenever `version` does. Returns a 304 response to return from the view, or None to render as
+    usual. Pages with pending flash messages are always rendered.
+    """
+
+    etag = version_tag(*version)
+    last_modified = as_utc_naive(last_modified)
+    g.validators = (etag, last_modified)
+
+    if session.get('_flashes'):
+        return None
+
+    if request.if_none_match:
+        current = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        since = as_utc_naive(request.if_modified_since)
+        current = last_modified.replace(microsecond=0) <= since
+    else:
+        current = False
+
+    if not current:
+        return None
+
+    return current_app.response_class(status=304)
+
+
+def apply_validators(response):
+    """Copy validators recorded by `not_modified` onto `response`."""
+
+    etag, last_modified = g.pop('validators', (None, None))
+
+    if etag:
+        response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+
+    return response
+
+
+def fingerprint(filename):
+    """Content hash of a static file, recomputed when it changes."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(path)
+
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as asset:
+            digest = hashlib.md5(asset.read()).hexdigest()[:12]
+        cached = _fingerprints[path] = (mtime, digest)
+
+    return cached[1]
+
+
+def static_url(filename):
+    """URL for a static file with a fingerprint that changes with it.
+
+    Available in templates as `static_url`.
+    """
+
+    return url_for('static', filename=filename, v=fingerprint(filename))
+
+
+def init_app(app):
+    """Expose `static_url` to templates.
+
+    You should call this in your Flask app.
+    """
+
+    app.jinja_env.globals['static_url'] = static_url
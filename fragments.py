@@ -0,0 +1,127 @@
+"""Rendered-fragment cache for Warbler.
+
+Pieces of pages that only change when their author writes something
+(profile headers, a user's message list, a single message) are rendered
+once and kept here as HTML. Keys include the version of the data they
+render (usually the author's `User.updated_at`), so a write changes the
+key every worker looks up, whichever worker handled it. Entries expire
+after FRAGMENT_CACHE_TTL seconds, the least recently used ones are
+evicted past FRAGMENT_CACHE_SIZE entries, and routes that change the
+underlying data drop superseded entries early by tag.
+"""
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from flask import render_template
+from markupsafe import Markup
+
+
+class FragmentCache:
+    """A thread-safe LRU cache of rendered HTML with TTL and tags."""
+
+    def __init__(self, max_entries=1000, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._tags = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Cached HTML for `key`, or None if it's missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    self._discard(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, html, tags=()):
+        """Store `html` under `key`, to be dropped with any of `tags`."""
+
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (self.clock() + self.ttl, html, tuple(tags))
+
+            for tag in tags:
+                self._tags[tag].add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def get_or_render(self, key, render, tags=()):
+        """Cached HTML for `key`, calling `render()` to fill it if needed."""
+
+        html = self.get(key)
+
+        if html is None:
+            html = render()
+            self.set(key, html, tags)
+
+        return html
+
+    def invalidate(self, *tags):
+        """Drop every entry stored with any of `tags`."""
+
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            for tag in entry[2]:
+                keys = self._tags[tag]
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+cache = FragmentCache()
+
+
+def cached_fragment(key, template_name, tags=(), **context):
+    """Render `template_name` with `context`, or reuse the cached HTML.
+
+    `key` must identify everything the fragment's output depends on,
+    including a version of that data such as `User.updated_at`; tags only
+    reach the cache of the process that made the change. Available in
+    templates as `cached_fragment`.
+    """
+
+    html = cache.get_or_render(
+        key, lambda: render_template(template_name, **context), tags)
+
+    return Markup(html)
+
+
+def init_app(app):
+    """Configure the fragment cache and expose it to templates.
+
+    You should call this in your Flask app.
+    """
+
+    cache.max_entries = app.config.get('FRAGMENT_CACHE_SIZE', 1000)
+    cache.ttl = app.config.get('FRAGMENT_CACHE_TTL', 300)
+    app.jinja_env.globals['cached_fragment'] = cached_fragment
@@ -2,15 +2,40 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows:
+
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 100000000 --workers 8
+
+Users are generated in shards of --shard-size users, each on a worker
+process with its own seed derived from --seed, so the output only depends
+on the options (not on --workers). Each shard writes its own part file
+and the parts are joined in order at the end; no step holds more than one
+shard's rows in memory. Messages are dated in the two years before
+--until, which defaults to today.
+
+Follower counts and post counts follow a power law: each user gets a
+"popularity" (how likely others are to follow them) and an "activity" (how
+many accounts they follow and how much they post), both Pareto-distributed.
+Follows are sampled per follower from the popularity distribution, without
+ever building the list of all possible pairs. Nobody follows more than
+every other user, so with few users the total can fall short of --follows.
+
+Runs offline: image URLs are fixed lists rather than fetched.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import shutil
+import sys
+import tempfile
+from datetime import date, datetime, time
+from multiprocessing import Pool
+
+import numpy as np
 from faker import Faker
-from helpers import get_random_datetime
+from helpers import get_random_datetimes
 
 MAX_WARBLER_LENGTH = 140
 
@@ -18,60 +43,246 @@ USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'heade
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+# bcrypt hash of "password", shared by every generated user
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+# Random profile image URLs to use for users
 
-# Generate random profile image URLs to use for users
-
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Header image URLs to use for users (formerly fetched from splashbase)
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+HEADER_IMAGE_URLS = [
+    f"https://splashbase.s3.amazonaws.com/unsplash/regular/tumblr_{key}1st5lhmo1_1280.jpg"
+    for key in [
+        'mnh0n9pHJW', 'mnh0uemhCk', 'mnh121HEWa', 'mnh17lfd9R', 'mnh1d7s3UD',
+        'mnh1jdFvHR', 'mnh1uhYnog', 'mnh25vNOvI', 'mnh29fxz11', 'mnh2m1hnS8',
+        'mo1h6tGOZf', 'mo2wz2LTCs', 'mo2x3aAnRH', 'mo2x80NkDu', 'mo2x9xqeef',
+        'mo2xbk8JUK', 'mo2xdqmle5', 'mo2xfarCvW', 'mo2xgqdEFn', 'mo2xijE2nr',
+        'mopq4kHmAg', 'mopq69jlcS', 'mopq8fyQwI', 'mopqamedKu', 'mopqc3ZZcz',
+        'mopqdfx05t', 'mopqfpSTPN', 'mopqhxFulr', 'mopqj9QUeq', 'mopqkkwK2M',
+        'mp6rzyNlAN', 'mp6s1hAudo', 'mp6s32zb6l', 'mp6s4dzqHA', 'mp6s661UgK',
+        'mp6s7lR1lS', 'mp6s995bvI', 'mp6sasSvPZ', 'mp6scv2xrZ', 'mpp6f50W26',
+        'mpp6gwrYvm', 'mpp6l06zXi', 'mpp6poZxE5', 'mpp6tjdFhf', 'mpp6w0dxAm',
+    ]
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+# Per-worker state, set up once by `init_worker`
+plan = {}
+
+
+def shard_seed(seed, kind, shard):
+    """Independent, reproducible seed material for one shard of one file."""
+
+    return np.random.SeedSequence([seed, ['users', 'messages', 'follows'].index(kind), shard])
+
+
+def shard_rngs(seed, kind, shard):
+    """A numpy generator and a Faker instance seeded for one shard."""
+
+    sequence = shard_seed(seed, kind, shard)
+    fake = Faker()
+    fake.seed_instance(int(sequence.generate_state(1)[0]))
+
+    return np.random.default_rng(sequence), fake
+
+
+def init_worker(worker_plan):
+    plan.update(worker_plan)
+
+
+def write_users(path, shard, start, stop):
+    rng, fake = shard_rngs(plan['seed'], 'users', shard)
+
+    images = rng.choice(IMAGE_URLS, size=stop - start)
+    headers = rng.choice(HEADER_IMAGE_URLS, size=stop - start)
+
+    with open(path, 'w', newline='') as part:
+        writer = csv.writer(part)
+
+        for i, user_id in enumerate(range(start + 1, stop + 1)):
+            # The id suffix keeps usernames (and so emails) unique.
+            username = f"{fake.user_name()}{user_id}"
+            writer.writerow([
+                f"{username}@{fake.free_email_domain()}",
+                username,
+                images[i],
+                PASSWORD,
+                fake.sentence(),
+                headers[i],
+                fake.city(),
+            ])
+
+    return stop - start
+
+
+def write_messages(path, shard, start, stop):
+    rng, fake = shard_rngs(plan['seed'], 'messages', shard)
+
+    counts = plan['post_counts'][start:stop]
+    user_ids = np.repeat(np.arange(start + 1, stop + 1), counts)
+    rng.shuffle(user_ids)
+    timestamps = get_random_datetimes(len(user_ids), rng=rng, now=plan['now'])
+
+    with open(path, 'w', newline='') as part:
+        writer = csv.writer(part)
+
+        for user_id, timestamp in zip(user_ids, timestamps):
+            writer.writerow([
+                fake.paragraph()[:MAX_WARBLER_LENGTH],
+                str(timestamp).replace('T', ' '),
+                user_id,
+            ])
+
+    return len(user_ids)
+
+
+def pick_followed(rng, follower_id, count):
+    """Ids of up to `count` distinct users for `follower_id` to follow.
+
+    Draws by popularity, dropping duplicates and self-follows and topping
+    up for a few rounds. Followers who want a large share of all users are
+    sampled without replacement directly, which costs O(users).
+    """
+
+    cdf = plan['popularity_cdf']
+
+    if count * 10 > len(cdf):
+        weights = np.diff(cdf, prepend=0)
+        weights[follower_id - 1] = 0
+        weights /= weights.sum()
+        count = min(count, np.count_nonzero(weights))
+        return rng.choice(len(cdf), count, replace=False, p=weights) + 1
+
+    picked = np.empty(0, dtype=np.int64)
+
+    for _ in range(5):
+        wanted = count - len(picked)
+        draws = np.searchsorted(cdf, rng.random(wanted + wanted // 4 + 8)) + 1
+        draws = np.concatenate([picked, draws[draws != follower_id]])
+
+        _, first = np.unique(draws, return_index=True)
+        picked = draws[np.sort(first)][:count]
+
+        if len(picked) == count:
+            break
+
+    return picked
+
+
+def write_follows(path, shard, start, stop):
+    rng, _ = shard_rngs(plan['seed'], 'follows', shard)
+    written = 0
+
+    with open(path, 'w', newline='') as part:
+        writer = csv.writer(part)
+
+        for follower_id, count in enumerate(plan['follow_counts'][start:stop],
+                                            start + 1):
+            if not count:
+                continue
+
+            followed = pick_followed(rng, follower_id, count)
+            writer.writerows((followed_id, follower_id)
+                             for followed_id in followed.tolist())
+            written += len(followed)
+
+    return written
+
+
+WRITERS = {
+    'users': write_users,
+    'messages': write_messages,
+    'follows': write_follows,
+}
+
+
+def run_shard(task):
+    kind, path, shard, start, stop = task
+    return kind, WRITERS[kind](path, shard, start, stop)
+
+
+def make_plan(args):
+    """Per-user popularity and activity, shared by every worker."""
+
+    rng = np.random.default_rng(np.random.SeedSequence([args.seed]))
+
+    popularity = rng.pareto(args.shape, args.users) + 1
+    activity = rng.pareto(args.shape, args.users) + 1
+    activity /= activity.sum()
+
+    follow_counts = rng.multinomial(args.follows, activity)
+    np.minimum(follow_counts, args.users - 1, out=follow_counts)
+
+    cdf = np.cumsum(popularity)
+    cdf /= cdf[-1]
+
+    return {
+        'seed': args.seed,
+        'now': datetime.combine(args.until, time()),
+        'popularity_cdf': cdf,
+        'follow_counts': follow_counts,
+        'post_counts': rng.multinomial(args.messages, activity),
+    }
+
+
+def join_parts(destination, headers, parts):
+    with open(destination, 'w', newline='') as out:
+        csv.writer(out).writerow(headers)
+
+        for part in parts:
+            with open(part) as source:
+                shutil.copyfileobj(source, out)
+            os.remove(part)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate Warbler CSVs.")
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0,
+                        help="same seed and sizes give the same files")
+    parser.add_argument('--until', type=date.fromisoformat, default=date.today(),
+                        help="latest message date (YYYY-MM-DD; default today)")
+    parser.add_argument('--shape', type=float, default=1.5,
+                        help="Pareto shape; smaller means more skewed")
+    parser.add_argument('--shard-size', type=int, default=10_000,
+                        help="users per shard")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)),
+                        help="directory to write the CSVs to")
+    args = parser.parse_args()
+
+    files = [
+        ('users', USERS_CSV_HEADERS),
+        ('messages', MESSAGES_CSV_HEADERS),
+        ('follows', FOLLOWS_CSV_HEADERS),
+    ]
+    shards = [(shard, start, min(start + args.shard_size, args.users))
+              for shard, start in enumerate(range(0, args.users, args.shard_size))]
+
+    with tempfile.TemporaryDirectory(dir=args.out) as parts_dir:
+        tasks = [
+            (kind, os.path.join(parts_dir, f"{kind}-{shard:06d}.csv"), shard, start, stop)
+            for kind, _ in files
+            for shard, start, stop in shards
+        ]
+        written = dict.fromkeys(WRITERS, 0)
+
+        with Pool(args.workers, init_worker, (make_plan(args),)) as pool:
+            for kind, rows in pool.imap_unordered(run_shard, tasks):
+                written[kind] += rows
+                print(f"{kind}: {written[kind]:,} rows", file=sys.stderr)
+
+        for kind, headers in files:
+            join_parts(os.path.join(args.out, f"{kind}.csv"), headers,
+                       [task[1] for task in tasks if task[0] == kind])
+
+
+if __name__ == '__main__':
+    main()
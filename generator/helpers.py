@@ -1,14 +1,31 @@
 """Support functions for CSV generation."""
 
 from datetime import datetime
-from random import uniform
+
+import numpy as np
+
+
+def get_random_datetimes(count, year_gap=2, rng=None, now=None):
+    """Get `count` random datetimes within the last few years.
+
+    Returns a numpy array of datetime64 values (microsecond precision),
+    drawn uniformly between `year_gap` years before `now` and `now`.
+    """
+
+    rng = rng or np.random.default_rng()
+    now = now or datetime.now()
+    try:
+        then = now.replace(year=now.year - year_gap)
+    except ValueError:
+        # `now` is Feb 29 and that year isn't a leap year.
+        then = now.replace(year=now.year - year_gap, day=28)
+    start = np.datetime64(then, 'us').astype(np.int64)
+    stop = np.datetime64(now, 'us').astype(np.int64)
+
+    return rng.integers(start, stop, size=count).astype('datetime64[us]')
 
 
 def get_random_datetime(year_gap=2):
     """Get a random datetime within the last few years."""
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
-
-    return datetime.fromtimestamp(random_timestamp)
+    return get_random_datetimes(1, year_gap)[0].item()
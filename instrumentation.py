@@ -0,0 +1,137 @@
+"""Per-request SQL and template timing for Warbler.
+
+Every SQL statement run through SQLAlchemy is counted and timed, as is
+template rendering, and each response gets a Server-Timing header with the
+totals, e.g.:
+
+    Server-Timing: db;dur=12.41;desc="7 queries", render;dur=3.02, total;dur=18.70
+
+Browser dev tools show these next to the request. `count_queries()` uses
+the same hooks to count statements around any block of code, which is
+what the query budgets in the view tests are built on.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, template_rendered, before_render_template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_active = threading.local()
+
+
+class QueryStats:
+    """Number of statements run and the time spent in them."""
+
+    def __init__(self, keep_statements=False):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = [] if keep_statements else None
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+
+        if self.statements is not None:
+            self.statements.append(statement)
+
+
+def _recorders():
+    if not hasattr(_active, 'recorders'):
+        _active.recorders = []
+
+    return _active.recorders
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+
+    for stats in _recorders():
+        stats.add(statement, elapsed)
+
+
+@contextmanager
+def count_queries(keep_statements=True):
+    """Count the SQL statements this thread runs inside the block.
+
+        with count_queries() as stats:
+            ...
+        stats.count, stats.seconds, stats.statements
+    """
+
+    stats = QueryStats(keep_statements)
+    recorders = _recorders()
+    recorders.append(stats)
+
+    try:
+        yield stats
+    finally:
+        recorders.remove(stats)
+
+
+def _start_request():
+    g.request_started = time.perf_counter()
+    g.query_stats = QueryStats()
+    g.render_seconds = 0.0
+    g.render_started = []
+    _recorders().append(g.query_stats)
+
+
+def _before_render(sender, template, context, **extra):
+    if 'render_started' in g:
+        g.render_started.append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    if not g.get('render_started'):
+        return
+
+    started = g.render_started.pop()
+
+    # Fragments render inside their page; only time the outermost template.
+    if not g.render_started:
+        g.render_seconds += time.perf_counter() - started
+
+
+def _add_server_timing(response):
+    stats = g.get('query_stats')
+
+    if stats is None:
+        return response
+
+    total = time.perf_counter() - g.request_started
+    response.headers.add(
+        'Server-Timing',
+        f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries", '
+        f'render;dur={g.render_seconds * 1000:.2f}, '
+        f'total;dur={total * 1000:.2f}')
+
+    return response
+
+
+def _stop_request(exc):
+    stats = g.pop('query_stats', None)
+
+    if stats is not None and stats in _recorders():
+        _recorders().remove(stats)
+
+
+def init_app(app):
+    """Time SQL and rendering for every request and report it in headers.
+
+    You should call this in your Flask app.
+    """
+
+    app.before_request(_start_request)
+    app.after_request(_add_server_timing)
+    app.teardown_request(_stop_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
@@ -0,0 +1,236 @@
+"""Prometheus metrics for Warbler, served at /metrics.
+
+Exports:
+
+- warbler_request_duration_seconds: histogram of request latency by
+  Flask endpoint, method and status code.
+- warbler_requests_in_flight: requests currently being handled.
+- warbler_db_pool_*: connections checked out, overflow connections in use,
+  pool size, time spent waiting for a connection, and checkout timeouts,
+  labelled by bind: 'primary', or the SQLALCHEMY_BINDS key of a replica.
+- warbler_cache_requests_total: hits and misses of registered caches (the
+  fragment cache).
+
+With several pre-forked workers (gunicorn), point PROMETHEUS_MULTIPROC_DIR
+at an empty directory before starting them. Each worker then writes its
+samples there and /metrics, whichever worker serves it, reports the sum
+across all of them. Gauges count live workers only; have gunicorn call
+`mark_process_dead` from its `child_exit` hook so a dead worker's
+in-flight requests and connections drop out:
+
+    # gunicorn.conf.py
+    def child_exit(server, worker):
+        from metrics import mark_process_dead
+        mark_process_dead(worker.pid)
+"""
+
+import os
+import threading
+import time
+
+from flask import Response, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+REQUEST_DURATION = Histogram(
+    'warbler_request_duration_seconds',
+    "Time spent handling requests.",
+    ['endpoint', 'method', 'status'])
+
+IN_FLIGHT = Gauge(
+    'warbler_requests_in_flight',
+    "Requests currently being handled.",
+    multiprocess_mode='livesum')
+
+POOL_CHECKED_OUT = Gauge(
+    'warbler_db_pool_checked_out',
+    "Database connections currently checked out of the pool.",
+    ['bind'],
+    multiprocess_mode='livesum')
+
+POOL_OVERFLOW = Gauge(
+    'warbler_db_pool_overflow',
+    "Connections open beyond the pool size.",
+    ['bind'],
+    multiprocess_mode='livesum')
+
+POOL_SIZE = Gauge(
+    'warbler_db_pool_size',
+    "Connections the pool keeps open.",
+    ['bind'],
+    multiprocess_mode='livesum')
+
+POOL_WAIT = Histogram(
+    'warbler_db_pool_wait_seconds',
+    "Time spent waiting to check out a database connection.",
+    ['bind'],
+    buckets=(.0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 30))
+
+POOL_TIMEOUTS = Counter(
+    'warbler_db_pool_timeouts',
+    "Checkouts that gave up waiting for a free connection.",
+    ['bind'])
+
+CACHE_REQUESTS = Counter(
+    'warbler_cache_requests',
+    "Cache lookups, by cache and result.",
+    ['cache', 'result'])
+
+# name -> [cache, hits already counted, misses already counted]
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that reports its usage and checkout waits.
+
+    Pools don't know which engine they belong to, so `bind` is filled in
+    when the engine first connects (see `_name_pool`); until then, the
+    very first checkout, nothing is reported.
+    """
+
+    bind = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            if self.bind:
+                POOL_TIMEOUTS.labels(self.bind).inc()
+            raise
+        finally:
+            if self.bind:
+                POOL_WAIT.labels(self.bind).observe(
+                    time.perf_counter() - start)
+            self._report()
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self._report()
+
+    def _report(self):
+        if self.bind:
+            POOL_CHECKED_OUT.labels(self.bind).set(self.checkedout())
+            POOL_OVERFLOW.labels(self.bind).set(max(self.overflow(), 0))
+            POOL_SIZE.labels(self.bind).set(self.size())
+
+
+def bind_name(app, url):
+    """'primary', or the SQLALCHEMY_BINDS key of the database at `url`."""
+
+    url = str(url)
+
+    if url == str(make_url(app.config['SQLALCHEMY_DATABASE_URI'])):
+        return 'primary'
+
+    for key, uri in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        if url == str(make_url(uri)):
+            return key
+
+    return make_url(url).database or 'unknown'
+
+
+def _name_pool(app):
+    def name(conn, branch):
+        pool = conn.engine.pool
+
+        if isinstance(pool, InstrumentedQueuePool) and pool.bind is None:
+            pool.bind = bind_name(app, conn.engine.url)
+            pool._report()
+
+    return name
+
+
+def register_cache(name, cache):
+    """Export hit/miss counts of `cache`, which has `hits` and `misses`."""
+
+    with _caches_lock:
+        _caches[name] = [cache, cache.hits, cache.misses]
+
+
+def _count_cache_requests():
+    # Caches keep plain counters; add what changed since we last looked.
+    # Requests on other threads do the same, so only one at a time may.
+    with _caches_lock:
+        for name, seen in _caches.items():
+            cache, hits, misses = seen
+            now_hits, now_misses = cache.hits, cache.misses
+
+            if now_hits > hits:
+                CACHE_REQUESTS.labels(name, 'hit').inc(now_hits - hits)
+            if now_misses > misses:
+                CACHE_REQUESTS.labels(name, 'miss').inc(now_misses - misses)
+
+            seen[1:] = [now_hits, now_misses]
+
+
+def _start_request():
+    g.metrics_started = time.perf_counter()
+    IN_FLIGHT.inc()
+
+
+def _observe_request(response):
+    started = g.get('metrics_started')
+
+    if started is not None:
+        endpoint = request.endpoint or 'unmatched'
+        REQUEST_DURATION.labels(
+            endpoint, request.method, response.status_code
+        ).observe(time.perf_counter() - started)
+
+    _count_cache_requests()
+    return response
+
+
+def _finish_request(exc):
+    if g.pop('metrics_started', None) is not None:
+        IN_FLIGHT.dec()
+
+
+def metrics_view():
+    """Current metrics in the Prometheus text format."""
+
+    _count_cache_requests()
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def mark_process_dead(pid):
+    """Drop a dead worker's live gauges (call from gunicorn's child_exit)."""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+def init_app(app):
+    """Record request metrics, instrument the pool and serve /metrics.
+
+    You should call this in your Flask app, before anything uses the
+    database (the pool class is set when the engine is created).
+    """
+
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+
+    if url.get_backend_name() != 'sqlite':
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        options.setdefault('poolclass', InstrumentedQueuePool)
+        event.listen(Engine, 'engine_connect', _name_pool(app))
+
+    app.before_request(_start_request)
+    app.after_request(_observe_request)
+    app.teardown_request(_finish_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,51 @@
+"""Precomputed home timelines: the timeline_entries table, filled in.
+
+Each follower gets the newest TIMELINE_MAX_ENTRIES messages of the
+authors they follow who have at most TIMELINE_PUSH_MAX_FOLLOWERS
+followers. Messages of more-followed authors are pulled in when
+timelines are read, as `TimelineEntry.rebuild` does. The backfill is a
+single INSERT ... SELECT, and it is skipped if the table already has
+rows.
+"""
+
+from sqlalchemy import text
+
+from models import TimelineEntry
+
+
+def upgrade(conn):
+    conn.execute(
+        'CREATE TABLE IF NOT EXISTS timeline_entries ('
+        ' user_id INTEGER NOT NULL'
+        '  REFERENCES users (id) ON DELETE CASCADE,'
+        ' message_id INTEGER NOT NULL'
+        '  REFERENCES messages (id) ON DELETE CASCADE,'
+        ' author_id INTEGER NOT NULL'
+        '  REFERENCES users (id) ON DELETE CASCADE,'
+        ' "timestamp" TIMESTAMP WITHOUT TIME ZONE NOT NULL,'
+        ' PRIMARY KEY (user_id, message_id))')
+    conn.execute('CREATE INDEX IF NOT EXISTS '
+                 'ix_timeline_entries_user_id_timestamp '
+                 'ON timeline_entries (user_id, "timestamp", message_id)')
+
+    if conn.execute('SELECT 1 FROM timeline_entries LIMIT 1').scalar():
+        return
+
+    conn.execute(text(
+        'INSERT INTO timeline_entries '
+        ' (user_id, message_id, author_id, "timestamp") '
+        'SELECT user_id, message_id, author_id, "timestamp" FROM ('
+        ' SELECT f.user_following_id AS user_id, m.id AS message_id,'
+        '  m.user_id AS author_id, m."timestamp",'
+        '  row_number() OVER (PARTITION BY f.user_following_id'
+        '   ORDER BY m."timestamp" DESC, m.id DESC) AS position'
+        ' FROM follows f'
+        ' JOIN messages m ON m.user_id = f.user_being_followed_id'
+        ' WHERE f.user_being_followed_id IN ('
+        '  SELECT user_being_followed_id FROM follows'
+        '  GROUP BY user_being_followed_id'
+        '  HAVING count(*) <= :push_max)'
+        ') AS ranked '
+        'WHERE position <= :keep'),
+        push_max=TimelineEntry.push_max_followers(),
+        keep=TimelineEntry.max_entries())
@@ -0,0 +1,44 @@
+"""Cached message, follow and like counters on users.
+
+Adds users.messages_count, following_count, followers_count and
+likes_count, then fills them in BATCH users at a time. Each batch
+commits on its own, so a failed run picks up where it stopped. Writes
+made while the backfill runs can leave a counter off by one; run `flask
+recount-users` once the new code is deployed.
+"""
+
+from sqlalchemy import inspect, text
+
+transactional = False
+
+BATCH = 10_000
+
+COUNTERS = {
+    'messages_count': 'SELECT count(*) FROM messages '
+                      'WHERE messages.user_id = users.id',
+    'following_count': 'SELECT count(*) FROM follows '
+                       'WHERE follows.user_following_id = users.id',
+    'followers_count': 'SELECT count(*) FROM follows '
+                       'WHERE follows.user_being_followed_id = users.id',
+    'likes_count': 'SELECT count(*) FROM likes '
+                   'WHERE likes.user_id = users.id',
+}
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+
+    for name in COUNTERS:
+        if name not in columns:
+            # A constant default doesn't rewrite the table on Postgres 11+.
+            conn.execute(f'ALTER TABLE users '
+                         f'ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0')
+
+    counts = ', '.join(f'{name} = ({count})'
+                       for name, count in COUNTERS.items())
+    last = conn.execute('SELECT max(id) FROM users').scalar() or 0
+
+    for start in range(0, last, BATCH):
+        conn.execute(text(f'UPDATE users SET {counts} '
+                          f'WHERE id > :start AND id <= :stop'),
+                     start=start, stop=start + BATCH)
@@ -0,0 +1,26 @@
+"""users.updated_at, the version of everything on a user's profile header.
+
+Existing users get the time of the migration. Conditional GETs and
+cached fragments are keyed on it, so it only has to change from here on.
+"""
+
+from sqlalchemy import inspect
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+
+    if 'updated_at' in columns:
+        return
+
+    if conn.dialect.name == 'postgresql':
+        # now() is stable, so Postgres 11+ stores the default once instead
+        # of rewriting the table.
+        conn.execute("ALTER TABLE users ADD COLUMN updated_at "
+                     "TIMESTAMP WITHOUT TIME ZONE NOT NULL "
+                     "DEFAULT timezone('utc', now())")
+    else:
+        # SQLite only adds columns with constant defaults.
+        conn.execute("ALTER TABLE users ADD COLUMN updated_at DATETIME "
+                     "NOT NULL DEFAULT '1970-01-01 00:00:00'")
+        conn.execute("UPDATE users SET updated_at = CURRENT_TIMESTAMP")
@@ -0,0 +1,42 @@
+"""Let every user like a message once, instead of one like per message.
+
+The original schema had UNIQUE (message_id) on likes, so only the first
+user to like a message could. The model now has UNIQUE (user_id,
+message_id) instead, plus an index on (message_id, user_id) for the
+per-page like counts.
+
+On Postgres the new unique index is built CONCURRENTLY and then attached
+as the constraint, and the old constraint is dropped last. Existing rows
+can't conflict with the new constraint, because the old one was stricter.
+SQLite can't change constraints in place; rebuild such a database from
+the models instead.
+"""
+
+from sqlalchemy import text
+
+from migrations import create_index
+
+transactional = False
+
+CONSTRAINT = 'likes_user_id_message_id_key'
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_likes_message_id_user_id', 'likes',
+                 'message_id, user_id')
+
+    if conn.dialect.name != 'postgresql':
+        return
+
+    attached = conn.execute(text(
+        "SELECT 1 FROM pg_constraint WHERE conname = :name"),
+        name=CONSTRAINT).scalar()
+
+    if not attached:
+        create_index(conn, CONSTRAINT, 'likes', 'user_id, message_id',
+                     unique=True)
+        conn.execute(f'ALTER TABLE likes ADD CONSTRAINT {CONSTRAINT} '
+                     f'UNIQUE USING INDEX {CONSTRAINT}')
+
+    conn.execute('ALTER TABLE likes DROP CONSTRAINT IF EXISTS '
+                 'likes_message_id_key')
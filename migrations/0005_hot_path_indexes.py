@@ -0,0 +1,24 @@
+"""Indexes for the profile, following and likes queries.
+
+- messages(user_id, timestamp DESC, id DESC): a user's messages newest
+  first, for profiles, timeline backfills and pulled timelines.
+- follows(user_following_id, user_being_followed_id): whom a user follows.
+  The primary key leads with the followed user, so it only serves
+  followers lookups.
+- likes(user_id, id): a user's likes, latest first.
+"""
+
+from migrations import create_index
+
+transactional = False
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_messages_user_id_timestamp_id', 'messages',
+                 'user_id, "timestamp" DESC, id DESC')
+    create_index(conn, 'ix_follows_user_following_id_user_being_followed_id',
+                 'follows', 'user_following_id, user_being_followed_id')
+    create_index(conn, 'ix_likes_user_id_id', 'likes', 'user_id, id')
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute('ANALYZE messages, follows, likes')
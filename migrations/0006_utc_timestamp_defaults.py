@@ -0,0 +1,25 @@
+"""Server-side UTC defaults for messages.timestamp and users.updated_at.
+
+`Message.timestamp` used to default to `datetime.utcnow()` evaluated once
+at import, so every message a process wrote got the same timestamp. The
+model now calls it per row, and the database fills in the current UTC time
+for rows inserted without one (bulk loads, manual SQL). A users.updated_at
+column that `create_all()` built before 0003 existed has a server default
+of `now()`, which is local time on servers not set to UTC.
+
+Only the defaults change; timestamps already written aren't touched.
+SQLite can't change a column's default in place; the model's Python
+defaults cover it.
+"""
+
+UTC_NOW = "timezone('utc', now())"
+
+
+def upgrade(conn):
+    if conn.dialect.name != 'postgresql':
+        return
+
+    conn.execute(f'ALTER TABLE messages ALTER COLUMN "timestamp" '
+                 f'SET DEFAULT {UTC_NOW}')
+    conn.execute(f'ALTER TABLE users ALTER COLUMN updated_at '
+                 f'SET DEFAULT {UTC_NOW}')
@@ -0,0 +1,45 @@
+"""Cached like counters on messages, for the trending page.
+
+- messages.likes_count, backfilled from the likes table BATCH messages at
+  a time. Each batch commits on its own, so no long transaction holds
+  row locks, and a failed run picks up where it stopped.
+- messages(timestamp): the recent messages a trending refresh looks at.
+
+The trending_messages table is new, so `db.create_all()` creates it.
+Likes made while the backfill runs can leave a counter off by one; run
+`flask recount-users` once the new code is deployed.
+"""
+
+from sqlalchemy import inspect, text
+
+from migrations import create_index
+
+transactional = False
+
+BATCH = 10_000
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('messages')}
+
+    if 'likes_count' not in columns:
+        # A constant default doesn't rewrite the table on Postgres 11+.
+        conn.execute('ALTER TABLE messages '
+                     'ADD COLUMN likes_count INTEGER NOT NULL DEFAULT 0')
+
+    last = conn.execute('SELECT max(id) FROM messages').scalar() or 0
+
+    for start in range(0, last, BATCH):
+        conn.execute(text(
+            "UPDATE messages SET likes_count = counted.likes "
+            "FROM (SELECT message_id, count(*) AS likes FROM likes "
+            "      WHERE message_id > :start AND message_id <= :stop "
+            "      GROUP BY message_id) AS counted "
+            "WHERE messages.id = counted.message_id "
+            "AND messages.likes_count <> counted.likes"),
+            start=start, stop=start + BATCH)
+
+    create_index(conn, 'ix_messages_timestamp', 'messages', '"timestamp"')
+
+    if conn.dialect.name == 'postgresql':
+        conn.execute('ANALYZE messages')
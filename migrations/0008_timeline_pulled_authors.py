@@ -0,0 +1,23 @@
+"""users.timeline_pulled, a sticky per-author timeline mode.
+
+Authors used to switch between fan-out and pull with their follower
+count, so dropping back under TIMELINE_PUSH_MAX_FOLLOWERS hid the
+messages they wrote while pulled. Authors over the limit now are marked
+pulled, which matches the timelines they already have.
+"""
+
+from sqlalchemy import inspect, text
+
+from models import TimelineEntry
+
+
+def upgrade(conn):
+    columns = {column['name'] for column in inspect(conn).get_columns('users')}
+
+    if 'timeline_pulled' not in columns:
+        conn.execute('ALTER TABLE users ADD COLUMN timeline_pulled '
+                     'BOOLEAN NOT NULL DEFAULT false')
+
+    conn.execute(text('UPDATE users SET timeline_pulled = true '
+                      'WHERE followers_count > :push_max'),
+                 push_max=TimelineEntry.push_max_followers())
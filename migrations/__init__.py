@@ -0,0 +1,171 @@
+"""Versioned schema migrations for Warbler.
+
+`db.create_all()` only creates missing tables, so changes to existing
+tables (new indexes, new column defaults) ship as numbered modules in
+this package, e.g. `0005_hot_path_indexes.py`. Each defines:
+
+- `upgrade(conn)`: apply the change on a SQLAlchemy connection.
+- `transactional` (optional, default True): set it to False for steps
+  that can't run inside a transaction, like CREATE INDEX CONCURRENTLY.
+  They run in autocommit mode and must be safe to re-run after failing
+  partway through.
+
+They are numbered in the order the changes were made, starting from the
+original schema in `migrations/baseline.py`. Tables that are new and
+need no backfill (e.g. suggestions) aren't migrated; `migrate` creates
+them from the models once the migrations have run.
+
+The schema_migrations table records which versions a database has.
+`flask migrate` applies the missing ones in order and
+`flask migration-status` lists them. Migrations are written to be no-ops
+on a database that `create_all()` already built from the current models,
+so fresh databases can run them too.
+"""
+
+import importlib
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import (Column, DateTime, MetaData, String, Table, select,
+                        text)
+
+from models import db
+
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.py$')
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+metadata = MetaData()
+
+schema_migrations = Table(
+    'schema_migrations', metadata,
+    Column('version', String(4), primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('applied_at', DateTime, nullable=False),
+)
+
+
+def available():
+    """Every migration in this package, oldest first."""
+
+    migrations = []
+
+    for filename in sorted(os.listdir(os.path.dirname(__file__))):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            module = importlib.import_module(f'{__name__}.{filename[:-3]}')
+            migrations.append(Migration(*match.groups(), module))
+
+    return migrations
+
+
+def applied(engine):
+    """{version: applied_at} of the migrations this database has run."""
+
+    metadata.create_all(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(select([schema_migrations.c.version,
+                                    schema_migrations.c.applied_at]))
+        return {version: applied_at for version, applied_at in rows}
+
+
+def pending(engine):
+    """Migrations this database hasn't run yet, oldest first."""
+
+    done = applied(engine)
+    return [m for m in available() if m.version not in done]
+
+
+def apply(engine, migration):
+    """Run one migration and record it."""
+
+    if getattr(migration.module, 'transactional', True):
+        with engine.begin() as conn:
+            migration.module.upgrade(conn)
+            record(conn, migration)
+    else:
+        with engine.connect() as conn:
+            migration.module.upgrade(
+                conn.execution_options(isolation_level='AUTOCOMMIT'))
+
+        with engine.begin() as conn:
+            record(conn, migration)
+
+
+def record(conn, migration):
+    conn.execute(schema_migrations.insert(),
+                 version=migration.version, name=migration.name,
+                 applied_at=datetime.utcnow())
+
+
+def migrate(engine, log=print):
+    """Apply every pending migration in order, then create new tables.
+
+    Returns how many migrations ran.
+    """
+
+    migrations = pending(engine)
+
+    for migration in migrations:
+        log(f"Applying {migration.version} {migration.name}...")
+        apply(engine, migration)
+
+    db.Model.metadata.create_all(engine)
+
+    return len(migrations)
+
+
+def create_index(conn, name, table, columns, unique=False):
+    """Build an index if it's missing, without blocking writes on Postgres.
+
+    `columns` is the SQL column list, e.g. '"timestamp" DESC'. Postgres
+    builds it CONCURRENTLY, which needs an autocommit connection (a
+    non-transactional migration). A concurrent build that failed leaves
+    an invalid index behind; it is dropped and built again.
+    """
+
+    create = 'CREATE UNIQUE INDEX' if unique else 'CREATE INDEX'
+
+    if conn.dialect.name != 'postgresql':
+        conn.execute(f'{create} IF NOT EXISTS {name} ON {table} ({columns})')
+        return
+
+    valid = conn.execute(text(
+        "SELECT i.indisvalid FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "WHERE c.relname = :name"), name=name).scalar()
+
+    if valid is False:
+        conn.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+
+    conn.execute(f'{create} CONCURRENTLY IF NOT EXISTS {name} '
+                 f'ON {table} ({columns})')
+
+
+def init_app(app):
+    """Add the `flask migrate` and `flask migration-status` commands.
+
+    You should call this in your Flask app.
+    """
+
+    @app.cli.command('migrate')
+    def migrate_command():
+        """Apply pending schema migrations."""
+
+        count = migrate(db.engine)
+        print(f"Applied {count} migrations." if count
+              else "Database is up to date.")
+
+    @app.cli.command('migration-status')
+    def migration_status():
+        """List schema migrations and when each was applied."""
+
+        done = applied(db.engine)
+
+        for migration in available():
+            when = done.get(migration.version)
+            print(f"{migration.version} {migration.name:<40} "
+                  f"{when.isoformat(' ', 'seconds') if when else 'pending'}")
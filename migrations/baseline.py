@@ -0,0 +1,55 @@
+"""The schema Warbler's migrations start from.
+
+These are the four tables as the app first shipped them, before any
+migration. Tests and benchmarks/explain_queries.py build them to get a
+real pre-migration database. Don't change them; schema changes belong in
+numbered migrations.
+"""
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Integer, MetaData,
+                        String, Table, Text)
+
+metadata = MetaData()
+
+users = Table(
+    'users', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('email', Text, nullable=False, unique=True),
+    Column('username', Text, nullable=False, unique=True),
+    Column('image_url', Text),
+    Column('header_image_url', Text),
+    Column('bio', Text),
+    Column('location', Text),
+    Column('password', Text, nullable=False),
+)
+
+messages = Table(
+    'messages', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('text', String(140), nullable=False),
+    Column('timestamp', DateTime, nullable=False),
+    Column('user_id', Integer,
+           ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+)
+
+follows = Table(
+    'follows', metadata,
+    Column('user_being_followed_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    Column('user_following_id', Integer,
+           ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+)
+
+likes = Table(
+    'likes', metadata,
+    Column('id', Integer, primary_key=True),
+    Column('user_id', Integer, ForeignKey('users.id', ondelete='cascade')),
+    Column('message_id', Integer,
+           ForeignKey('messages.id', ondelete='cascade'), unique=True),
+)
+
+
+def create(engine):
+    """Create the original tables on an empty database."""
+
+    metadata.create_all(engine)
@@ -1,12 +1,63 @@
 """SQLAlchemy models for Warbler."""
 
-from datetime import datetime
+import math
+from collections import namedtuple
+from datetime import datetime, timedelta
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import exists, literal, select, union_all
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from pagination import decode_cursor, keyset, keyset_page, make_page
+from passwords import hasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+LikeSummary = namedtuple('LikeSummary', ['liked', 'counts'])
+
+
+class utcnow(FunctionElement):
+    """The database's current time in UTC, without a timezone.
+
+    For server-side defaults of the naive-UTC DateTime columns, which
+    `now()` would fill in the database session's local time.
+    """
+
+    type = db.DateTime()
+
+
+@compiles(utcnow, 'postgresql')
+def _postgresql_utcnow(element, compiler, **kw):
+    return "timezone('utc', now())"
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+def insert_ignoring_duplicates(table, values, require):
+    """INSERT `values` unless the row exists or `require` doesn't hold.
+
+    One statement: ON CONFLICT DO NOTHING on Postgres, INSERT OR IGNORE
+    elsewhere. Returns True if a row was inserted.
+    """
+
+    columns = list(values)
+    rows = select([literal(values[c]) for c in columns]).where(require)
+
+    if db.engine.dialect.name == 'postgresql':
+        statement = (postgresql.insert(table)
+                     .from_select(columns, rows)
+                     .on_conflict_do_nothing())
+    else:
+        statement = (table.insert()
+                     .from_select(columns, rows)
+                     .prefix_with('OR IGNORE'))
+
+    return db.session.execute(statement).rowcount > 0
 
 
 class Follows(db.Model):
@@ -26,6 +77,54 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key serves "who follows X"; this serves "whom X follows".
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id_user_being_followed_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    # add/remove write single rows, never loading either user's follow
+    # lists, and only touch counters and timelines when a row changed, so
+    # repeating one (a double submit, a write-behind retry) is harmless.
+
+    @classmethod
+    def add(cls, user_id, followed_id):
+        """Have `user_id` follow `followed_id`. Returns True if it's new."""
+
+        added = insert_ignoring_duplicates(
+            cls.__table__,
+            {'user_being_followed_id': followed_id,
+             'user_following_id': user_id},
+            exists().where(User.id == followed_id)
+            & exists().where(User.id == user_id))
+
+        if added:
+            User.bump_counts(user_id, following=1)
+            User.bump_counts(followed_id, followers=1)
+            TimelineEntry.mark_pulled(followed_id)
+            TimelineEntry.backfill(user_id, followed_id)
+
+        return added
+
+    @classmethod
+    def remove(cls, user_id, followed_id):
+        """Have `user_id` stop following `followed_id`.
+
+        Returns True if they were following.
+        """
+
+        removed = (cls.query
+                   .filter_by(user_being_followed_id=followed_id,
+                              user_following_id=user_id)
+                   .delete(synchronize_session=False)) > 0
+
+        if removed:
+            User.bump_counts(user_id, following=-1)
+            User.bump_counts(followed_id, followers=-1)
+            TimelineEntry.prune_author(user_id, followed_id)
+
+        return removed
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
@@ -45,9 +144,79 @@ class Likes(db.Model):
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
     )
 
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id'),
+        db.Index('ix_likes_message_id_user_id', 'message_id', 'user_id'),
+        db.Index('ix_likes_user_id_id', 'user_id', 'id'),
+    )
+
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Have `user_id` like `message_id`. Returns True if it's new.
+
+        Like `Follows.add`, one idempotent statement plus counter updates.
+        """
+
+        added = insert_ignoring_duplicates(
+            cls.__table__,
+            {'user_id': user_id, 'message_id': message_id},
+            exists().where(Message.id == message_id)
+            & exists().where(User.id == user_id))
+
+        if added:
+            User.bump_counts(user_id, likes=1)
+            Message.bump_likes(message_id, 1)
+
+        return added
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Take back `user_id`'s like of `message_id`.
+
+        Returns True if there was one.
+        """
+
+        removed = (cls.query
+                   .filter_by(user_id=user_id, message_id=message_id)
+                   .delete(synchronize_session=False)) > 0
+
+        if removed:
+            User.bump_counts(user_id, likes=-1)
+            Message.bump_likes(message_id, -1)
+
+        return removed
+
+    @classmethod
+    def summarize(cls, message_ids, user_id):
+        """Like counts for `message_ids`, and which of them `user_id` likes.
+
+        One grouped query over the likes index, limited to the given
+        messages (e.g. the ones on the current page).
+        """
+
+        message_ids = set(message_ids)
+        if not message_ids:
+            return LikeSummary(liked=set(), counts={})
+
+        liked_by_user = db.func.max(
+            db.case([(cls.user_id == user_id, 1)], else_=0))
+
+        rows = (db.session
+                .query(cls.message_id, db.func.count(), liked_by_user)
+                .filter(cls.message_id.in_(message_ids))
+                .group_by(cls.message_id))
+
+        liked = set()
+        counts = {}
+        for message_id, count, is_liked in rows:
+            counts[message_id] = count
+            if is_liked:
+                liked.add(message_id)
+
+        return LikeSummary(liked=liked, counts=counts)
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +263,59 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Cached stat counters, kept up to date by the routes that change them.
+    # `User.recount()` repairs them from the underlying tables.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Set once followers_count passes TIMELINE_PUSH_MAX_FOLLOWERS: from then
+    # on the user's messages are pulled into home timelines when they are
+    # read instead of fanned out. It stays set if followers drop back
+    # below, since messages written meanwhile were never pushed; `flask
+    # rebuild-timelines` recomputes it.
+    timeline_pulled = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # Bumped by every change to the user or its counters, so it versions
+    # everything shown on the user's profile header.
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        server_default=utcnow(),
+    )
+
     messages = db.relationship('Message')
 
     followers = db.relationship(
@@ -121,28 +343,181 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return self.id in other_user.following_among([self.id])
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
-    
-    def get_following_messages(self):
-        following_messages = []
-        for u in self.following:
-            following_messages.extend(u.messages)
-        
-        return following_messages
+        return other_user.id in self.following_among([other_user.id])
+
+    def following_among(self, user_ids):
+        """Which of `user_ids` does this user follow?
+
+        Returns a set of ids, looked up with a single query on the follows
+        primary key, so templates can check many user cards at once.
+        """
+
+        user_ids = set(user_ids)
+        if not user_ids:
+            return set()
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id,
+                            Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in followed}
+
+    def followers_page(self, limit, before=None, after=None):
+        """A `pagination.Page` of this user's followers, highest id first.
+
+        Ordered by follower id, which the follows primary key covers; follows
+        have no timestamp, so this isn't the order they followed in.
+        Raises ValueError if a cursor is malformed.
+        """
+
+        followers = (User.query
+                     .options(*loading('user_cards'))
+                     .join(Follows, Follows.user_following_id == User.id)
+                     .filter(Follows.user_being_followed_id == self.id))
+
+        return keyset_page(followers, (Follows.user_following_id,), (int,),
+                           limit, key=lambda user: (user.id,),
+                           before=before, after=after)
+
+    def following_page(self, limit, before=None, after=None):
+        """A `pagination.Page` of users this user follows, highest id first.
+
+        Like `followers_page`, ordered by user id, not by when they were
+        followed. Raises ValueError if a cursor is malformed.
+        """
+
+        following = (User.query
+                     .options(*loading('user_cards'))
+                     .join(Follows, Follows.user_being_followed_id == User.id)
+                     .filter(Follows.user_following_id == self.id))
+
+        return keyset_page(following, (Follows.user_being_followed_id,),
+                           (int,), limit, key=lambda user: (user.id,),
+                           before=before, after=after)
+
+    def likes_page(self, limit, before=None, after=None):
+        """A `pagination.Page` of messages this user liked, latest like first.
+
+        Raises ValueError if a cursor is malformed.
+        """
+
+        liked = (db.session
+                 .query(Message, Likes.id)
+                 .join(Likes, Likes.message_id == Message.id)
+                 .options(*loading('messages_with_authors'))
+                 .filter(Likes.user_id == self.id))
+
+        page = keyset_page(liked, (Likes.id,), (int,), limit,
+                           key=lambda row: (row[1],),
+                           before=before, after=after)
+
+        return page._replace(items=[msg for msg, _ in page.items])
+
+    @classmethod
+    def page_all(cls, limit, before=None, after=None):
+        """A `pagination.Page` of every user, highest id first.
+
+        Raises ValueError if a cursor is malformed.
+        """
+
+        return keyset_page(cls.query.options(*loading('user_cards')),
+                           (cls.id,), (int,), limit,
+                           key=lambda user: (user.id,),
+                           before=before, after=after)
+
+    def get_following_messages(self, limit=100):
+        """Most recent messages of followed users, newest first."""
+
+        return TimelineEntry.for_user(self, limit=limit)
     
-    def get_likes(self):
-        likes = []
-        for l in self.likes:
-            likes.append(l.id)
-        return likes
-            
+    def release_counts(self):
+        """Take this user out of other users' counters before deleting it.
+
+        Users it follows lose a follower, its followers lose a following,
+        users who liked its messages lose those likes, and messages it
+        liked lose a like.
+        """
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id))
+        (User.query
+         .filter(User.id.in_(followed))
+         .update({User.followers_count: User.followers_count - 1},
+                 synchronize_session=False))
+
+        followers = (db.session
+                     .query(Follows.user_following_id)
+                     .filter(Follows.user_being_followed_id == self.id))
+        (User.query
+         .filter(User.id.in_(followers))
+         .update({User.following_count: User.following_count - 1},
+                 synchronize_session=False))
+
+        liked = (db.session
+                 .query(Likes.message_id)
+                 .filter(Likes.user_id == self.id))
+        (Message.query
+         .filter(Message.id.in_(liked))
+         .update({Message.likes_count: Message.likes_count - 1},
+                 synchronize_session=False))
+
+        received_likes = (db.session
+                          .query(Likes.user_id)
+                          .join(Message, Message.id == Likes.message_id)
+                          .filter(Message.user_id == self.id))
+        likes_lost = (db.session
+                      .query(db.func.count(Likes.id))
+                      .join(Message, Message.id == Likes.message_id)
+                      .filter(Message.user_id == self.id,
+                              Likes.user_id == User.id)
+                      .correlate(User)
+                      .as_scalar())
+        (User.query
+         .filter(User.id.in_(received_likes), User.id != self.id)
+         .update({User.likes_count: User.likes_count - likes_lost},
+                 synchronize_session=False))
+
+
+    @classmethod
+    def bump_counts(cls, user_id, **deltas):
+        """Atomically add `deltas` to a user's cached stat counters.
+
+        Keys are counter names without the `_count` suffix, so
+        `User.bump_counts(user.id, messages=1)` adds one to messages_count.
+        """
+
+        values = {}
+        for name, delta in deltas.items():
+            column = getattr(cls, f'{name}_count')
+            values[column] = column + delta
+
+        (cls.query
+         .filter(cls.id == user_id)
+         .update(values, synchronize_session=False))
+
+    @classmethod
+    def recount(cls):
+        """Recompute every user's cached stat counters from scratch."""
+
+        def count(match):
+            return (db.select([db.func.count()])
+                    .where(match == cls.id)
+                    .correlate(cls)
+                    .as_scalar())
+
+        return cls.query.update({
+            cls.messages_count: count(Message.user_id),
+            cls.following_count: count(Follows.user_following_id),
+            cls.followers_count: count(Follows.user_being_followed_id),
+            cls.likes_count: count(Likes.user_id),
+        }, synchronize_session=False)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -151,7 +526,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -172,13 +547,19 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the stored hash was made with a different bcrypt cost than the
+        one configured now, it is replaced with a fresh hash; the caller
+        should commit.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -202,7 +583,8 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
+        server_default=utcnow(),
     )
 
     user_id = db.Column(
@@ -211,8 +593,569 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Cached like counter, kept up to date like the User counters and
+    # repaired by `Message.recount()`.
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    @classmethod
+    def bump_likes(cls, message_id, delta):
+        """Atomically add `delta` to a message's cached like counter."""
+
+        (cls.query
+         .filter(cls.id == message_id)
+         .update({cls.likes_count: cls.likes_count + delta},
+                 synchronize_session=False))
+
+    @classmethod
+    def recount(cls):
+        """Recompute every message's cached like counter from scratch."""
+
+        likes = (db.select([db.func.count()])
+                 .where(Likes.message_id == cls.id)
+                 .correlate(cls)
+                 .as_scalar())
+
+        return cls.query.update({cls.likes_count: likes},
+                                synchronize_session=False)
+
+    def release_counts(self):
+        """Take this message's likes out of its likers' counters.
+
+        Call before deleting the message; its likes are removed with it.
+        """
+
+        likers = (db.session
+                  .query(Likes.user_id)
+                  .filter(Likes.message_id == self.id))
+        (User.query
+         .filter(User.id.in_(likers))
+         .update({User.likes_count: User.likes_count - 1},
+                 synchronize_session=False))
+
+
+# A user's messages, newest first: profiles, backfills and the pulled side
+# of home timelines.
+db.Index('ix_messages_user_id_timestamp_id',
+         Message.user_id, Message.timestamp.desc(), Message.id.desc())
+
+# Recent messages, for refreshing the trending ranking.
+db.Index('ix_messages_timestamp', Message.timestamp)
+
+
+class TimelineEntry(db.Model):
+    """A message pushed into a follower's precomputed home timeline.
+
+    Messages are fanned out to followers when they are written, so reading
+    a timeline is a single indexed range scan. Once an author has more than
+    TIMELINE_PUSH_MAX_FOLLOWERS followers they are marked
+    `User.timeline_pulled` and no longer fanned out; their messages are
+    pulled and merged in when the timeline is read.
+
+    Backfills trim the one timeline they write to. Fan-outs touch every
+    follower's timeline, too many to trim inside a request, so `flask
+    trim-timelines` cuts them back to TIMELINE_MAX_ENTRIES rows; run it
+    periodically.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+    )
+
+    @staticmethod
+    def push_max_followers():
+        return db.get_app().config.get('TIMELINE_PUSH_MAX_FOLLOWERS', 5000)
+
+    @staticmethod
+    def max_entries():
+        return db.get_app().config.get('TIMELINE_MAX_ENTRIES', 800)
+
+    @classmethod
+    def is_pushed_author(cls, author_id):
+        """Are messages by `author_id` fanned out at write time?"""
+
+        pulled = (db.session
+                  .query(User.timeline_pulled)
+                  .filter(User.id == author_id)
+                  .scalar())
+        return not pulled
+
+    @classmethod
+    def mark_pulled(cls, author_id):
+        """Switch `author_id` to pull mode if they have too many followers.
+
+        The switch is one-way: see `User.timeline_pulled`.
+        """
+
+        (User.query
+         .filter(User.id == author_id,
+                 User.followers_count > cls.push_max_followers(),
+                 User.timeline_pulled == db.false())
+         .update({User.timeline_pulled: True}, synchronize_session=False))
+
+    @classmethod
+    def fan_out(cls, message):
+        """Push a newly written message into its author's followers' timelines.
+
+        The message must already be flushed so it has an id and timestamp.
+        """
+
+        if not cls.is_pushed_author(message.user_id):
+            return
+
+        followers = (db.session
+                     .query(Follows.user_following_id,
+                            db.literal(message.id),
+                            db.literal(message.user_id),
+                            db.literal(message.timestamp))
+                     .filter(Follows.user_being_followed_id == message.user_id))
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            followers.statement))
+
+    @classmethod
+    def retract(cls, message):
+        """Remove a message from every timeline it was pushed to."""
+
+        cls.query.filter(cls.message_id == message.id).delete(
+            synchronize_session=False)
+
+    @classmethod
+    def backfill(cls, user_id, author_id):
+        """Copy an author's recent messages into a new follower's timeline."""
+
+        if not cls.is_pushed_author(author_id):
+            return
+
+        recent = (db.session
+                  .query(db.literal(user_id), Message.id,
+                         Message.user_id, Message.timestamp)
+                  .filter(Message.user_id == author_id)
+                  .order_by(Message.timestamp.desc())
+                  .limit(cls.max_entries()))
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            recent.statement))
+
+        cls.trim(user_ids=[user_id])
+
+    @classmethod
+    def prune_author(cls, user_id, author_id):
+        """Drop an unfollowed author's messages from a user's timeline."""
+
+        (cls.query
+         .filter(cls.user_id == user_id, cls.author_id == author_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def trim(cls, user_ids=None):
+        """Cut timelines down to their newest TIMELINE_MAX_ENTRIES rows.
+
+        Trims the timelines of `user_ids` (a list of ids or a select of
+        them), or by default every timeline over the limit; counting them
+        is an index-only scan, and only their rows are ranked. Returns the
+        number of entries removed.
+        """
+
+        if user_ids is None:
+            user_ids = (db.session
+                        .query(cls.user_id)
+                        .group_by(cls.user_id)
+                        .having(db.func.count() > cls.max_entries())
+                        .statement)
+
+        position = (db.func.row_number()
+                    .over(partition_by=cls.user_id,
+                          order_by=(cls.timestamp.desc(),
+                                    cls.message_id.desc()))
+                    .label('position'))
+        ranked = (db.session
+                  .query(cls.user_id, cls.message_id, position)
+                  .filter(cls.user_id.in_(user_ids))
+                  .subquery())
+        stale = (db.session.query(ranked.c.user_id, ranked.c.message_id)
+                 .filter(ranked.c.position > cls.max_entries()))
+
+        return (cls.query
+                .filter(db.tuple_(cls.user_id, cls.message_id)
+                        .in_(stale.statement))
+                .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls):
+        """Recompute every timeline from the follows and messages tables.
+
+        Authors' pull mode is reset from their current follower counts.
+        Only each follower's newest TIMELINE_MAX_ENTRIES messages are
+        inserted, so the full follows x messages join is never written.
+        """
+
+        cls.query.delete(synchronize_session=False)
+
+        User.query.update(
+            {User.timeline_pulled:
+             User.followers_count > cls.push_max_followers()},
+            synchronize_session=False)
+
+        pushed_authors = (db.session
+                          .query(User.id)
+                          .filter(User.timeline_pulled == db.false()))
+
+        position = (db.func.row_number()
+                    .over(partition_by=Follows.user_following_id,
+                          order_by=(Message.timestamp.desc(),
+                                    Message.id.desc()))
+                    .label('position'))
+        ranked = (db.session
+                  .query(Follows.user_following_id.label('user_id'),
+                         Message.id.label('message_id'),
+                         Message.user_id.label('author_id'),
+                         Message.timestamp.label('timestamp'),
+                         position)
+                  .join(Message,
+                        Message.user_id == Follows.user_being_followed_id)
+                  .filter(Follows.user_being_followed_id.in_(pushed_authors))
+                  .subquery())
+        entries = (db.session
+                   .query(ranked.c.user_id, ranked.c.message_id,
+                          ranked.c.author_id, ranked.c.timestamp)
+                   .filter(ranked.c.position <= cls.max_entries()))
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'],
+            entries.statement))
+
+    @classmethod
+    def for_user(cls, user, limit=100, before=None, after=None):
+        """Up to `limit` messages from `user`'s home timeline.
+
+        `before` and `after` are (timestamp, message id) keys from a page
+        cursor; see `pagination.keyset` for the resulting order. Pushed
+        entries and messages pulled from high-follower authors are merged
+        in one statement, each side bounded by `limit`.
+        """
+
+        pushed = keyset(db.session
+                        .query(cls.message_id.label('message_id'))
+                        .filter(cls.user_id == user.id),
+                        (cls.timestamp, cls.message_id),
+                        before=before, after=after)
+
+        pulled = keyset(db.session
+                        .query(Message.id.label('message_id'))
+                        .join(Follows,
+                              Follows.user_being_followed_id == Message.user_id)
+                        .join(User, User.id == Follows.user_being_followed_id)
+                        .filter(Follows.user_following_id == user.id)
+                        .filter(User.timeline_pulled == db.true()),
+                        (Message.timestamp, Message.id),
+                        before=before, after=after)
+
+        pushed = pushed.limit(limit).subquery()
+        pulled = pulled.limit(limit).subquery()
+
+        message_ids = union_all(
+            db.select([pushed.c.message_id]),
+            db.select([pulled.c.message_id]),
+        ).alias()
+
+        # Authors are shown with every message; load them in the same query.
+        messages = (Message.query
+                    .options(*loading('messages_with_authors'))
+                    .filter(Message.id.in_(
+                        db.select([message_ids.c.message_id]))))
+
+        return (keyset(messages, (Message.timestamp, Message.id),
+                       after=after)
+                .limit(limit)
+                .all())
+
+    @classmethod
+    def page_for(cls, user, limit=100, before=None, after=None):
+        """A `pagination.Page` of `user`'s home timeline, newest first.
+
+        `before` and `after` are opaque cursors taken from a previous page.
+        Raises ValueError if a cursor is malformed.
+        """
+
+        before_key = decode_cursor(before, datetime, int) if before else None
+        after_key = decode_cursor(after, datetime, int) if after else None
+
+        rows = cls.for_user(user, limit=limit + 1,
+                            before=before_key, after=after_key)
+
+        return make_page(rows, limit,
+                         key=lambda msg: (msg.timestamp, msg.id),
+                         before=before or None, after=after or None)
+
+
+class TrendingMessage(db.Model):
+    """A recent message's place in the trending ranking.
+
+    `score` is the log of the message's time-decayed like velocity: each
+    like gained adds weight 2^(t / TRENDING_HALF_LIFE_HOURS), t being when
+    a refresh saw it, so a like counts half as much after every half-life.
+    Keeping the log, measured from a fixed epoch, means scores never need
+    decaying in place: comparing them at any moment ranks messages by
+    their current decayed velocity. Refreshes only touch messages whose
+    like counters rose past the highest value a refresh has seen.
+    """
+
+    __tablename__ = 'trending_messages'
+
+    EPOCH = datetime(2020, 1, 1)
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    # The highest likes_count a refresh has seen for the message. Only likes
+    # beyond it add to the score, so unliking and liking again doesn't.
+    likes_seen = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # Copied from the message, so old rows can be pruned without a join.
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_trending_messages_score', 'score'),
+        db.Index('ix_trending_messages_timestamp', 'timestamp'),
+    )
+
+    @classmethod
+    def weight(cls, now):
+        """log(weight) of a like seen at `now`, for the configured half-life."""
+
+        half_life = db.get_app().config['TRENDING_HALF_LIFE_HOURS'] * 3600
+        return (now - cls.EPOCH).total_seconds() / half_life * math.log(2)
+
+    @classmethod
+    def refresh(cls, now=None):
+        """Fold likes gained since the last refresh into the ranking.
+
+        Only messages newer than TRENDING_WINDOW_HOURS are ranked; older
+        ones are dropped. Returns how many messages were rescored.
+        """
+
+        now = now or datetime.utcnow()
+        cutoff = now - timedelta(
+            hours=db.get_app().config['TRENDING_WINDOW_HOURS'])
+        weight = cls.weight(now)
+
+        changed = (db.session
+                   .query(Message.id, Message.timestamp, Message.likes_count,
+                          cls.score, cls.likes_seen)
+                   .outerjoin(cls, cls.message_id == Message.id)
+                   .filter(Message.timestamp >= cutoff,
+                           Message.likes_count
+                           > db.func.coalesce(cls.likes_seen, 0))
+                   .all())
+
+        inserts = []
+        updates = []
+
+        for message_id, timestamp, likes, score, seen in changed:
+            gained_score = math.log(likes - (seen or 0)) + weight
+
+            if seen is None:
+                inserts.append({'message_id': message_id,
+                                'score': gained_score, 'likes_seen': likes,
+                                'timestamp': timestamp})
+            else:
+                high = max(score, gained_score)
+                score = high + math.log1p(
+                    math.exp(-abs(score - gained_score)))
+                updates.append({'id': message_id, 'new_score': score,
+                                'likes': likes})
+
+        if inserts:
+            db.session.execute(cls.__table__.insert(), inserts)
+
+        if updates:
+            table = cls.__table__
+            db.session.execute(
+                table.update()
+                .where(table.c.message_id == db.bindparam('id'))
+                .values(score=db.bindparam('new_score'),
+                        likes_seen=db.bindparam('likes')),
+                updates)
+
+        cls.query.filter(cls.timestamp < cutoff).delete(
+            synchronize_session=False)
+
+        return len(inserts) + len(updates)
+
+    @classmethod
+    def top(cls, limit):
+        """The `limit` hottest messages, with their authors, in one query."""
+
+        return (Message.query
+                .join(cls, cls.message_id == Message.id)
+                .options(*loading('messages_with_authors'))
+                .order_by(cls.score.desc())
+                .limit(limit)
+                .all())
+
+
+class Suggestion(db.Model):
+    """An account suggested for a user to follow, with its score.
+
+    Computed offline by `recommendations.refresh` (`flask suggest-follows`)
+    and shown in the homepage's "Who to follow" panel.
+    """
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    @classmethod
+    def for_user(cls, user_id, limit):
+        """Up to `limit` of `user_id`'s best suggestions, as Users.
+
+        Accounts the user has followed since the suggestions were computed
+        are skipped.
+        """
+
+        followed = (db.session
+                    .query(Follows)
+                    .filter(Follows.user_following_id == user_id,
+                            Follows.user_being_followed_id
+                            == cls.suggested_id))
+
+        return (User.query
+                .options(*loading('user_cards'))
+                .join(cls, cls.suggested_id == User.id)
+                .filter(cls.user_id == user_id, ~followed.exists())
+                .order_by(cls.score.desc(), User.id)
+                .limit(limit))
+
+
+class SuggestionFingerprint(db.Model):
+    """A hash of the follows a user's suggestions were computed from.
+
+    Lets an incremental refresh skip users whose follows haven't changed.
+    """
+
+    __tablename__ = 'suggestion_fingerprints'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    fingerprint = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    computed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+# The relationships each kind of page reads, as (loader, relationship)
+# pairs: db.joinedload for many-to-one, db.selectinload for collections.
+# Queries feeding a template take their options from `loading`.
+LOADING_PROFILES = {
+    # A user's profile header; counters are columns, so nothing to load.
+    'profile': (),
+    # Users listed as cards: followers, following, search, suggestions.
+    'user_cards': (),
+    # Messages listed under their author's profile header.
+    'own_messages': (),
+    # Messages shown with their author's name and avatar.
+    'messages_with_authors': ((db.joinedload, Message.user),),
+}
+
+
+def loading(profile):
+    """Loader options for a query feeding a page of kind `profile`.
+
+    The relationships the profile names are loaded up front. With
+    LOADING_STRICT on, touching any other relationship of the loaded
+    objects raises InvalidRequestError instead of running a query per
+    row; otherwise it lazy-loads as usual.
+    """
+
+    strict = db.get_app().config['LOADING_STRICT']
+    options = []
+
+    # Built per call: chaining onto a shared loader option mutates it.
+    for loader, relationship in LOADING_PROFILES[profile]:
+        option = loader(relationship)
+        if strict:
+            option = option.raiseload('*', sql_only=True)
+        options.append(option)
+
+    if strict:
+        options.append(db.raiseload('*', sql_only=True))
+
+    return options
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -0,0 +1,113 @@
+"""Keyset pagination helpers for Warbler.
+
+Pages are addressed by opaque cursors that encode the sort key of the
+row on the edge of the page, so fetching any page is an index range scan
+no matter how deep into a collection it is.
+"""
+
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+Page = namedtuple('Page', ['items', 'newer', 'older'])
+
+
+def encode_cursor(*values):
+    """Encode sort-key values into an opaque, URL-safe cursor string."""
+
+    values = [v.isoformat() if isinstance(v, datetime) else v
+              for v in values]
+    raw = json.dumps(values, separators=(',', ':')).encode('UTF-8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, *types):
+    """Decode a cursor made by `encode_cursor` back into typed values.
+
+    Raises ValueError if the cursor is malformed or doesn't match `types`.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    if not isinstance(values, list) or len(values) != len(types):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    try:
+        return tuple(datetime.fromisoformat(value) if kind is datetime
+                     else kind(value)
+                     for kind, value in zip(types, values))
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def keyset(query, columns, before=None, after=None):
+    """Restrict and order `query` to rows on one side of a cursor key.
+
+    `columns` are the sort-key columns, most significant first. Rows older
+    than `before` come back newest first; rows newer than `after` come
+    back oldest first so the nearest rows are the ones kept by a LIMIT.
+    """
+
+    if after is not None:
+        return (query
+                .filter(tuple_(*columns) > tuple_(*after))
+                .order_by(*[column.asc() for column in columns]))
+
+    if before is not None:
+        query = query.filter(tuple_(*columns) < tuple_(*before))
+
+    return query.order_by(*[column.desc() for column in columns])
+
+
+def make_page(rows, limit, key, before=None, after=None):
+    """Build a Page from rows fetched with a keyset query.
+
+    `rows` must hold up to `limit + 1` rows, newest first when paging
+    backwards (the default) and oldest first when `after` is given. `key`
+    returns the sort-key values of a row for its cursor.
+    """
+
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+
+    if after is not None:
+        rows.reverse()
+
+    if not rows:
+        return Page(items=[], newer=before, older=after)
+
+    newer = encode_cursor(*key(rows[0]))
+    older = encode_cursor(*key(rows[-1]))
+
+    if after is not None:
+        return Page(items=rows, newer=newer if has_more else None, older=older)
+
+    return Page(items=rows,
+                newer=newer if before is not None else None,
+                older=older if has_more else None)
+
+
+def keyset_page(query, columns, types, limit, key, before=None, after=None):
+    """Fetch one `Page` of `query`, keyed on `columns` of the given `types`.
+
+    `before` and `after` are opaque cursors taken from a previous page.
+    Raises ValueError if a cursor is malformed.
+    """
+
+    before_key = decode_cursor(before, *types) if before else None
+    after_key = decode_cursor(after, *types) if after else None
+
+    rows = (keyset(query, columns, before=before_key, after=after_key)
+            .limit(limit + 1)
+            .all())
+
+    return make_page(rows, limit, key,
+                     before=before or None, after=after or None)
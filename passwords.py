@@ -0,0 +1,151 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashing and checking run on a small
+bounded thread pool (bcrypt releases the GIL while it works). The
+request thread still waits on the result, so the pool doesn't free web
+workers during a hash; it caps how many hashes run at once, so a burst of
+logins can't take every core. When too many password operations are
+already waiting, new ones fail fast with PasswordQueueFull rather than
+piling up.
+
+The bcrypt cost comes from BCRYPT_LOG_ROUNDS, or is calibrated at startup
+to take about BCRYPT_TARGET_MS on this host, but never below 10 rounds.
+Hashes made with a different cost are upgraded the next time their owner
+logs in.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask_bcrypt import Bcrypt
+
+bcrypt = Bcrypt()
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+
+
+class PasswordQueueFull(Exception):
+    """Too many password hashes are already queued; try again later."""
+
+
+def hash_cost(pw_hash):
+    """The bcrypt cost (log rounds) a hash was made with, or None."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def calibrate(target_ms, min_rounds=10, max_rounds=MAX_ROUNDS):
+    """Pick the highest bcrypt cost whose hash takes at most `target_ms`.
+
+    The result is clamped to `min_rounds`..`max_rounds`: on a host too slow
+    to hash at `min_rounds` within `target_ms`, `min_rounds` is returned
+    anyway, since a cheaper hash would be too easy to brute-force. Each
+    extra round doubles the work, so one timed hash at `min_rounds` is
+    enough to estimate the rest.
+    """
+
+    start = time.perf_counter()
+    bcrypt.generate_password_hash('calibration', min_rounds)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        rounds += 1
+        elapsed_ms *= 2
+
+    return rounds
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded worker pool."""
+
+    def __init__(self, rounds=12, workers=4, max_pending=32):
+        self._lock = threading.Lock()
+        self._executor = None
+        self.configure(rounds, workers, max_pending)
+
+    def configure(self, rounds, workers, max_pending):
+        """Set the bcrypt cost and pool limits, replacing any old pool."""
+
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+
+            self.rounds = rounds
+            self.workers = workers
+            self.max_pending = max_pending
+            self._slots = threading.BoundedSemaphore(max_pending)
+            self._executor = None
+            self._pid = None
+
+    def _pool(self):
+        # Worker threads don't survive a fork, so each process (e.g. each
+        # pre-forked web worker) starts its own pool on first use.
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._pid = os.getpid()
+
+            return self._executor
+
+    def _run(self, fn, *args):
+        slots = self._slots
+
+        if not slots.acquire(blocking=False):
+            raise PasswordQueueFull()
+
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+
+        future.add_done_callback(lambda _: slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Hash `password` with the configured cost."""
+
+        pw_hash = self._run(bcrypt.generate_password_hash, password,
+                            self.rounds)
+        return pw_hash.decode('UTF-8')
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run(bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different cost than we use now?"""
+
+        return hash_cost(pw_hash) != self.rounds
+
+
+hasher = PasswordHasher()
+
+
+def init_app(app):
+    """Configure the shared hasher from app config.
+
+    You should call this in your Flask app.
+    """
+
+    target_ms = app.config.get('BCRYPT_TARGET_MS')
+
+    if target_ms:
+        rounds = calibrate(target_ms)
+    else:
+        rounds = app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+    hasher.configure(
+        rounds=max(MIN_ROUNDS, min(rounds, MAX_ROUNDS)),
+        workers=app.config.get('PASSWORD_WORKERS', 4),
+        max_pending=app.config.get('PASSWORD_MAX_PENDING', 32),
+    )
@@ -0,0 +1,245 @@
+"""Opt-in request profiling for Warbler.
+
+Two independent modes, both off by default:
+
+- PROFILE_SAMPLE_RATE: profile this fraction of requests (0.01 is 1%)
+  with cProfile. Saved as `.prof` files, to be opened with pstats or
+  snakeviz.
+- PROFILE_SLOW_MS: watch every request with a background thread that
+  samples its stack every PROFILE_SAMPLE_INTERVAL_MS, and keep the samples
+  of requests that take longer than this. Saved as `.txt` files of
+  collapsed stacks, one "frame;frame;frame count" line per distinct
+  stack, which flamegraph.pl and speedscope read.
+
+Either way the profile covers the whole request: view, ORM queries and
+template rendering. Only the newest PROFILE_KEEP files in PROFILE_DIR
+are kept. Users whose ids are listed in ADMIN_USER_IDS can browse and
+download them at /admin/profiles.
+
+When both modes are off, the app is left unwrapped and no per-request
+work is done.
+"""
+
+import cProfile
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import (abort, flash, g, redirect, render_template,
+                   send_from_directory)
+
+PROFILE_NAME = re.compile(r'^[\w.-]+\.(prof|txt)$')
+
+
+class ProfileStore:
+    """A directory holding at most `keep` of the newest profile files."""
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def filename(self, environ, elapsed, extension):
+        path = re.sub(r'[^\w-]+', '_', environ.get('PATH_INFO', '')).strip('_')
+        stamp = datetime.utcnow().strftime('%Y%m%dT%H%M%S.%f')
+
+        return (f"{stamp}-{environ.get('REQUEST_METHOD', 'GET')}-"
+                f"{path or 'root'}-{elapsed * 1000:.0f}ms.{extension}")
+
+    def save(self, filename, write):
+        """Write a new profile with `write(path)`, dropping the oldest."""
+
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            write(os.path.join(self.directory, filename))
+
+            for old in self.list()[self.keep:]:
+                os.remove(os.path.join(self.directory, old))
+
+    def list(self):
+        """Profile filenames, newest first."""
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+
+        return sorted((name for name in names if PROFILE_NAME.match(name)),
+                      reverse=True)
+
+
+class StackSampler:
+    """Samples the stacks of registered threads from a background thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def watch(self, thread_id):
+        samples = Counter()
+
+        with self._lock:
+            self._watched[thread_id] = samples
+            self._start()
+
+        return samples
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def _start(self):
+        # Threads don't survive a fork; each worker process starts its own.
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name='profile-sampler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+
+            # Sample under the lock, so nothing is added after `unwatch`.
+            with self._lock:
+                if not self._watched:
+                    continue
+
+                frames = sys._current_frames()
+
+                for thread_id, samples in self._watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+
+
+def collapse(frame):
+    """A stack as 'outermost;...;innermost' frame names."""
+
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+
+    return ';'.join(reversed(names))
+
+
+class ProfilingMiddleware:
+    """WSGI middleware that profiles sampled and slow requests."""
+
+    def __init__(self, wsgi_app, store, sample_rate=0, slow_seconds=0,
+                 sampler=None):
+        self.wsgi_app = wsgi_app
+        self.store = store
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.sampler = sampler
+
+    def __call__(self, environ, start_response):
+        profile = None
+
+        if self.sample_rate and random.random() < self.sample_rate:
+            profile = cProfile.Profile()
+
+        samples = None
+        if self.slow_seconds:
+            samples = self.sampler.watch(threading.get_ident())
+
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profiler is already active in this interpreter.
+                profile = None
+
+        start = time.perf_counter()
+
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            if profile is not None:
+                profile.disable()
+
+            if samples is not None:
+                self.sampler.unwatch(threading.get_ident())
+
+                if elapsed >= self.slow_seconds and samples:
+                    self.store.save(self.store.filename(environ, elapsed, 'txt'),
+                                    lambda path: write_samples(path, samples))
+
+            if profile is not None:
+                profile.create_stats()
+                self.store.save(self.store.filename(environ, elapsed, 'prof'),
+                                profile.dump_stats)
+
+
+def write_samples(path, samples):
+    with open(path, 'w') as out:
+        for stack, count in samples.most_common():
+            out.write(f"{stack} {count}\n")
+
+
+def is_admin(app):
+    return bool(g.user) and g.user.id in app.config['ADMIN_USER_IDS']
+
+
+def init_app(app):
+    """Wrap the app for profiling if it's enabled, and add admin pages.
+
+    You should call this in your Flask app.
+    """
+
+    store = ProfileStore(
+        app.config.get('PROFILE_DIR')
+        or os.path.join(app.instance_path, 'profiles'),
+        app.config.get('PROFILE_KEEP', 50))
+    app.extensions['profiles'] = store
+
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    slow_ms = app.config.get('PROFILE_SLOW_MS', 0)
+
+    if sample_rate or slow_ms:
+        interval = app.config.get('PROFILE_SAMPLE_INTERVAL_MS', 5) / 1000
+        app.wsgi_app = ProfilingMiddleware(
+            app.wsgi_app, store,
+            sample_rate=sample_rate,
+            slow_seconds=slow_ms / 1000,
+            sampler=StackSampler(interval) if slow_ms else None,
+        )
+
+    @app.route('/admin/profiles')
+    def list_profiles():
+        """List saved request profiles, newest first (admins only)."""
+
+        if not is_admin(app):
+            flash("Access unauthorized.", "danger")
+            return redirect("/")
+
+        store = app.extensions['profiles']
+        return render_template('admin/profiles.html', profiles=store.list())
+
+    @app.route('/admin/profiles/<name>')
+    def download_profile(name):
+        """Download one saved profile (admins only)."""
+
+        if not is_admin(app):
+            flash("Access unauthorized.", "danger")
+            return redirect("/")
+
+        store = app.extensions['profiles']
+        if name not in store.list():
+            abort(404)
+
+        return send_from_directory(store.directory, name, as_attachment=True)
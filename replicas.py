@@ -0,0 +1,89 @@
+"""Read-replica routing for Warbler.
+
+Replicas are ordinary Flask-SQLAlchemy binds, listed by bind key in
+SQLALCHEMY_READ_REPLICAS. The session sends a statement to a replica
+when all of these hold:
+
+- it runs while handling a GET or HEAD request,
+- it isn't a flush or an INSERT/UPDATE/DELETE,
+- the user hasn't written anything in the last DB_PRIMARY_STICKY_SECONDS.
+
+Everything else goes to the primary (SQLALCHEMY_DATABASE_URI), as does
+any work outside a request (CLI commands, scripts, tests). Each request
+uses one replica, picked at random.
+
+The sticky window gives users read-your-writes consistency despite
+replication lag. A request that writes stamps the user's session cookie,
+so the redirect after posting a message or following someone, and
+whatever they load next, reads their own changes from the primary.
+"""
+
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+PRIMARY_UNTIL_KEY = 'db_primary_until'
+
+READ_METHODS = {'GET', 'HEAD'}
+
+
+def replica_for_request():
+    """Bind key of the replica this request reads from, or None."""
+
+    if 'db_replica' not in g:
+        replicas = current_app.config.get('SQLALCHEMY_READ_REPLICAS')
+
+        if (not replicas or request.method not in READ_METHODS
+                or session.get(PRIMARY_UNTIL_KEY, 0) > time.time()):
+            g.db_replica = None
+        else:
+            g.db_replica = random.choice(replicas)
+
+    return g.db_replica
+
+
+class RoutingSession(SignallingSession):
+    """A session that reads from a replica when it's safe to."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context():
+            if self._flushing or isinstance(clause, UpdateBase):
+                # Read the rest of this request, and the user's next ones,
+                # from the primary too.
+                g.db_replica = None
+                g.db_wrote = True
+            elif replica_for_request():
+                return get_state(self.app).db.get_engine(
+                    self.app, bind=g.db_replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose sessions route reads to replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def _stick_to_primary(response):
+    if g.get('db_wrote'):
+        session[PRIMARY_UNTIL_KEY] = (
+            time.time() + current_app.config['DB_PRIMARY_STICKY_SECONDS'])
+
+    return response
+
+
+def init_app(app):
+    """Keep users who just wrote something reading from the primary.
+
+    You should call this in your Flask app.
+    """
+
+    app.config.setdefault('SQLALCHEMY_READ_REPLICAS', [])
+    app.config.setdefault('DB_PRIMARY_STICKY_SECONDS', 5)
+    app.after_request(_stick_to_primary)
@@ -0,0 +1,151 @@
+"""User search for Warbler.
+
+On Postgres with the pg_trgm extension, usernames are matched and ranked
+by trigram similarity, and bio/location by full-text search; both are
+served by the GIN indexes from `install_search_indexes`. Elsewhere
+(SQLite, or Postgres without pg_trgm) usernames are matched with a
+case-insensitive substring search, ranked exact match first, then
+prefix matches, then shorter usernames.
+"""
+
+import time
+from collections import namedtuple
+
+from sqlalchemy import case, func, or_
+from sqlalchemy.exc import DBAPIError
+
+from models import db, loading, User
+
+SearchPage = namedtuple('SearchPage', ['users', 'page', 'has_next'])
+
+# Expression the full-text index on bio and location is built on. Queries
+# must use exactly this expression for Postgres to pick the index.
+PROFILE_TEXT = func.to_tsvector(
+    'simple',
+    func.coalesce(User.bio, '') + ' ' + func.coalesce(User.location, ''))
+
+TRIGRAM_INDEX = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_username_trgm "
+    "ON users USING gin (username gin_trgm_ops)")
+
+PROFILE_TEXT_INDEX = (
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_users_profile_text "
+    "ON users USING gin ("
+    "to_tsvector('simple', coalesce(bio, '') || ' ' || coalesce(location, '')))")
+
+# How long has_trigrams() trusts its last answer, so installing or
+# dropping pg_trgm on a running database takes effect without a restart.
+TRIGRAM_RECHECK_SECONDS = 60
+
+# Database URL -> (monotonic time checked, whether pg_trgm is installed).
+_trigram_support = {}
+
+
+def is_postgres():
+    return db.engine.dialect.name == 'postgresql'
+
+
+def has_trigrams():
+    """Is pg_trgm installed in the database we're connected to?
+
+    The answer is rechecked every TRIGRAM_RECHECK_SECONDS.
+    """
+
+    url = str(db.engine.url)
+    now = time.monotonic()
+    checked, installed = _trigram_support.get(url, (None, False))
+
+    if checked is None or now - checked > TRIGRAM_RECHECK_SECONDS:
+        installed = is_postgres() and bool(db.session.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").scalar())
+        _trigram_support[url] = (now, installed)
+
+    return installed
+
+
+def install_search_indexes():
+    """Create pg_trgm and the search indexes without locking out writes.
+
+    Returns False if this isn't Postgres. If pg_trgm can't be installed,
+    only the full-text index is created and usernames keep using the
+    substring search.
+    """
+
+    if not is_postgres():
+        return False
+
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+
+        try:
+            conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        except DBAPIError:
+            pass
+        else:
+            conn.execute(TRIGRAM_INDEX)
+
+        conn.execute(PROFILE_TEXT_INDEX)
+
+    _trigram_support.clear()
+    return True
+
+
+def escape_like(text):
+    """Escape LIKE wildcards so `text` only matches literally."""
+
+    return (text.replace('\\', '\\\\')
+                .replace('%', '\\%')
+                .replace('_', '\\_'))
+
+
+def substring_search(term):
+    """Filter and ranking for the substring-matching fallback."""
+
+    pattern = escape_like(term.lower())
+    username = func.lower(User.username)
+
+    match = username.like(f'%{pattern}%', escape='\\')
+    rank = case([(username == term.lower(), 0),
+                 (username.like(f'{pattern}%', escape='\\'), 1)],
+                else_=2)
+
+    return match, (rank, func.length(User.username), User.username)
+
+
+def trigram_search(term):
+    """Filter and ranking for Postgres trigram and full-text search."""
+
+    query = func.plainto_tsquery('simple', term)
+    # pg_trgm's similarity operator is %, doubled so psycopg2 doesn't read
+    # it as the start of a placeholder.
+    username_match = or_(User.username.op('%%')(term),
+                         User.username.ilike(f'%{escape_like(term)}%'))
+    profile_match = PROFILE_TEXT.op('@@')(query)
+
+    relevance = (func.similarity(User.username, term) * 2
+                 + func.ts_rank(PROFILE_TEXT, query))
+
+    return (or_(username_match, profile_match),
+            (relevance.desc(), User.username))
+
+
+def search_users(term, page=1, per_page=20):
+    """A page of users matching `term`, most relevant first."""
+
+    page = max(page, 1)
+
+    if has_trigrams():
+        match, ranking = trigram_search(term)
+    else:
+        match, ranking = substring_search(term)
+
+    users = (User.query
+             .options(*loading('user_cards'))
+             .filter(match)
+             .order_by(*ranking)
+             .offset((page - 1) * per_page)
+             .limit(per_page + 1)
+             .all())
+
+    return SearchPage(users=users[:per_page], page=page,
+                      has_next=len(users) > per_page)
@@ -0,0 +1,148 @@
+"""JSON API tests."""
+
+import json
+import os
+from unittest import TestCase
+
+from fragments import cache
+from models import db, Follows, Likes, Message, TimelineEntry, User
+from testing import QueryBudgetMixin
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True)
+            .splitlines()]
+
+
+class ApiTestCase(QueryBudgetMixin, TestCase):
+    """Test the /api/v1 routes."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        u1 = User.signup("testuser", "testing@test.com", "password", None)
+        u2 = User.signup("testuser2", "testing2@test.com", "password", None)
+        db.session.flush()
+
+        older = Message(text="First", user_id=u2.id)
+        db.session.add(older)
+        db.session.flush()
+        newer = Message(text="Second", user_id=u2.id,
+                        timestamp=older.timestamp.replace(year=2100))
+        db.session.add(newer)
+        db.session.add(Follows(user_being_followed_id=u2.id,
+                               user_following_id=u1.id))
+        db.session.flush()
+        db.session.add(Likes(user_id=u1.id, message_id=older.id))
+        db.session.commit()
+
+        User.recount()
+        TimelineEntry.rebuild()
+        db.session.commit()
+
+        self.u1_id, self.u2_id = u1.id, u2.id
+        self.older_id, self.newer_id = older.id, newer.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def test_requires_login(self):
+        """ Are the same pages as in HTML closed to anonymous users? """
+
+        for path in ['/api/v1/timeline',
+                     f'/api/v1/users/{self.u2_id}/followers',
+                     f'/api/v1/users/{self.u2_id}/following',
+                     f'/api/v1/users/{self.u1_id}/likes']:
+            res = self.client.get(path)
+            self.assertEqual(res.status_code, 401, path)
+            self.assertIn('error', res.get_json())
+
+    def test_unknown_user(self):
+        """ Is a missing user a JSON 404? """
+
+        self.login()
+        res = self.client.get('/api/v1/users/99999/followers')
+
+        self.assertEqual(res.status_code, 404)
+        self.assertIn('error', res.get_json())
+
+    def test_user_show(self):
+        """ Does a profile include its counters? """
+
+        user = self.client.get(f'/api/v1/users/{self.u2_id}').get_json()
+
+        self.assertEqual(user['username'], 'testuser2')
+        self.assertEqual(user['messages_count'], 2)
+        self.assertEqual(user['followers_count'], 1)
+        self.assertNotIn('password', user)
+
+    def test_user_messages(self):
+        """ Are a user's messages streamed newest first? """
+
+        res = self.client.get(f'/api/v1/users/{self.u2_id}/messages')
+
+        self.assertEqual(res.mimetype, 'application/x-ndjson')
+        self.assertTrue(res.is_streamed)
+        self.assertEqual([msg['id'] for msg in ndjson(res)],
+                         [self.newer_id, self.older_id])
+
+    def test_followers_and_following(self):
+        """ Are follows streamed as compact user records? """
+
+        self.login()
+        followers = ndjson(
+            self.client.get(f'/api/v1/users/{self.u2_id}/followers'))
+        following = ndjson(
+            self.client.get(f'/api/v1/users/{self.u1_id}/following'))
+
+        self.assertEqual(followers, [{'id': self.u1_id,
+                                      'username': 'testuser',
+                                      'image_url': User.image_url.default.arg}])
+        self.assertEqual([user['id'] for user in following], [self.u2_id])
+
+    def test_likes(self):
+        """ Are liked messages streamed with their author? """
+
+        self.login()
+        likes = ndjson(self.client.get(f'/api/v1/users/{self.u1_id}/likes'))
+
+        self.assertEqual(len(likes), 1)
+        self.assertEqual(likes[0]['id'], self.older_id)
+        self.assertEqual(likes[0]['username'], 'testuser2')
+
+    def test_timeline(self):
+        """ Does the timeline page carry like counts and cursors? """
+
+        self.login()
+
+        with self.assertMaxQueries(4):
+            page = self.client.get('/api/v1/timeline').get_json()
+
+        self.assertEqual([msg['id'] for msg in page['messages']],
+                         [self.newer_id, self.older_id])
+        self.assertEqual(page['messages'][1]['likes'], 1)
+        self.assertTrue(page['messages'][1]['liked'])
+        self.assertEqual(page['messages'][0]['user']['username'], 'testuser2')
+        self.assertIsNone(page['older'])
+
+    def test_bad_cursor(self):
+        """ Is a malformed cursor a JSON 400? """
+
+        self.login()
+        res = self.client.get('/api/v1/timeline?before=nope')
+
+        self.assertEqual(res.status_code, 400)
@@ -0,0 +1,72 @@
+"""Fragment cache tests."""
+
+from unittest import TestCase
+
+from fragments import FragmentCache
+
+
+class FakeClock:
+    """A clock the tests can move forward by hand."""
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test FragmentCache eviction and invalidation."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = FragmentCache(max_entries=2, ttl=10, clock=self.clock)
+
+    def test_get_or_render(self):
+        """ Is a fragment rendered once and then reused? """
+
+        renders = []
+        def render():
+            renders.append(1)
+            return '<p>hi</p>'
+
+        self.assertEqual(self.cache.get_or_render('a', render), '<p>hi</p>')
+        self.assertEqual(self.cache.get_or_render('a', render), '<p>hi</p>')
+        self.assertEqual(len(renders), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_ttl(self):
+        """ Do entries expire after the TTL? """
+
+        self.cache.set('a', 'A')
+        self.clock.now = 9
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.clock.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_lru_eviction(self):
+        """ Is the least recently used entry evicted first? """
+
+        self.cache.set('a', 'A')
+        self.cache.set('b', 'B')
+        self.cache.get('a')
+        self.cache.set('c', 'C')
+
+        self.assertEqual(self.cache.get('a'), 'A')
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 'C')
+
+    def test_invalidate_tags(self):
+        """ Does invalidating a tag drop every entry stored with it? """
+
+        self.cache.set('a', 'A', tags=['user:1', 'message:1'])
+        self.cache.set('b', 'B', tags=['user:2'])
+
+        self.cache.invalidate('message:1')
+
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get('b'), 'B')
+
+        self.cache.invalidate('user:1', 'user:2')
+        self.assertEqual(len(self.cache), 0)
@@ -4,7 +4,7 @@ import os
 from unittest import TestCase
 from sqlalchemy import exc
 
-from models import db, Message, User, Likes
+from models import db, loading, Message, User, Likes
 
 # Does the repr method work as expected?
 # Does basic model work?
@@ -98,3 +98,67 @@ class MessageModelTestCase(TestCase):
 		self.assertEqual(u2.likes[0], m)
 
 		
+
+	def test_like_summary(self):
+		""" Are like counts and the viewer's likes summarized per message? """
+
+		m1 = Message(text="First", user_id=self.u1.id)
+		m2 = Message(text="Second", user_id=self.u1.id)
+		u2 = User.signup("user2", "user2@test.com", "password", None)
+		db.session.add_all([m1, m2])
+		db.session.commit()
+
+		# Several users can like the same message
+		db.session.add_all([
+			Likes(user_id=self.u1.id, message_id=m1.id),
+			Likes(user_id=u2.id, message_id=m1.id),
+			Likes(user_id=u2.id, message_id=m2.id),
+		])
+		db.session.commit()
+
+		summary = Likes.summarize([m1.id, m2.id], self.u1.id)
+		self.assertEqual(summary.liked, {m1.id})
+		self.assertEqual(summary.counts, {m1.id: 2, m2.id: 1})
+
+		summary = Likes.summarize([m2.id], u2.id)
+		self.assertEqual(summary.liked, {m2.id})
+		self.assertEqual(summary.counts, {m2.id: 1})
+
+		self.assertEqual(Likes.summarize([], u2.id).counts, {})
+
+	def test_duplicate_like(self):
+		""" Can a user like the same message twice? """
+
+		m = Message(text="Once", user_id=self.u1.id)
+		db.session.add(m)
+		db.session.commit()
+
+		db.session.add_all([
+			Likes(user_id=self.u1.id, message_id=m.id),
+			Likes(user_id=self.u1.id, message_id=m.id),
+		])
+
+		with self.assertRaises(exc.IntegrityError):
+			db.session.commit()
+
+	def test_loading_profile(self):
+		""" Does a strict loading profile raise on relationships it skips? """
+
+		m = Message(text="Loaded", user_id=self.u1.id)
+		db.session.add(m)
+		db.session.commit()
+		db.session.expunge_all()
+
+		strict = app.config['LOADING_STRICT']
+		app.config['LOADING_STRICT'] = True
+		try:
+			msg = (Message.query
+				.options(*loading('messages_with_authors'))
+				.one())
+		finally:
+			app.config['LOADING_STRICT'] = strict
+
+		self.assertEqual(msg.user.username, "user1")
+
+		with self.assertRaises(exc.InvalidRequestError):
+			msg.user.messages
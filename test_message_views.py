@@ -6,10 +6,13 @@
 
 
 import os
+from datetime import datetime
 from unittest import TestCase
 from sqlalchemy import exc
 
-from models import db, connect_db, Message, User
+from fragments import cache
+from models import db, connect_db, Follows, Message, User, TimelineEntry
+from testing import QueryBudgetMixin
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -32,9 +35,10 @@ db.create_all()
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
 
 
-class MessageViewTestCase(TestCase):
+class MessageViewTestCase(QueryBudgetMixin, TestCase):
     """Test views for messages."""
 
     def setUp(self):
@@ -42,6 +46,7 @@ class MessageViewTestCase(TestCase):
 
         User.query.delete()
         Message.query.delete()
+        cache.clear()
 
         self.client = app.test_client()
 
@@ -79,6 +84,139 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(msg.text, "Hello")
 
 
+    def test_add_message_fans_out(self):
+        """ Test new messages are pushed to followers' timelines """
+
+        self.testuser2.following.append(self.testuser)
+        db.session.commit()
+        testuser2_id = self.testuser2.id
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.testuser.id
+
+        self.client.post("/messages/new", data={"text": "Hello followers"})
+        msg = Message.query.one()
+
+        entry = TimelineEntry.query.one()
+        self.assertEqual(entry.user_id, testuser2_id)
+        self.assertEqual(entry.message_id, msg.id)
+
+        self.client.post(f"/messages/{msg.id}/delete")
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_add_message_high_follower_author(self):
+        """ Test messages by high-follower authors are pulled on read """
+
+        app.config['TIMELINE_PUSH_MAX_FOLLOWERS'] = 0
+        self.testuser2.following.append(self.testuser)
+        db.session.flush()
+        User.recount()
+        TimelineEntry.rebuild()
+        db.session.commit()
+        testuser2_id = self.testuser2.id
+
+        try:
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            self.client.post("/messages/new", data={"text": "Hello fans"})
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = testuser2_id
+
+            res = self.client.get("/")
+            self.assertIn("Hello fans", res.get_data(as_text=True))
+        finally:
+            app.config['TIMELINE_PUSH_MAX_FOLLOWERS'] = 5000
+
+    def test_pulled_author_stays_pulled(self):
+        """ Test messages written in pull mode survive losing followers """
+
+        app.config['TIMELINE_PUSH_MAX_FOLLOWERS'] = 1
+        testuser_id = self.testuser.id
+        testuser2_id = self.testuser2.id
+        testuser3 = User.signup(username="testuser3",
+                                email="test3@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.commit()
+        testuser3_id = testuser3.id
+
+        try:
+            Follows.add(testuser2_id, testuser_id)
+            Follows.add(testuser3_id, testuser_id)
+            db.session.commit()
+
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = testuser_id
+
+            self.client.post("/messages/new", data={"text": "Hello fans"})
+            self.assertEqual(TimelineEntry.query.count(), 0)
+
+            Follows.remove(testuser3_id, testuser_id)
+            db.session.commit()
+            self.client.post("/messages/new", data={"text": "Hello again"})
+
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = testuser2_id
+
+            html = self.client.get("/").get_data(as_text=True)
+            self.assertIn("Hello fans", html)
+            self.assertIn("Hello again", html)
+        finally:
+            app.config['TIMELINE_PUSH_MAX_FOLLOWERS'] = 5000
+
+    def test_trim_timelines(self):
+        """ Test trimming cuts timelines back to their newest entries """
+
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+        Follows.add(self.testuser2.id, self.testuser.id)
+        db.session.commit()
+
+        try:
+            with self.client.session_transaction() as session:
+                session[CURR_USER_KEY] = self.testuser.id
+
+            for text in ("One", "Two", "Three"):
+                self.client.post("/messages/new", data={"text": text})
+            self.assertEqual(TimelineEntry.query.count(), 3)
+
+            result = app.test_cli_runner().invoke(args=['trim-timelines'])
+            self.assertIn("Removed 1 old timeline entries.", result.output)
+
+            kept = [text for (text,) in db.session
+                    .query(Message.text)
+                    .join(TimelineEntry,
+                          TimelineEntry.message_id == Message.id)
+                    .order_by(TimelineEntry.timestamp)]
+            self.assertEqual(kept, ["Two", "Three"])
+        finally:
+            app.config['TIMELINE_MAX_ENTRIES'] = 800
+
+    def test_rebuild_keeps_newest(self):
+        """ Test rebuilt timelines hold only the newest entries """
+
+        app.config['TIMELINE_MAX_ENTRIES'] = 2
+        self.testuser2.following.append(self.testuser)
+        for day, text in enumerate(("One", "Two", "Three"), start=1):
+            db.session.add(Message(text=text, user_id=self.testuser.id,
+                                   timestamp=datetime(2020, 1, day)))
+        db.session.flush()
+
+        try:
+            TimelineEntry.rebuild()
+            db.session.commit()
+
+            kept = [text for (text,) in db.session
+                    .query(Message.text)
+                    .join(TimelineEntry,
+                          TimelineEntry.message_id == Message.id)
+                    .order_by(TimelineEntry.timestamp)]
+            self.assertEqual(kept, ["Two", "Three"])
+        finally:
+            app.config['TIMELINE_MAX_ENTRIES'] = 800
+
     def test_add_no_session(self):
         """ Test add message when not logged in """
 
@@ -115,6 +253,35 @@ class MessageViewTestCase(TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIn('A test message', str(res.data))
 
+    def test_message_show_query_budget(self):
+        """Showing a message loads it with its author, and the viewer."""
+
+        m = Message(text="A test message", user_id=self.testuser.id)
+        db.session.add(m)
+        db.session.commit()
+        m_id = m.id
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser2.id
+
+        with self.assertMaxQueries(3):
+            res = self.client.get(f'/messages/{m_id}')
+
+        self.assertEqual(res.status_code, 200)
+
+
+    def test_message_show_conditional_get(self):
+        """ Test message pages answer If-None-Match with 304 """
+        m = Message(text="A test message", user_id=self.testuser.id)
+        db.session.add(m)
+        db.session.commit()
+
+        res = self.client.get(f'/messages/{m.id}')
+        res = self.client.get(f'/messages/{m.id}',
+                              headers={'If-None-Match': res.headers['ETag']})
+
+        self.assertEqual(res.status_code, 304)
+        self.assertEqual(res.data, b'')
 
     def test_invalid_message_show(self):
         """ Test if invalid message doesn't show up"""
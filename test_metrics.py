@@ -0,0 +1,135 @@
+"""Metrics endpoint tests."""
+
+import os
+import threading
+import time
+from unittest import TestCase
+
+from fragments import cache
+from models import db, User
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app
+
+import metrics
+
+# The test database under another URL, so it gets an engine of its own.
+REPLICA_URL = 'postgresql:///warbler-test?application_name=replica'
+
+
+class MetricsTestCase(TestCase):
+    """Test /metrics exports request, pool and cache statistics."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        user = User.signup("testuser", "testing@test.com", "password", None)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def sample(self, text, name, **labels):
+        """The value of one sample in Prometheus text output, or None."""
+
+        for line in text.splitlines():
+            if line.startswith('#') or ' ' not in line:
+                continue
+            sample, value = line.rsplit(' ', 1)
+            metric, _, label_text = sample.partition('{')
+            if metric == name and all(f'{k}="{v}"' in label_text
+                                      for k, v in labels.items()):
+                return float(value)
+
+        return None
+
+    def test_metrics(self):
+        """ Are requests, pool usage and cache lookups exported? """
+
+        before = self.client.get('/metrics').get_data(as_text=True)
+        for _ in range(2):
+            self.client.get(f'/users/{self.user_id}')
+
+        res = self.client.get('/metrics')
+        text = res.get_data(as_text=True)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('text/plain', res.content_type)
+
+        count = 'warbler_request_duration_seconds_count'
+        labels = dict(endpoint='users_show', method='GET', status='200')
+        self.assertEqual(self.sample(text, count, **labels)
+                         - (self.sample(before, count, **labels) or 0), 2)
+
+        # Only the /metrics request itself is in flight
+        self.assertEqual(self.sample(text, 'warbler_requests_in_flight'), 1)
+
+        self.assertIsNotNone(
+            self.sample(text, 'warbler_db_pool_size', bind='primary'))
+        self.assertIsNotNone(
+            self.sample(text, 'warbler_db_pool_checked_out', bind='primary'))
+        self.assertGreater(self.sample(
+            text, 'warbler_db_pool_wait_seconds_count', bind='primary'), 0)
+
+        hits = 'warbler_cache_requests_total'
+        self.assertGreaterEqual(
+            self.sample(text, hits, cache='fragments', result='hit')
+            - (self.sample(before, hits, cache='fragments', result='hit') or 0), 1)
+        self.assertGreaterEqual(
+            self.sample(text, hits, cache='fragments', result='miss'), 1)
+
+    def test_pool_bind_labels(self):
+        """ Are a replica's pool samples kept apart from the primary's? """
+
+        app.config['SQLALCHEMY_BINDS'] = {'replica0': REPLICA_URL}
+        try:
+            engine = db.get_engine(app, bind='replica0')
+            with engine.connect() as conn:
+                conn.execute('SELECT 1')
+                text = self.client.get('/metrics').get_data(as_text=True)
+            engine.dispose()
+        finally:
+            app.config['SQLALCHEMY_BINDS'] = {}
+
+        self.assertEqual(self.sample(text, 'warbler_db_pool_checked_out',
+                                     bind='replica0'), 1)
+        self.assertIsNotNone(
+            self.sample(text, 'warbler_db_pool_size', bind='primary'))
+
+    def test_concurrent_cache_counts(self):
+        """ Do requests on several threads count each cache hit once? """
+
+        class SlowCache:
+            misses = 0
+
+            @property
+            def hits(self):
+                time.sleep(0.01)
+                return 5
+
+        metrics.register_cache('slow', SlowCache())
+        self.addCleanup(metrics._caches.pop, 'slow')
+        # Registering read the hits; start from none counted.
+        metrics._caches['slow'][1] = 0
+
+        threads = [threading.Thread(target=metrics._count_cache_requests)
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertEqual(self.sample(text, 'warbler_cache_requests_total',
+                                     cache='slow', result='hit'), 5)
+
+    def test_pool_class(self):
+        """ Is the engine using the instrumented pool? """
+
+        self.assertIsInstance(db.engine.pool, metrics.InstrumentedQueuePool)
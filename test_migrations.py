@@ -0,0 +1,188 @@
+"""Schema migration tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from sqlalchemy import inspect
+
+import migrations
+from migrations import baseline
+from models import db, Likes, Message, TimelineEntry, User
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app
+
+
+class MigrationTestCase(TestCase):
+    """Test migrations bring an older schema up to date."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        migrations.schema_migrations.drop(db.engine, checkfirst=True)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def index_names(self, table):
+        return {index['name'] for index in inspect(db.engine).get_indexes(table)}
+
+    def schema(self):
+        """Columns, indexes and unique constraints of every model table."""
+
+        inspector = inspect(db.engine)
+
+        return {
+            table: (
+                sorted((column['name'], str(column['type']), column['nullable'])
+                       for column in inspector.get_columns(table)),
+                sorted((index['name'], tuple(index['column_names']),
+                        index['unique'])
+                       for index in inspector.get_indexes(table)),
+                sorted((constraint['name'], tuple(constraint['column_names']))
+                       for constraint
+                       in inspector.get_unique_constraints(table)),
+            )
+            for table in inspector.get_table_names()
+            if table != 'schema_migrations'
+        }
+
+    def test_upgrade_baseline(self):
+        """ Does migrating the original schema match the current models? """
+
+        db.drop_all()
+        baseline.create(db.engine)
+
+        with db.engine.begin() as conn:
+            conn.execute(baseline.users.insert(), [
+                {'id': n, 'email': f'user{n}@test.com',
+                 'username': f'user{n}', 'password': 'x'}
+                for n in (1, 2, 3)])
+            conn.execute(baseline.messages.insert(),
+                         id=1, text="Old post", user_id=2,
+                         timestamp=datetime(2020, 1, 1))
+            conn.execute(baseline.follows.insert(),
+                         user_following_id=1, user_being_followed_id=2)
+            conn.execute(baseline.likes.insert(), user_id=3, message_id=1)
+
+        migrations.migrate(db.engine, log=lambda msg: None)
+        migrated = self.schema()
+
+        u1, u2 = User.query.get(1), User.query.get(2)
+        self.assertEqual((u2.messages_count, u2.followers_count), (1, 1))
+        self.assertEqual((u1.following_count, u1.likes_count), (1, 0))
+        self.assertIsNotNone(u1.updated_at)
+        self.assertEqual([(entry.user_id, entry.message_id)
+                          for entry in TimelineEntry.query],
+                         [(1, 1)])
+
+        self.assertTrue(Likes.add(1, 1))
+        db.session.commit()
+        self.assertEqual(Message.query.get(1).likes_count, 2)
+
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        self.assertEqual(migrated, self.schema())
+
+    def test_upgrade_old_schema(self):
+        """ Do migrations add the indexes and defaults an old schema lacks? """
+
+        with db.engine.begin() as conn:
+            conn.execute('DROP INDEX ix_messages_user_id_timestamp_id')
+            conn.execute('DROP INDEX ix_likes_user_id_id')
+            conn.execute('ALTER TABLE messages ALTER COLUMN "timestamp" '
+                         'DROP DEFAULT')
+
+        self.assertEqual(migrations.migrate(db.engine, log=lambda msg: None),
+                         len(migrations.available()))
+
+        self.assertIn('ix_messages_user_id_timestamp_id',
+                      self.index_names('messages'))
+        self.assertIn('ix_likes_user_id_id', self.index_names('likes'))
+        self.assertEqual(migrations.pending(db.engine), [])
+        self.assertEqual(migrations.migrate(db.engine, log=lambda msg: None), 0)
+
+        user = User.signup("testuser", "testing@test.com", "password", None)
+        db.session.commit()
+        db.session.execute(
+            "INSERT INTO messages (text, user_id) VALUES ('Raw', :user_id)",
+            {'user_id': user.id})
+        stamp = db.session.execute(
+            "SELECT timestamp FROM messages WHERE text = 'Raw'").scalar()
+        self.assertLess(abs(stamp - datetime.utcnow()), timedelta(minutes=1))
+
+    def test_backfill_like_counts(self):
+        """ Are like counters added and filled in for existing messages? """
+
+        user = User.signup("testuser", "testing@test.com", "password", None)
+        db.session.flush()
+        liked = Message(text="Liked", user_id=user.id)
+        quiet = Message(text="Quiet", user_id=user.id)
+        db.session.add_all([liked, quiet])
+        db.session.flush()
+        liked_id, quiet_id = liked.id, quiet.id
+        db.session.add(Likes(user_id=user.id, message_id=liked_id))
+        db.session.commit()
+
+        with db.engine.begin() as conn:
+            conn.execute('DROP INDEX ix_messages_timestamp')
+            conn.execute('ALTER TABLE messages DROP COLUMN likes_count')
+
+        migrations.migrate(db.engine, log=lambda msg: None)
+
+        self.assertIn('ix_messages_timestamp', self.index_names('messages'))
+        counts = dict(db.session.execute(
+            "SELECT id, likes_count FROM messages").fetchall())
+        self.assertEqual(counts, {liked_id: 1, quiet_id: 0})
+
+    def test_likes_unique_per_user(self):
+        """ Can two users like one message once the old constraint is gone? """
+
+        with db.engine.begin() as conn:
+            conn.execute('ALTER TABLE likes '
+                         'DROP CONSTRAINT likes_user_id_message_id_key')
+            conn.execute('DROP INDEX ix_likes_message_id_user_id')
+            conn.execute('ALTER TABLE likes '
+                         'ADD CONSTRAINT likes_message_id_key UNIQUE (message_id)')
+
+        migrations.migrate(db.engine, log=lambda msg: None)
+
+        u1 = User.signup("testuser", "testing@test.com", "password", None)
+        u2 = User.signup("testuser2", "testing2@test.com", "password", None)
+        db.session.flush()
+        msg = Message(text="Popular", user_id=u1.id)
+        db.session.add(msg)
+        db.session.flush()
+
+        self.assertTrue(Likes.add(u1.id, msg.id))
+        self.assertTrue(Likes.add(u2.id, msg.id))
+        self.assertFalse(Likes.add(u2.id, msg.id))
+        db.session.commit()
+
+        self.assertEqual(Likes.query.filter_by(message_id=msg.id).count(), 2)
+        self.assertIn('ix_likes_message_id_user_id', self.index_names('likes'))
+
+    def test_fresh_schema(self):
+        """ Do migrations run cleanly on a schema built by create_all? """
+
+        self.assertEqual(migrations.migrate(db.engine, log=lambda msg: None),
+                         len(migrations.available()))
+        self.assertEqual(sorted(migrations.applied(db.engine)),
+                         [m.version for m in migrations.available()])
+
+    def test_message_timestamps_differ(self):
+        """ Is each message's timestamp taken when it's written? """
+
+        user = User.signup("testuser", "testing@test.com", "password", None)
+        db.session.flush()
+        first = Message(text="One", user_id=user.id)
+        db.session.add(first)
+        db.session.flush()
+        second = Message(text="Two", user_id=user.id)
+        db.session.add(second)
+        db.session.commit()
+
+        self.assertLess(first.timestamp, second.timestamp)
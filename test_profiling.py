@@ -0,0 +1,73 @@
+"""Request profiling tests."""
+
+import os
+import pstats
+import tempfile
+import time
+from unittest import TestCase
+
+from profiling import ProfileStore, ProfilingMiddleware, StackSampler
+
+
+def slow_app(environ, start_response):
+    time.sleep(0.05)
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'done']
+
+
+def call(wsgi_app, path='/users/1'):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path}
+    return wsgi_app(environ, lambda status, headers: None)
+
+
+class ProfilingTestCase(TestCase):
+    """Test saving sampled and slow request profiles."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.store = ProfileStore(self.dir.name, keep=3)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_store_keeps_newest(self):
+        """ Does the store drop the oldest files past `keep`? """
+
+        for n in range(5):
+            self.store.save(f'2020010{n}-GET-x-1ms.txt',
+                            lambda path: open(path, 'w').close())
+
+        self.assertEqual(self.store.list(), [
+            '20200104-GET-x-1ms.txt',
+            '20200103-GET-x-1ms.txt',
+            '20200102-GET-x-1ms.txt',
+        ])
+
+    def test_sampled_request_profile(self):
+        """ Is a sampled request saved as a cProfile dump? """
+
+        wrapped = ProfilingMiddleware(slow_app, self.store, sample_rate=1)
+
+        self.assertEqual(call(wrapped), [b'done'])
+
+        [name] = self.store.list()
+        self.assertRegex(name, r'-GET-users_1-\d+ms\.prof$')
+        stats = pstats.Stats(os.path.join(self.dir.name, name))
+        self.assertTrue(any(func[2] == 'slow_app' for func in stats.stats))
+
+    def test_slow_request_samples(self):
+        """ Are stack samples kept for slow requests only? """
+
+        wrapped = ProfilingMiddleware(slow_app, self.store,
+                                      slow_seconds=0.03,
+                                      sampler=StackSampler(0.001))
+        call(wrapped)
+
+        [name] = self.store.list()
+        self.assertTrue(name.endswith('.txt'))
+        with open(os.path.join(self.dir.name, name)) as samples:
+            self.assertIn('test_profiling.py:slow_app', samples.read())
+
+        wrapped.slow_seconds = 10
+        call(wrapped)
+        self.assertEqual(len(self.store.list()), 1)
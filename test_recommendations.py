@@ -0,0 +1,141 @@
+"""Follow suggestion tests."""
+
+import os
+from unittest import TestCase
+
+import numpy as np
+from scipy import sparse
+
+import recommendations
+from fragments import cache
+from models import db, Follows, Suggestion, User
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
+
+
+def quiet(message):
+    pass
+
+
+class ScoringTestCase(TestCase):
+    """Test the vectorized scoring helpers."""
+
+    def test_top_k(self):
+        """ Are the best k entries of each row kept, ties to lower ids? """
+
+        scores = sparse.csr_matrix(np.array([[0, 3, 1, 3],
+                                             [0, 0, 0, 0],
+                                             [2, 0, 0, 5]], dtype=np.float32))
+
+        rows, columns, values = recommendations.top_k(scores, 2)
+
+        self.assertEqual(list(zip(rows, columns, values)),
+                         [(0, 1, 3), (0, 3, 3), (2, 3, 5), (2, 0, 2)])
+
+    def test_plan_chunks(self):
+        """ Do chunks stay under the pair budget? """
+
+        users = np.arange(5)
+        estimate = np.array([3, 3, 3, 50, 3], dtype=np.float64)
+
+        chunks = recommendations.plan_chunks(users, estimate, 10)
+
+        self.assertEqual([chunk.tolist() for chunk in chunks],
+                         [[0, 1], [2], [3], [4]])
+
+    def test_fingerprints(self):
+        """ Do fingerprints depend on follow sets but not their order? """
+
+        def prints(edges):
+            followers, followed = zip(*edges)
+            matrix = sparse.csr_matrix(
+                (np.ones(len(edges), dtype=np.float32), (followers, followed)),
+                shape=(3, 3))
+            return recommendations.fingerprints(matrix, matrix.T.tocsr())
+
+        before = prints([(0, 1), (0, 2), (1, 2)])
+
+        self.assertEqual(before.tolist(),
+                         prints([(1, 2), (0, 2), (0, 1)]).tolist())
+        self.assertNotEqual(before[1], prints([(0, 1), (0, 2), (1, 0)])[1])
+
+
+class RefreshTestCase(TestCase):
+    """Test suggestions are computed, stored and shown."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        users = [User(username=f'user{n}', email=f'user{n}@test.com',
+                      password='x') for n in range(1, 7)]
+        db.session.add_all(users)
+        db.session.flush()
+        self.ids = [user.id for user in users]
+        u1, u2, u3, u4, u5, u6 = self.ids
+
+        # u1 follows u2, who follows u3: u3 is a friend of a friend.
+        # u4 follows u1 and u5: u5 is a co-follower.
+        for follower, followed in [(u1, u2), (u2, u3), (u4, u1), (u4, u5)]:
+            db.session.add(Follows(user_following_id=follower,
+                                   user_being_followed_id=followed))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggested(self, user_id):
+        return [(row.suggested_id, row.score) for row in
+                Suggestion.query.filter_by(user_id=user_id)
+                .order_by(Suggestion.score.desc())]
+
+    def test_refresh(self):
+        """ Are friends of friends ranked above co-followers? """
+
+        u1, u2, u3, u4, u5, u6 = self.ids
+
+        self.assertEqual(recommendations.refresh(log=quiet), 6)
+
+        self.assertEqual(self.suggested(u1), [(u3, 1.0), (u5, 0.5)])
+        self.assertEqual(self.suggested(u6), [])
+
+    def test_incremental_refresh(self):
+        """ Are only users whose follows changed rescored? """
+
+        u1, u2, u3, u4, u5, u6 = self.ids
+
+        recommendations.refresh(log=quiet)
+        self.assertEqual(recommendations.refresh(log=quiet), 0)
+
+        db.session.add(Follows(user_following_id=u6,
+                               user_being_followed_id=u2))
+        db.session.commit()
+
+        # u6's following set and u2's follower set changed.
+        self.assertEqual(recommendations.refresh(log=quiet), 2)
+        self.assertEqual(self.suggested(u6), [(u3, 1.0)])
+
+    def test_homepage_panel(self):
+        """ Does the homepage show suggestions not yet followed? """
+
+        u1, u2, u3, u4, u5, u6 = self.ids
+        recommendations.refresh(log=quiet)
+
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = u1
+
+        html = client.get('/').get_data(as_text=True)
+        self.assertIn('Who to follow', html)
+        self.assertIn('<a href="/users/%d">@user3</a>' % u3, html)
+
+        client.post(f'/users/follow/{u3}')
+        html = client.get('/').get_data(as_text=True)
+        self.assertNotIn('<a href="/users/%d">@user3</a>' % u3, html)
+        self.assertIn('<a href="/users/%d">@user5</a>' % u5, html)
@@ -0,0 +1,107 @@
+"""Read-replica routing tests."""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+
+from fragments import cache
+from models import db, User
+from replicas import PRIMARY_UNTIL_KEY
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
+
+REPLICA_URL = 'postgresql:///warbler-test-replica'
+
+
+def create_replica_database():
+    server = create_engine('postgresql:///postgres',
+                           isolation_level='AUTOCOMMIT')
+
+    with server.connect() as conn:
+        exists = conn.execute(
+            "SELECT 1 FROM pg_database WHERE datname = 'warbler-test-replica'"
+        ).scalar()
+        if not exists:
+            conn.execute('CREATE DATABASE "warbler-test-replica"')
+
+    server.dispose()
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test reads go to the replica except after the user's writes."""
+
+    @classmethod
+    def setUpClass(cls):
+        create_replica_database()
+        app.config['SQLALCHEMY_BINDS'] = {'replica0': REPLICA_URL}
+        app.config['SQLALCHEMY_READ_REPLICAS'] = ['replica0']
+
+    @classmethod
+    def tearDownClass(cls):
+        app.config['SQLALCHEMY_BINDS'] = {}
+        app.config['SQLALCHEMY_READ_REPLICAS'] = []
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        u1 = User.signup("testuser", "testing@test.com", "password", None)
+        u2 = User.signup("testuser2", "testing2@test.com", "password", None)
+        db.session.commit()
+        self.u1_id, self.u2_id = u1.id, u2.id
+
+        # "Replicate" the users, plus one the primary doesn't have, so we
+        # can tell which database a page was read from.
+        replica = db.get_engine(app, bind='replica0')
+        db.Model.metadata.drop_all(replica)
+        db.Model.metadata.create_all(replica)
+
+        users = User.__table__
+        rows = [dict(row) for row in db.session.execute(users.select())]
+        with replica.begin() as conn:
+            conn.execute(users.insert(), rows)
+            conn.execute(users.insert(), id=99999, username='replicauser',
+                         email='replica@test.com', password='x')
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_get_reads_replica(self):
+        """ Do GET requests read from the replica? """
+
+        html = self.client.get('/users').get_data(as_text=True)
+
+        self.assertIn('<p>@replicauser</p>', html)
+
+    def test_outside_requests_use_primary(self):
+        """ Does code outside a request read from the primary? """
+
+        self.assertIsNone(User.query.filter_by(username='replicauser').first())
+
+    def test_read_your_writes(self):
+        """ Do reads after a user's write stick to the primary for a while? """
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        res = self.client.post(f'/users/follow/{self.u2_id}',
+                               follow_redirects=True)
+        # The follow only exists on the primary
+        self.assertIn('<p>@testuser2</p>', res.get_data(as_text=True))
+
+        with self.client.session_transaction() as session:
+            self.assertIn(PRIMARY_UNTIL_KEY, session)
+            session[PRIMARY_UNTIL_KEY] = 0
+
+        cache.clear()
+        res = self.client.get(f'/users/{self.u1_id}/following')
+        self.assertNotIn('<p>@testuser2</p>', res.get_data(as_text=True))
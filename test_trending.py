@@ -0,0 +1,141 @@
+"""Trending page tests."""
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from fragments import cache
+from models import db, Likes, Message, TrendingMessage, User
+from testing import QueryBudgetMixin
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
+
+
+class TrendingTestCase(QueryBudgetMixin, TestCase):
+    """Test like counters and the trending ranking."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        users = [User(username=f'user{n}', email=f'user{n}@test.com',
+                      password='x') for n in range(1, 4)]
+        db.session.add_all(users)
+        db.session.flush()
+
+        first = Message(text="First", user_id=users[0].id)
+        second = Message(text="Second", user_id=users[0].id)
+        db.session.add_all([first, second])
+        db.session.commit()
+
+        self.user_ids = [user.id for user in users]
+        self.first_id, self.second_id = first.id, second.id
+        self.now = datetime.utcnow()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def like(self, user_id, message_id):
+        db.session.add(Likes(user_id=user_id, message_id=message_id))
+        Message.bump_likes(message_id, 1)
+        db.session.commit()
+
+    def ranking(self):
+        return [msg.id for msg in TrendingMessage.top(10)]
+
+    def test_counters(self):
+        """ Do liking and unliking keep the message's counter? """
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_ids[1]
+
+        self.client.post(f'/users/add_like/{self.first_id}')
+        self.assertEqual(Message.query.get(self.first_id).likes_count, 1)
+
+        self.client.post(f'/users/remove_like/{self.first_id}')
+        db.session.expire_all()
+        self.assertEqual(Message.query.get(self.first_id).likes_count, 0)
+
+    def test_recent_likes_rank_higher(self):
+        """ Do newer likes outweigh older ones once they decay? """
+
+        u1, u2, u3 = self.user_ids
+
+        self.like(u2, self.first_id)
+        self.like(u3, self.first_id)
+        self.assertEqual(TrendingMessage.refresh(now=self.now), 1)
+        db.session.commit()
+        self.assertEqual(self.ranking(), [self.first_id])
+
+        # Two half-lives later, one like is worth the earlier two, twice.
+        self.like(u2, self.second_id)
+        TrendingMessage.refresh(
+            now=self.now + timedelta(
+                hours=2 * app.config['TRENDING_HALF_LIFE_HOURS']))
+        db.session.commit()
+        self.assertEqual(self.ranking(), [self.second_id, self.first_id])
+
+    def test_incremental_refresh(self):
+        """ Are unchanged and expired messages left out? """
+
+        u1, u2, u3 = self.user_ids
+
+        self.like(u2, self.first_id)
+        TrendingMessage.refresh(now=self.now)
+        self.assertEqual(TrendingMessage.refresh(now=self.now), 0)
+
+        later = self.now + timedelta(
+            hours=app.config['TRENDING_WINDOW_HOURS'] + 1)
+        TrendingMessage.refresh(now=later)
+        db.session.commit()
+        self.assertEqual(self.ranking(), [])
+
+    def test_unlike_and_like_again(self):
+        """ Does toggling a like across refreshes leave the score alone? """
+
+        u1, u2, u3 = self.user_ids
+
+        self.like(u2, self.first_id)
+        TrendingMessage.refresh(now=self.now)
+        db.session.commit()
+        score = TrendingMessage.query.get(self.first_id).score
+
+        for _ in range(3):
+            Likes.remove(u2, self.first_id)
+            db.session.commit()
+            TrendingMessage.refresh(now=self.now)
+            self.like(u2, self.first_id)
+            TrendingMessage.refresh(now=self.now)
+            db.session.commit()
+
+        db.session.expire_all()
+        self.assertEqual(TrendingMessage.query.get(self.first_id).score, score)
+
+        # A like past the earlier high still counts
+        self.like(u3, self.first_id)
+        TrendingMessage.refresh(now=self.now)
+        db.session.commit()
+        db.session.expire_all()
+        self.assertGreater(TrendingMessage.query.get(self.first_id).score, score)
+
+    def test_page(self):
+        """ Is the trending page one query, open to anonymous users? """
+
+        self.like(self.user_ids[1], self.first_id)
+        TrendingMessage.refresh(now=self.now)
+        db.session.commit()
+
+        with self.assertMaxQueries(1):
+            res = self.client.get('/trending')
+
+        html = res.get_data(as_text=True)
+        self.assertEqual(res.status_code, 200)
+        self.assertIn('First', html)
+        self.assertNotIn('Second', html)
@@ -10,6 +10,7 @@ from unittest import TestCase
 from sqlalchemy import exc
 
 from models import db, User, Message, Follows
+from passwords import PasswordHasher, PasswordQueueFull, bcrypt, calibrate, hash_cost, hasher
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -99,6 +100,22 @@ class UserModelTestCase(TestCase):
         # u1 should be followed by u2
         self.assertEqual(self.u1.followers[0], self.u2)
     
+    def test_following_among(self):
+        """ Does the batch follow lookup work? """
+
+        f = Follows(user_being_followed_id=self.u2.id, user_following_id=self.u1.id)
+        db.session.add(f)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_among([self.u1.id, self.u2.id, 12345]), {self.u2.id})
+        self.assertEqual(self.u2.following_among([self.u1.id]), set())
+        self.assertEqual(self.u1.following_among([]), set())
+
+        self.assertTrue(self.u1.is_following(self.u2))
+        self.assertFalse(self.u2.is_following(self.u1))
+        self.assertTrue(self.u2.is_followed_by(self.u1))
+        self.assertFalse(self.u1.is_followed_by(self.u2))
+
     def test_signup_user(self):
         """ Does signup user work? """
         
@@ -132,4 +149,54 @@ class UserModelTestCase(TestCase):
         u = User.authenticate("nonexistentemail@test.com", "password")
 
         #u should be False
-        self.assertFalse(u)
\ No newline at end of file
+        self.assertFalse(u)
+
+    def test_recount(self):
+        """ Does recount repair the cached counters? """
+
+        db.session.add(Follows(user_being_followed_id=self.u2.id, user_following_id=self.u1.id))
+        db.session.add(Message(text="Hello", user_id=self.u1.id))
+        db.session.commit()
+
+        # Rows written directly bypass the counters
+        self.assertEqual(self.u1.messages_count, 0)
+
+        User.recount()
+        db.session.commit()
+
+        self.assertEqual(self.u1.messages_count, 1)
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u1.followers_count, 0)
+        self.assertEqual(self.u2.followers_count, 1)
+        self.assertEqual(self.u2.likes_count, 0)
+
+    def test_authenticate_rehashes(self):
+        """ Are hashes with an outdated cost upgraded on login? """
+
+        self.u1.password = bcrypt.generate_password_hash("password", 4).decode('UTF-8')
+        db.session.commit()
+
+        u = User.authenticate(self.u1.username, "password")
+        db.session.commit()
+
+        self.assertEqual(u, self.u1)
+        self.assertEqual(hash_cost(self.u1.password), hasher.rounds)
+        self.assertTrue(bcrypt.check_password_hash(self.u1.password, "password"))
+
+    def test_password_queue_full(self):
+        """ Do password operations fail fast when the queue is full? """
+
+        full = PasswordHasher(rounds=4, workers=1, max_pending=0)
+
+        with self.assertRaises(PasswordQueueFull):
+            full.hash("password")
+
+        free = PasswordHasher(rounds=4, workers=1, max_pending=1)
+        self.assertTrue(free.check(free.hash("password"), "password"))
+        self.assertFalse(free.needs_rehash(free.hash("password")))
+
+    def test_calibrate(self):
+        """ Does calibration stay within bounds? """
+
+        self.assertEqual(calibrate(0, min_rounds=4), 4)
+        self.assertEqual(calibrate(10 ** 9, min_rounds=4, max_rounds=6), 6)
@@ -1,23 +1,33 @@
 """ User views tests """
 
 import os
+import re
+import shutil
+import tempfile
 from unittest import TestCase
 from flask import session
+from sqlalchemy.dialects import postgresql
 
-from models import db, User, Message, Follows, Likes
+import search
+from fragments import cache
+from models import db, User, Message, Follows, Likes, TimelineEntry
+from search import has_trigrams, install_search_indexes, trigram_search
+from testing import QueryBudgetMixin
 
 os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, CURR_USER_NAV_KEY
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
 
-class UserViewTestCase(TestCase):
+class UserViewTestCase(QueryBudgetMixin, TestCase):
 	"""Test views for users """
 
 	def setUp(self):
 		db.drop_all()
 		db.create_all()
+		cache.clear()
 
 		u1 = User.signup("testuser", "testing@test.com", "password", None)
 		u2 = User.signup("testuser2", "testing2@test.com", "password", None)
@@ -29,6 +39,9 @@ class UserViewTestCase(TestCase):
 		m.id=12345
 
 		u2.messages.append(m)
+		db.session.flush()
+		User.recount()
+		TimelineEntry.rebuild()
 		db.session.commit()
 
 		self.u1_id = u1.id
@@ -49,6 +62,76 @@ class UserViewTestCase(TestCase):
 		self.assertEqual(resp.status_code, 200)
 		self.assertIn(f'<p>@{self.u1.username}</p>', html)
 	
+	def test_search_users(self):
+		""" Test user search ranks and pages results """
+
+		for name in ['xtestuserx', 'testuser_b', 'test%user']:
+			db.session.add(User(username=name, email=f'{name}@test.com', password='x'))
+		db.session.commit()
+
+		app.config['USER_SEARCH_PAGE_SIZE'] = 3
+		try:
+			resp = self.client.get('/users?q=testuser')
+			html = resp.get_data(as_text=True)
+
+			self.assertEqual(resp.status_code, 200)
+			# Exact match first, then prefix matches, then substrings
+			self.assertLess(html.index('<p>@testuser</p>'), html.index('<p>@testuser2</p>'))
+			self.assertLess(html.index('<p>@testuser2</p>'), html.index('<p>@testuser_b</p>'))
+			self.assertNotIn('<p>@xtestuserx</p>', html)
+			self.assertNotIn('<p>@test%user</p>', html)
+			self.assertIn('page=2', html)
+
+			resp = self.client.get('/users?q=testuser&page=2')
+			html = resp.get_data(as_text=True)
+			self.assertIn('<p>@xtestuserx</p>', html)
+			self.assertNotIn('page=3', html)
+
+			# Wildcards in the search term match literally
+			resp = self.client.get('/users?q=t%25u')
+			html = resp.get_data(as_text=True)
+			self.assertIn('<p>@test%user</p>', html)
+			self.assertNotIn('<p>@testuser</p>', html)
+		finally:
+			app.config['USER_SEARCH_PAGE_SIZE'] = 24
+
+	def test_trigram_search_sql(self):
+		""" Test the trigram operator survives psycopg2's placeholders """
+
+		match, ranking = trigram_search('testuser')
+		sql = str(match.compile(dialect=postgresql.psycopg2.dialect()))
+
+		self.assertIn('users.username %% %(username_1)s', sql)
+
+	def test_search_users_trigrams(self):
+		""" Test user search with pg_trgm installed """
+
+		available = db.session.execute(
+			"SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'").scalar()
+		db.session.rollback()
+		if not available:
+			self.skipTest('pg_trgm is not available on this server')
+
+		db.session.add(User(username='testusr', email='testusr@test.com', password='x'))
+		db.session.commit()
+
+		self.assertTrue(install_search_indexes())
+		try:
+			self.assertTrue(has_trigrams())
+
+			resp = self.client.get('/users?q=testuser')
+			html = resp.get_data(as_text=True)
+
+			self.assertEqual(resp.status_code, 200)
+			# Exact match first; close misspellings match too
+			self.assertLess(html.index('<p>@testuser</p>'), html.index('<p>@testuser2</p>'))
+			self.assertIn('<p>@testusr</p>', html)
+		finally:
+			db.session.rollback()
+			db.session.execute("DROP EXTENSION IF EXISTS pg_trgm CASCADE")
+			db.session.commit()
+			search._trigram_support.clear()
+
 	def test_show_user_view(self):
 		""" Test user detail view """
 		resp = self.client.get(f'/users/{self.u1.id}')
@@ -57,6 +140,111 @@ class UserViewTestCase(TestCase):
 		self.assertEqual(resp.status_code, 200)
 		self.assertIn(f'<h4 id="sidebar-username">@{self.u1.username}</h4>', html)
 	
+	def test_show_user_view_invalidation(self):
+		""" Test cached profile fragments are refreshed by writes """
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		self.assertIn('Test post', resp.get_data(as_text=True))
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2_id
+
+		self.client.post('/messages/new', data={'text': 'Fresh post'})
+		self.client.post(f'/messages/{self.m.id}/delete')
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		html = resp.get_data(as_text=True)
+		self.assertIn('Fresh post', html)
+		self.assertNotIn('Test post', html)
+		self.assertIn(f'<a href="/users/{self.u2_id}">1</a>', html)
+
+		# The viewer's own header is cached apart from other viewers'
+		self.assertIn('Edit Profile', html)
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		html = resp.get_data(as_text=True)
+		self.assertNotIn('Edit Profile', html)
+		self.assertIn(f'action="/users/stop-following/{self.u2_id}"', html)
+
+	def test_show_user_versioned_fragments(self):
+		""" Test cached profile fragments follow writes made elsewhere """
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		self.assertIn('Test post', resp.get_data(as_text=True))
+
+		# As another worker would: nothing invalidates this process's cache
+		db.session.add(Message(text='Elsewhere post', user_id=self.u2_id))
+		User.bump_counts(self.u2_id, messages=1)
+		db.session.commit()
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		html = resp.get_data(as_text=True)
+		self.assertIn('Elsewhere post', html)
+		self.assertIn(f'<a href="/users/{self.u2_id}">2</a>', html)
+
+	def test_show_user_conditional_get(self):
+		""" Test profile pages answer conditional requests with 304 """
+
+		resp = self.client.get(f'/users/{self.u2_id}')
+		etag = resp.headers['ETag']
+		last_modified = resp.headers['Last-Modified']
+		self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+		resp = self.client.get(f'/users/{self.u2_id}', headers={'If-None-Match': etag})
+		self.assertEqual(resp.status_code, 304)
+		self.assertEqual(resp.headers['ETag'], etag)
+
+		resp = self.client.get(f'/users/{self.u2_id}',
+			headers={'If-Modified-Since': last_modified})
+		self.assertEqual(resp.status_code, 304)
+
+		# Logging in changes the page chrome
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2_id
+
+		resp = self.client.get(f'/users/{self.u2_id}', headers={'If-None-Match': etag})
+		self.assertEqual(resp.status_code, 200)
+
+		# Even for clients that only send If-Modified-Since
+		resp = self.client.get(f'/users/{self.u2_id}',
+			headers={'If-Modified-Since': last_modified})
+		self.assertEqual(resp.status_code, 200)
+		self.assertIn('Edit Profile', resp.get_data(as_text=True))
+		etag = resp.headers['ETag']
+		last_modified = resp.headers['Last-Modified']
+
+		resp = self.client.get(f'/users/{self.u2_id}',
+			headers={'If-Modified-Since': last_modified})
+		self.assertEqual(resp.status_code, 304)
+
+		# So does posting a message
+		self.client.post('/messages/new', data={'text': 'Fresh post'})
+		resp = self.client.get(f'/users/{self.u2_id}', headers={'If-None-Match': etag})
+		self.assertEqual(resp.status_code, 200)
+		self.assertIn('Fresh post', resp.get_data(as_text=True))
+		last_modified = resp.headers['Last-Modified']
+
+		# And logging out
+		self.client.get('/logout')
+		resp = self.client.get(f'/users/{self.u2_id}',
+			headers={'If-Modified-Since': last_modified})
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotIn('Edit Profile', resp.get_data(as_text=True))
+
+	def test_fingerprinted_static(self):
+		""" Test static assets get fingerprinted, long-lived URLs """
+
+		resp = self.client.get('/signup')
+		html = resp.get_data(as_text=True)
+		self.assertIn('/static/stylesheets/style.css?v=', html)
+
+		start = html.index('/static/stylesheets/style.css?v=')
+		url = html[start:html.index('"', start)]
+		resp = self.client.get(url)
+		self.assertIn('immutable', resp.headers['Cache-Control'])
+
 	def test_show_following(self):
 		"""Test user following"""
 
@@ -70,6 +258,7 @@ class UserViewTestCase(TestCase):
 		# Make sure user can see its own followers				
 		self.assertEqual(resp.status_code, 200)
 		self.assertIn(f'<p>@{self.u2.username}</p>', html)
+		self.assertIn(f'action="/users/stop-following/{self.u2.id}"', html)
 
 		# Make sure logged in users can see other followers
 		resp = self.client.get(f'/users/{self.u2.id}/following')
@@ -157,6 +346,181 @@ class UserViewTestCase(TestCase):
 		# Should redirect to front page
 		self.assertIn('<p>Sign up now to get your own personalized timeline!</p>', html)
 	
+	def test_stat_counters(self):
+		""" Test follow, like and message routes keep counters in sync """
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2_id
+
+		self.client.post(f'/users/follow/{self.u1_id}')
+		self.client.post(f'/users/add_like/{self.m.id}')
+		self.client.post('/messages/new', data={'text': 'Another post'})
+
+		u1 = User.query.get(self.u1_id)
+		u2 = User.query.get(self.u2_id)
+		self.assertEqual(u1.followers_count, 1)
+		self.assertEqual(u2.following_count, 1)
+		self.assertEqual(u2.followers_count, 1)
+		self.assertEqual(u2.likes_count, 1)
+		self.assertEqual(u2.messages_count, 2)
+
+		res = self.client.get(f'/users/{self.u2_id}')
+		html = res.get_data(as_text=True)
+		self.assertIn(f'<a href="/users/{self.u2_id}/likes">1</a>', html)
+
+		self.client.post(f'/users/stop-following/{self.u1_id}')
+		self.client.post(f'/users/remove_like/{self.m.id}')
+		self.client.post(f'/messages/{self.m.id}/delete')
+
+		u1 = User.query.get(self.u1_id)
+		u2 = User.query.get(self.u2_id)
+		self.assertEqual(u1.followers_count, 0)
+		self.assertEqual(u2.following_count, 0)
+		self.assertEqual(u2.likes_count, 0)
+		self.assertEqual(u2.messages_count, 1)
+
+	def test_delete_user_counters(self):
+		""" Test deleting a user updates the counters of related users """
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		self.client.post(f'/users/add_like/{self.m.id}')
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2_id
+
+		self.client.post(f'/messages/{self.m.id}/delete')
+		self.client.post('/users/delete')
+
+		u1 = User.query.get(self.u1_id)
+		self.assertEqual(u1.following_count, 0)
+		self.assertEqual(u1.likes_count, 0)
+
+	def test_homepage_timeline(self):
+		""" Test homepage shows followed users' messages """
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1.id
+
+		res = self.client.get('/')
+		html = res.get_data(as_text=True)
+
+		self.assertEqual(res.status_code, 200)
+		self.assertIn('Test post', html)
+
+	def test_homepage_pagination(self):
+		""" Test homepage pages through the timeline newest first """
+
+		app.config['TIMELINE_PAGE_SIZE'] = 2
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2_id
+
+		self.client.post(f'/messages/{self.m.id}/delete')
+		for i in range(5):
+			self.client.post('/messages/new', data={'text': f'Hello {i}'})
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		try:
+			page = TimelineEntry.page_for(self.u1, limit=2)
+			self.assertEqual([m.text for m in page.items], ['Hello 4', 'Hello 3'])
+			self.assertIsNone(page.newer)
+
+			res = self.client.get(f'/?before={page.older}')
+			html = res.get_data(as_text=True)
+			self.assertEqual(res.status_code, 200)
+			self.assertLess(html.index('Hello 2'), html.index('Hello 1'))
+			self.assertNotIn('Hello 3', html)
+
+			older = TimelineEntry.page_for(self.u1, limit=2, before=page.older)
+			newer = TimelineEntry.page_for(self.u1, limit=2, after=older.newer)
+			self.assertEqual([m.text for m in newer.items], ['Hello 4', 'Hello 3'])
+			self.assertIsNone(newer.newer)
+
+			res = self.client.get('/?before=not-a-cursor')
+			self.assertEqual(res.status_code, 400)
+		finally:
+			app.config['TIMELINE_PAGE_SIZE'] = 100
+
+	def test_follow_and_unfollow_timeline(self):
+		""" Test follow backfills and unfollow prunes the timeline """
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u2.id
+
+		self.client.post(f'/users/follow/{self.u1_id}')
+		m = Message(text='Post by u1', user_id=self.u1_id)
+		db.session.add(m)
+		db.session.commit()
+
+		# Messages written outside the routes aren't fanned out
+		self.assertEqual(TimelineEntry.query.filter_by(user_id=self.u2_id).count(), 0)
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		self.client.post(f'/users/stop-following/{self.u2_id}')
+		self.assertEqual(TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 0)
+
+		self.client.post(f'/users/follow/{self.u2_id}')
+		entries = TimelineEntry.query.filter_by(user_id=self.u1_id).all()
+		self.assertEqual([e.message_id for e in entries], [self.m.id])
+
+	def test_repeated_follow_and_like(self):
+		""" Test following or liking twice only counts once """
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		# u1 already follows u2
+		self.client.post(f'/users/follow/{self.u2_id}')
+		self.client.post(f'/users/add_like/{self.m.id}')
+		res = self.client.post(f'/users/add_like/{self.m.id}')
+
+		self.assertEqual(res.status_code, 302)
+		self.assertEqual(Follows.query.count(), 1)
+		self.assertEqual(Likes.query.count(), 1)
+		self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
+		self.assertEqual(User.query.get(self.u1_id).likes_count, 1)
+		self.assertEqual(Message.query.get(self.m.id).likes_count, 1)
+
+		self.client.post(f'/users/stop-following/{self.u2_id}')
+		self.client.post(f'/users/stop-following/{self.u2_id}')
+		self.client.post(f'/users/remove_like/{self.m.id}')
+		self.client.post(f'/users/remove_like/{self.m.id}')
+
+		db.session.expire_all()
+		self.assertEqual(User.query.get(self.u1_id).following_count, 0)
+		self.assertEqual(User.query.get(self.u2_id).followers_count, 0)
+		self.assertEqual(User.query.get(self.u1_id).likes_count, 0)
+		self.assertEqual(Message.query.get(self.m.id).likes_count, 0)
+
+	def test_write_query_budget(self):
+		""" Test write routes don't load the user's follows or messages """
+
+		self.add_users(10, followed_by=self.u1_id)
+		m_id = self.m.id
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		with self.assertMaxQueries(6):
+			self.client.post(f'/users/stop-following/{self.u2_id}')
+
+		with self.assertMaxQueries(10):
+			self.client.post(f'/users/follow/{self.u2_id}')
+
+		with self.assertMaxQueries(5):
+			self.client.post(f'/users/add_like/{m_id}')
+
+		with self.assertMaxQueries(6):
+			self.client.post('/messages/new', data={'text': 'Constant'})
+
+		self.assertEqual(User.query.get(self.u1_id).following_count, 11)
+
 	def test_login_logout(self):
 		""" Test login and logout"""
 
@@ -204,6 +568,199 @@ class UserViewTestCase(TestCase):
 
 		self.assertIn('<h2 class="join-message">Welcome back.</h2>', html)
 
+	def test_lazy_current_user(self):
+		""" Test requests that don't use the current user skip loading it """
+
+		self.client.post('/login',
+			data={'username': self.u1.username, 'password': 'password'})
+
+		with self.assertMaxQueries(0):
+			res = self.client.get('/static/stylesheets/style.css')
+			self.assertEqual(res.status_code, 200)
+			res = self.client.get('/signup')
+			self.assertIn(f'/users/{self.u1_id}', res.get_data(as_text=True))
+
+	def test_server_timing(self):
+		""" Test responses report their SQL and render time """
+
+		res = self.client.get(f'/users/{self.u1_id}')
+		timing = res.headers['Server-Timing']
+
+		self.assertRegex(timing, r'db;dur=[0-9.]+;desc="[0-9]+ queries"')
+		self.assertRegex(timing, r'render;dur=[0-9.]+')
+		self.assertRegex(timing, r'total;dur=[0-9.]+')
+
+	def test_profiles_admin_only(self):
+		""" Test only admins can list and download request profiles """
+
+		store = app.extensions['profiles']
+		old_directory = store.directory
+		store.directory = tempfile.mkdtemp()
+		store.save('20200101T000000.000000-GET-root-5ms.txt',
+			lambda path: open(path, 'w').write('app.py:homepage 1\n'))
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		try:
+			res = self.client.get('/admin/profiles')
+			self.assertEqual(res.status_code, 302)
+
+			app.config['ADMIN_USER_IDS'] = [self.u1_id]
+			res = self.client.get('/admin/profiles')
+			self.assertIn('20200101T000000.000000-GET-root-5ms.txt', res.get_data(as_text=True))
+
+			res = self.client.get('/admin/profiles/20200101T000000.000000-GET-root-5ms.txt')
+			self.assertEqual(res.get_data(as_text=True), 'app.py:homepage 1\n')
+			res.close()
+
+			res = self.client.get('/admin/profiles/..%2Fapp.py')
+			self.assertEqual(res.status_code, 404)
+
+			with self.client.session_transaction() as session:
+				session[CURR_USER_KEY] = self.u2_id
+
+			res = self.client.get('/admin/profiles')
+			self.assertEqual(res.status_code, 302)
+		finally:
+			app.config['ADMIN_USER_IDS'] = []
+			shutil.rmtree(store.directory)
+			store.directory = old_directory
+
+	def add_users(self, count, follow=None, followed_by=None):
+		""" Add `count` users with a message each, following or followed """
+
+		for n in range(count):
+			user = User(username=f'extra{n}', email=f'extra{n}@test.com', password='x')
+			user.messages.append(Message(text=f'Extra post {n}'))
+			db.session.add(user)
+			if follow:
+				user.following.append(User.query.get(follow))
+			if followed_by:
+				User.query.get(followed_by).following.append(user)
+
+		db.session.flush()
+		User.recount()
+		TimelineEntry.rebuild()
+		db.session.commit()
+
+	def test_homepage_query_budget(self):
+		""" Test the timeline doesn't query once per author """
+
+		self.add_users(10, followed_by=self.u1_id)
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		# User, timeline, likes, and the suggestions panel until it's cached
+		with self.assertMaxQueries(4):
+			res = self.client.get('/')
+
+		self.assertIn('Extra post 9', res.get_data(as_text=True))
+
+		with self.assertMaxQueries(3):
+			self.client.get('/')
+
+	def test_followers_query_budget(self):
+		""" Test the followers page doesn't query once per follower """
+
+		self.add_users(10, follow=self.u2_id)
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		with self.assertMaxQueries(4):
+			res = self.client.get(f'/users/{self.u2_id}/followers')
+
+		self.assertIn('<p>@extra9</p>', res.get_data(as_text=True))
+
+	def test_followers_pagination(self):
+		""" Test the followers page pages through followers by descending id """
+
+		self.add_users(10, follow=self.u2_id)
+		names = [name for (name,) in db.session
+			.query(User.username)
+			.join(Follows, Follows.user_following_id == User.id)
+			.filter(Follows.user_being_followed_id == self.u2_id)
+			.order_by(User.id.desc())]
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		def shown(html, names):
+			positions = [html.index(f'<p>@{name}</p>') for name in names]
+			self.assertEqual(positions, sorted(positions))
+
+		app.config['LIST_PAGE_SIZE'] = 4
+		try:
+			res = self.client.get(f'/users/{self.u2_id}/followers')
+			html = res.get_data(as_text=True)
+			shown(html, names[:4])
+			self.assertNotIn(f'<p>@{names[4]}</p>', html)
+
+			older = re.search(r'before=([\w-]+)', html).group(1)
+			res = self.client.get(f'/users/{self.u2_id}/followers?before={older}')
+			html = res.get_data(as_text=True)
+			shown(html, names[4:8])
+			self.assertNotIn(f'<p>@{names[3]}</p>', html)
+			self.assertNotIn(f'<p>@{names[8]}</p>', html)
+			self.assertIn('after=', html)
+
+			res = self.client.get(f'/users/{self.u2_id}/followers?after=bad')
+			self.assertEqual(res.status_code, 400)
+		finally:
+			app.config['LIST_PAGE_SIZE'] = 48
+
+	def test_likes_and_users_pagination(self):
+		""" Test the likes and user list pages stop at the page size """
+
+		self.add_users(5)
+		for message in Message.query.all():
+			db.session.add(Likes(user_id=self.u1_id, message_id=message.id))
+		db.session.commit()
+
+		with self.client.session_transaction() as session:
+			session[CURR_USER_KEY] = self.u1_id
+
+		app.config['LIST_PAGE_SIZE'] = 3
+		try:
+			u1 = User.query.get(self.u1_id)
+			page = u1.likes_page(3)
+			self.assertEqual(len(page.items), 3)
+			self.assertIsNotNone(page.older)
+			rest = u1.likes_page(3, before=page.older)
+			self.assertEqual(len(rest.items), 3)
+			self.assertIsNone(rest.older)
+
+			html = self.client.get(f'/users/{self.u1_id}/likes').get_data(as_text=True)
+			self.assertEqual(html.count('class="message-link"'), 3)
+
+			html = self.client.get('/users').get_data(as_text=True)
+			self.assertIn('<p>@testuser2</p>', html)
+			self.assertNotIn('<p>@extra2</p>', html)
+			self.assertIn('before=', html)
+		finally:
+			app.config['LIST_PAGE_SIZE'] = 48
+
+	def test_edit_profile_refreshes_nav(self):
+		""" Test editing a profile updates the session nav snapshot """
+
+		self.client.post('/login',
+			data={'username': self.u1.username, 'password': 'password'})
+
+		res = self.client.post('/users/profile/',
+			data={'username': 'renamed', 'email': 'renamed@test.com',
+				'image_url': '/static/images/new.png', 'password': 'password'})
+		self.assertEqual(res.status_code, 302)
+
+		with self.client.session_transaction() as session:
+			self.assertEqual(session[CURR_USER_NAV_KEY]['username'], 'renamed')
+			self.assertEqual(session[CURR_USER_NAV_KEY]['image_url'], '/static/images/new.png')
+
+		self.client.get('/logout')
+		with self.client.session_transaction() as session:
+			self.assertNotIn(CURR_USER_NAV_KEY, session)
+
 # Talk to Alexander about this one
 
 	# def test_edit_profile(self):
@@ -0,0 +1,136 @@
+"""Write-behind queue tests."""
+
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from fragments import cache
+from models import db, Follows, Likes, Message, TimelineEntry, User
+import write_behind
+
+os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
+
+from app import app, CURR_USER_KEY
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['LOADING_STRICT'] = True
+
+
+class WriteBehindTestCase(TestCase):
+    """Test follow/like toggles are queued, coalesced and applied."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        cache.clear()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.saved = (write_behind.queue.path,
+                      app.config['WRITE_BEHIND_ENABLED'],
+                      app.config['WRITE_BEHIND_INTERVAL'])
+        write_behind.queue.path = os.path.join(self.tmp.name, 'queue.db')
+        app.config['WRITE_BEHIND_ENABLED'] = True
+        # Flush by hand rather than from a background thread
+        app.config['WRITE_BEHIND_INTERVAL'] = 0
+
+        u1 = User.signup("testuser", "testing@test.com", "password", None)
+        u2 = User.signup("testuser2", "testing2@test.com", "password", None)
+        db.session.flush()
+        msg = Message(text="Queued likes", user_id=u2.id)
+        db.session.add(msg)
+        db.session.commit()
+        self.u1_id, self.u2_id, self.msg_id = u1.id, u2.id, msg.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+        (write_behind.queue.path,
+         app.config['WRITE_BEHIND_ENABLED'],
+         app.config['WRITE_BEHIND_INTERVAL']) = self.saved
+        self.tmp.cleanup()
+
+    def flush(self):
+        with app.app_context():
+            return write_behind.flush()
+
+    def test_flusher_starts_without_toggles(self):
+        """ Is the queue flushed in processes that haven't toggled yet? """
+
+        app.config['WRITE_BEHIND_INTERVAL'] = 1
+
+        with mock.patch.object(write_behind.flusher,
+                               'ensure_running') as ensure_running:
+            write_behind.start_flusher(app)
+            ensure_running.assert_called_once_with(app)
+
+            # Each request checks too, for workers forked after startup
+            self.client.get('/')
+            self.assertEqual(ensure_running.call_count, 2)
+
+            app.config['WRITE_BEHIND_ENABLED'] = False
+            self.client.get('/')
+            self.assertEqual(ensure_running.call_count, 2)
+
+    def test_toggles_coalesce(self):
+        """ Does toggling a like many times leave one queued state? """
+
+        for _ in range(3):
+            self.client.post(f'/users/add_like/{self.msg_id}')
+            self.client.post(f'/users/remove_like/{self.msg_id}')
+        self.client.post(f'/users/add_like/{self.msg_id}')
+
+        self.assertEqual(len(write_behind.queue), 1)
+        self.assertEqual(Likes.query.count(), 0)
+
+    def test_pending_like_shown(self):
+        """ Does the user see their queued like before it's applied? """
+
+        # Make the message show up on the homepage
+        self.client.post(f'/users/follow/{self.u2_id}')
+        self.flush()
+        self.client.post(f'/users/add_like/{self.msg_id}')
+
+        html = self.client.get('/').get_data(as_text=True)
+        self.assertIn(f'action="/users/remove_like/{self.msg_id}"', html)
+
+    def test_flush_applies_like(self):
+        """ Does flushing add the like, bump counters and empty the queue? """
+
+        self.client.post(f'/users/add_like/{self.msg_id}')
+
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(len(write_behind.queue), 0)
+        self.assertEqual(Likes.query.count(), 1)
+        self.assertEqual(User.query.get(self.u1_id).likes_count, 1)
+
+    def test_follow_unfollow_follow(self):
+        """ Does the last of several follow toggles win when flushed? """
+
+        self.client.post(f'/users/follow/{self.u2_id}')
+        self.client.post(f'/users/stop-following/{self.u2_id}')
+        self.client.post(f'/users/follow/{self.u2_id}')
+
+        self.assertEqual(self.flush(), 1)
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+        self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
+        self.assertEqual(
+            [e.message_id for e in
+             TimelineEntry.query.filter_by(user_id=self.u1_id)],
+            [self.msg_id])
+
+    def test_flush_is_idempotent(self):
+        """ Does applying an existing follow again leave counters alone? """
+
+        self.client.post(f'/users/follow/{self.u2_id}')
+        self.flush()
+        self.client.post(f'/users/follow/{self.u2_id}')
+        self.flush()
+
+        self.assertEqual(Follows.query.count(), 1)
+        self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+        self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
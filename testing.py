@@ -0,0 +1,24 @@
+"""Helpers shared by Warbler's tests."""
+
+from contextlib import contextmanager
+
+from instrumentation import count_queries
+
+
+class QueryBudgetMixin:
+    """TestCase mixin for checking how many SQL statements code runs.
+
+        with self.assertMaxQueries(5):
+            self.client.get('/')
+    """
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with count_queries() as stats:
+            yield stats
+
+        if stats.count > budget:
+            statements = '\n'.join(f'{n}. {statement}' for n, statement
+                                   in enumerate(stats.statements, 1))
+            self.fail(f"Ran {stats.count} queries, over the budget of "
+                      f"{budget}:\n{statements}")
@@ -0,0 +1,280 @@
+"""Write-behind queue for follow and like toggles.
+
+When WRITE_BEHIND_ENABLED is on, the follow/unfollow and like/unlike
+routes don't touch the main database. They record the state the user
+asked for in a small SQLite file (WRITE_BEHIND_PATH) and answer
+straight away. Only the latest state per (user, kind, target) is kept,
+so someone toggling a like ten times leaves one row.
+
+Every WRITE_BEHIND_INTERVAL seconds a background thread in each process
+applies up to WRITE_BEHIND_BATCH queued states in one transaction. The
+thread starts with the app (and in each forked worker on its first
+request), so states left queued by a restart are applied without waiting
+for someone to toggle again. Inserts
+skip rows that already exist and deletes skip rows that are already gone.
+Counters and timelines are only touched for rows that actually changed,
+so applying a state twice (two workers racing, or a retry after a crash)
+is harmless. Rows re-queued while a batch was being applied stay queued.
+
+Until then, the user's own pages overlay their queued states on what the
+database says: follow buttons and like buttons and counts on the pages
+that show them. Other users see the change once it's flushed. `flask
+flush-writes` drains the queue by hand, e.g. before a deploy.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+
+import fragments
+from models import db, Follows, Likes, LikeSummary
+
+FOLLOW = 'follow'
+LIKE = 'like'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    user_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    target_id INTEGER NOT NULL,
+    active INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    PRIMARY KEY (user_id, kind, target_id)
+)
+"""
+
+
+class WriteBehindQueue:
+    """Latest requested state per (user, kind, target), kept in SQLite."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # sqlite3 connections can't be shared between threads (or across
+        # a fork), so each thread of each process opens its own.
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None or self._local.key != (os.getpid(), self.path):
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=FULL")
+            conn.execute(SCHEMA)
+            self._local.conn = conn
+            self._local.key = (os.getpid(), self.path)
+
+        return conn
+
+    def record(self, user_id, kind, target_id, active):
+        """Queue `user_id`'s wish to have (or not have) this follow/like."""
+
+        self._connection().execute(
+            "INSERT INTO pending VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id, kind, target_id) DO UPDATE SET "
+            "active = excluded.active, version = excluded.version",
+            (user_id, kind, target_id, int(active), time.time_ns()))
+
+    def pending(self, user_id, kind):
+        """{target_id: active} of `user_id`'s queued states of one kind."""
+
+        rows = self._connection().execute(
+            "SELECT target_id, active FROM pending "
+            "WHERE user_id = ? AND kind = ?", (user_id, kind))
+
+        return {target_id: bool(active) for target_id, active in rows}
+
+    def latest(self, user_id):
+        """When `user_id` last queued anything still pending, or 0."""
+
+        return self._connection().execute(
+            "SELECT coalesce(max(version), 0) FROM pending WHERE user_id = ?",
+            (user_id,)).fetchone()[0]
+
+    def take(self, limit):
+        """Up to `limit` queued states, oldest first (left queued)."""
+
+        return self._connection().execute(
+            "SELECT user_id, kind, target_id, active, version FROM pending "
+            "ORDER BY version LIMIT ?", (limit,)).fetchall()
+
+    def done(self, rows):
+        """Drop applied rows, unless they were re-queued meanwhile."""
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        conn.executemany(
+            "DELETE FROM pending WHERE user_id = ? AND kind = ? "
+            "AND target_id = ? AND version = ?",
+            [(user_id, kind, target_id, version)
+             for user_id, kind, target_id, _, version in rows])
+        conn.execute("COMMIT")
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT count(*) FROM pending").fetchone()[0]
+
+
+queue = WriteBehindQueue()
+
+
+def apply_follow(user_id, followed_id, active):
+    if active:
+        Follows.add(user_id, followed_id)
+    else:
+        Follows.remove(user_id, followed_id)
+
+
+def apply_like(user_id, message_id, active):
+    if active:
+        Likes.add(user_id, message_id)
+    else:
+        Likes.remove(user_id, message_id)
+
+
+APPLY = {FOLLOW: apply_follow, LIKE: apply_like}
+
+
+def flush(limit=500):
+    """Apply up to `limit` queued states in one transaction.
+
+    Returns how many were applied. Call it in an app context.
+    """
+
+    rows = queue.take(limit)
+    if not rows:
+        return 0
+
+    try:
+        for user_id, kind, target_id, active, _ in rows:
+            APPLY[kind](user_id, target_id, bool(active))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    queue.done(rows)
+
+    tags = set()
+    for user_id, kind, target_id, _, _ in rows:
+        tags.add(f'profile:{user_id}')
+        if kind == FOLLOW:
+            tags.add(f'profile:{target_id}')
+    fragments.cache.invalidate(*tags)
+
+    return len(rows)
+
+
+def with_pending(user_id, kind, current, candidates):
+    """`current` target ids with `user_id`'s queued states applied.
+
+    Only targets in `candidates` are considered, like the query that
+    produced `current`.
+    """
+
+    for target_id, active in queue.pending(user_id, kind).items():
+        if target_id not in candidates:
+            continue
+        if active:
+            current.add(target_id)
+        else:
+            current.discard(target_id)
+
+    return current
+
+
+def likes_with_pending(user_id, likes, message_ids):
+    """A `LikeSummary` with `user_id`'s queued likes applied to it."""
+
+    liked = with_pending(user_id, LIKE, set(likes.liked), set(message_ids))
+    counts = dict(likes.counts)
+
+    for message_id in liked ^ likes.liked:
+        counts[message_id] = (counts.get(message_id, 0)
+                              + (1 if message_id in liked else -1))
+
+    return LikeSummary(liked=liked, counts=counts)
+
+
+class Flusher:
+    """Background thread flushing the queue every `interval` seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def ensure_running(self, app):
+        # Threads don't survive a fork; each worker process starts its own.
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, args=(app,),
+                                 name='write-behind', daemon=True).start()
+
+    def _run(self, app):
+        interval = app.config['WRITE_BEHIND_INTERVAL']
+        batch = app.config['WRITE_BEHIND_BATCH']
+
+        while True:
+            time.sleep(interval)
+
+            with app.app_context():
+                try:
+                    while flush(batch) == batch:
+                        pass
+                except Exception:
+                    app.logger.exception("Write-behind flush failed")
+                finally:
+                    db.session.remove()
+
+
+flusher = Flusher()
+
+
+def start_flusher(app):
+    """Make sure this process is flushing the queue, if it should be."""
+
+    if (app.config['WRITE_BEHIND_ENABLED']
+            and app.config['WRITE_BEHIND_INTERVAL'] > 0):
+        flusher.ensure_running(app)
+
+
+def record(app, user_id, kind, target_id, active):
+    """Queue a state and make sure this process is flushing the queue."""
+
+    queue.record(user_id, kind, target_id, active)
+    start_flusher(app)
+
+
+def init_app(app):
+    """Configure the queue, start flushing it, and add `flask flush-writes`.
+
+    You should call this in your Flask app.
+    """
+
+    queue.path = (app.config.get('WRITE_BEHIND_PATH')
+                  or os.path.join(app.instance_path, 'write_behind.sqlite3'))
+
+    start_flusher(app)
+    # ensure_running is a pid check once started, so this only does work
+    # in a worker forked after init_app ran.
+    app.before_request(lambda: start_flusher(app))
+
+    @app.cli.command('flush-writes')
+    def flush_writes():
+        """Apply every queued follow and like change now."""
+
+        total = 0
+        batch = app.config['WRITE_BEHIND_BATCH']
+
+        while True:
+            applied = flush(batch)
+            total += applied
+            if applied < batch:
+                break
+
+        print(f"Applied {total} queued changes.")